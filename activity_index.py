@@ -0,0 +1,177 @@
+import bisect
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from economy import persisted_player
+from locks import player_locks
+from timestamps import to_epoch
+
+
+class ActivityIndex:
+    """Упорядоченный по времени индекс last_login.
+
+    entries - отсортированный список (timestamp, user_id), поэтому выборка
+    неактивных игроков и подсчет активных за период - это бинарный поиск,
+    а не разбор ISO строк всех игроков.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.by_user = {}
+
+    def attach(self, database):
+        """Построить индекс по базе и подписаться на ее изменения"""
+        self.rebuild(database.players)
+        database.add_listener(self.on_change)
+
+    def on_change(self, op, user_id, player, fields):
+        if op == "reset":
+            self.rebuild(player)
+        elif op == "delete":
+            self.remove(user_id)
+        elif player is not None and (fields is None or 'last_login' in fields):
+            self.update(user_id, player.get('last_login'))
+
+    def rebuild(self, players):
+        entries = []
+        by_user = {}
+        for user_id, player in list(players.items()):
+            value = player.get('last_login')
+            try:
+                ts = to_epoch(value)
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if ts is None:
+                continue
+            entries.append((ts, user_id))
+            by_user[user_id] = (value, ts)
+        entries.sort()
+
+        with self.lock:
+            self.entries = entries
+            self.by_user = by_user
+
+    def update(self, user_id, value):
+        with self.lock:
+            current = self.by_user.get(user_id)
+            # Строка не менялась - разбирать ее повторно не нужно
+            if current is not None and current[0] == value:
+                return
+            try:
+                ts = to_epoch(value)
+            except (TypeError, ValueError, AttributeError):
+                ts = None
+
+            if current is not None:
+                self._remove_entry(current[1], user_id)
+            if ts is None:
+                self.by_user.pop(user_id, None)
+                return
+            bisect.insort(self.entries, (ts, user_id))
+            self.by_user[user_id] = (value, ts)
+
+    def remove(self, user_id):
+        with self.lock:
+            current = self.by_user.pop(user_id, None)
+            if current is not None:
+                self._remove_entry(current[1], user_id)
+
+    def _remove_entry(self, ts, user_id):
+        index = bisect.bisect_left(self.entries, (ts, user_id))
+        if index < len(self.entries) and self.entries[index] == (ts, user_id):
+            del self.entries[index]
+
+    def inactive_since(self, cutoff_ts, limit=None):
+        """user_id игроков, последний вход которых был раньше cutoff_ts (самые старые первыми)"""
+        with self.lock:
+            end = bisect.bisect_left(self.entries, (cutoff_ts, ""))
+            if limit is not None:
+                end = min(end, limit)
+            return [user_id for _, user_id in self.entries[:end]]
+
+    def count_inactive(self, cutoff_ts):
+        with self.lock:
+            return bisect.bisect_left(self.entries, (cutoff_ts, ""))
+
+    def count_active_since(self, since_ts):
+        with self.lock:
+            return len(self.entries) - bisect.bisect_left(self.entries, (since_ts, ""))
+
+    def get_stats(self, now=None):
+        now = now or time.time()
+        return {
+            "indexed_players": len(self.entries),
+            "daily_active": self.count_active_since(now - 86400),
+            "weekly_active": self.count_active_since(now - 7 * 86400),
+            "monthly_active": self.count_active_since(now - 30 * 86400),
+            "oldest_login": datetime.fromtimestamp(self.entries[0][0]).isoformat() if self.entries else None
+        }
+
+
+def is_inactive(player, cutoff_ts):
+    """Последний вход игрока был раньше cutoff_ts"""
+    try:
+        ts = to_epoch(player.get('last_login'))
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return ts is not None and ts < cutoff_ts
+
+
+def archive_inactive_players(database, index, days=30, batch_size=500,
+                             archive_dir="archive", archive=True):
+    """Перенести неактивных игроков в холодный архив пачками.
+
+    Каждая пачка дописывается отдельным gzip-блоком в archive/inactive_players.jsonl.gz,
+    данные игроков сохраняются на диск один раз в конце.
+    """
+    cutoff_ts = time.time() - days * 86400
+    archive_file = os.path.join(archive_dir, "inactive_players.jsonl.gz")
+    removed_count = 0
+
+    while True:
+        batch = index.inactive_since(cutoff_ts, limit=batch_size)
+        if not batch:
+            break
+
+        # Игрок мог войти между выборкой из индекса и удалением: под его блокировкой
+        # перечитываем запись и удаляем только тех, кто по-прежнему неактивен
+        with player_locks.hold(*batch):
+            lines = []
+            expired = []
+            for user_id in batch:
+                player = database.get_player_data(user_id)
+                if player is None:
+                    # Игрока уже нет в базе - убираем его из индекса, чтобы не зациклиться
+                    index.remove(user_id)
+                    continue
+                if not is_inactive(player, cutoff_ts):
+                    index.update(user_id, player.get('last_login'))
+                    continue
+                expired.append(user_id)
+                if archive:
+                    lines.append(json.dumps({
+                        "user_id": user_id,
+                        "archived_at": datetime.now().isoformat(),
+                        "data": persisted_player(player)
+                    }, ensure_ascii=False))
+
+            if lines:
+                os.makedirs(archive_dir, exist_ok=True)
+                with gzip.open(archive_file, 'at', encoding='utf-8') as f:
+                    f.write("\n".join(lines) + "\n")
+
+            for user_id in expired:
+                if database.delete_player(user_id, save=False):
+                    removed_count += 1
+                else:
+                    index.remove(user_id)
+
+    if removed_count > 0:
+        database.save_data()
+
+    return removed_count
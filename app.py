@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import json
 import random
 import math
@@ -7,7 +7,30 @@ import os
 import time
 import hashlib
 import functools
+import bisect
+import zlib
+from collections import deque
 from database import db
+from locks import BACKUP_LOCK, BACKUP_OWNER, HISTORY_OWNER, MINING_OWNER, P2P_LOCK, player_locks
+from backup import BackupManager
+from activity_index import ActivityIndex, archive_inactive_players
+from player_index import PlayerIndex, SORT_KEYS
+from mining_jobs import MiningScheduler
+from http_cache import ResponseCache
+from static_pages import StaticPages
+from metrics import metrics, EconomyTotals
+from trade_history import TradeHistory
+from profiling import ProfileCaptures, SamplingProfiler, RequestProfiler
+from memory_stats import memory_tracer, deep_sizeof, player_footprint, process_memory
+from telemetry import telemetry, save_duration, save_bytes, COUNT_BUCKETS
+from timestamps import (
+    now_ts, to_epoch, to_iso, record_to_api, player_to_api, migrate_record_times, MINING_JOB_TIME_FIELDS
+)
+from candles import CandleAggregator, encode_binary, encode_compact, INTERVALS as CANDLE_INTERVALS
+from economy import (
+    CRYPTOS, MINING_CONFIG, generate_realistic_price, calculate_trading_fee,
+    update_order_book, get_current_energy, apply_mining_attempt, create_new_player_data
+)
 
 app = Flask(__name__)
 port = int(os.environ.get("PORT", 5000))
@@ -93,212 +116,105 @@ def require_admin_auth(f):
             return jsonify({"error": str(e)}), 500
     return decorated_function
 
-# Усложненная конфигурация криптовалют
-CRYPTOS = {
-    "BTC": {
-        "name": "Bitcoin", 
-        "color": "#f7931a",
-        "volatility": 0.015,
-        "base_price": 45000,
-        "emoji": "₿",
-        "mining_difficulty": 100,
-        "mining_reward": 0.0001
-    },
-    "ETH": {
-        "name": "Ethereum", 
-        "color": "#627eea",
-        "volatility": 0.018,
-        "base_price": 3000,
-        "emoji": "🔷",
-        "mining_difficulty": 80,
-        "mining_reward": 0.001
-    },
-    "BNB": {
-        "name": "Binance Coin", 
-        "color": "#f3ba2f",
-        "volatility": 0.022,
-        "base_price": 350,
-        "emoji": "💠",
-        "mining_difficulty": 60,
-        "mining_reward": 0.01
-    },
-    "XRP": {
-        "name": "Ripple", 
-        "color": "#23292f",
-        "volatility": 0.025,
-        "base_price": 0.6,
-        "emoji": "⚡",
-        "mining_difficulty": 40,
-        "mining_reward": 0.1
-    },
-    "ADA": {
-        "name": "Cardano", 
-        "color": "#0033ad",
-        "volatility": 0.020,
-        "base_price": 0.5,
-        "emoji": "🃏",
-        "mining_difficulty": 50,
-        "mining_reward": 0.05
-    },
-    "DOGE": {
-        "name": "Dogecoin", 
-        "color": "#c2a633",
-        "volatility": 0.028,
-        "base_price": 0.15,
-        "emoji": "🐕",
-        "mining_difficulty": 30,
-        "mining_reward": 1.0
-    },
-    "SOL": {
-        "name": "Solana", 
-        "color": "#00ffbd",
-        "volatility": 0.024,
-        "base_price": 100,
-        "emoji": "🔆",
-        "mining_difficulty": 45,
-        "mining_reward": 0.02
-    },
-    "DOT": {
-        "name": "Polkadot", 
-        "color": "#e6007a",
-        "volatility": 0.021,
-        "base_price": 7,
-        "emoji": "🔴",
-        "mining_difficulty": 55,
-        "mining_reward": 0.03
-    }
-}
-
-# Конфигурация майнинга
-MINING_CONFIG = {
-    "base_energy_cost": 10,
-    "energy_regeneration_rate": 0.5,
-    "max_energy": 100,
-    "mining_cooldown": 120,
-    "equipment_levels": {
-        1: {"name": "Basic GPU", "multiplier": 1.0, "cost": 1000},
-        2: {"name": "Advanced GPU", "multiplier": 1.3, "cost": 5000},
-        3: {"name": "ASIC Miner", "multiplier": 1.8, "cost": 20000},
-        4: {"name": "Mining Farm", "multiplier": 2.5, "cost": 100000},
-        5: {"name": "Industrial Farm", "multiplier": 4.0, "cost": 500000}
-    }
-}
-
-def generate_realistic_price(previous_price, volatility, symbol):
-    change = random.gauss(0, volatility)
-    mean_reversion = (CRYPTOS[symbol]["base_price"] - previous_price) * 0.0003
-    
-    change += mean_reversion
-    
-    new_price = previous_price * (1 + change)
-    new_price = max(new_price, previous_price * 0.7)
-    new_price = min(new_price, previous_price * 1.5)
-    
-    if new_price < 1:
-        return round(new_price, 4)
-    else:
-        return round(new_price, 2)
-
-def calculate_trading_fee(amount, price, order_type):
-    base_fee = 0.0025
-    if order_type == 'market':
-        base_fee += 0.0015
-    return amount * price * base_fee
-
-def initialize_order_book(symbol, base_price):
-    bids = []
-    asks = []
-    
-    spread = 0.015
-    
-    for i in range(5):
-        bid_price = base_price * (1 - spread * (i + 1))
-        ask_price = base_price * (1 + spread * (i + 1))
-        
-        bids.append({
-            "price": round(bid_price, 4 if base_price < 1 else 2),
-            "amount": round(random.uniform(0.05, 1.5), 4),
-            "total": round(bid_price * random.uniform(0.05, 1.5), 2)
-        })
-        
-        asks.append({
-            "price": round(ask_price, 4 if base_price < 1 else 2),
-            "amount": round(random.uniform(0.05, 1.5), 4),
-            "total": round(ask_price * random.uniform(0.05, 1.5), 2)
-        })
-    
-    return {"bids": bids, "asks": asks}
-
-def update_order_book(symbol, current_price):
-    return initialize_order_book(symbol, current_price)
-
-def create_new_player_data():
-    player_data = {
-        "balance": 500.00,
-        "portfolio": {symbol: 0 for symbol in CRYPTOS},
-        "portfolio_value": 0,
-        "total_value": 500.00,
-        "orders": [],
-        "price_history": {},
-        "current_prices": {},
-        "order_books": {},
-        "created_at": datetime.now().isoformat(),
-        "last_login": datetime.now().isoformat(),
-        "username": "Trader",
-        "mining": {
-            "energy": MINING_CONFIG["max_energy"],
-            "last_mining_time": datetime.now().isoformat(),
-            "equipment_level": 1,
-            "total_mined": {symbol: 0 for symbol in CRYPTOS},
-            "mining_power": 1.0
-        },
-        "stats": {
-            "total_trades": 0,
-            "total_profit": 0,
-            "daily_bonus_claimed": False,
-            "login_streak": 1,
-            "total_mining_rewards": 0
-        }
-    }
-    
-    for symbol, crypto in CRYPTOS.items():
-        price = crypto["base_price"] * random.uniform(0.95, 1.05)
-        player_data["current_prices"][symbol] = price
-        
-        history = [price]
-        for _ in range(49):
-            history.append(generate_realistic_price(history[-1], crypto["volatility"], symbol))
-        player_data["price_history"][symbol] = history
-        
-        player_data["order_books"][symbol] = initialize_order_book(symbol, price)
-    
-    return player_data
+def request_user_id(**kwargs):
+    """Игрок запроса (из пути или JSON) - ключ его блокировки"""
+    return kwargs.get('user_id') or (request.get_json(silent=True) or {}).get('user_id')
 
 class P2PManager:
     def __init__(self):
         self.orders_file = "p2p_orders.json"
+        # В режиме общего хранилища ордера и версия стакана общие для всех воркеров
+        self.store = db.store
+        # Версия стакана: растет при каждом изменении ордеров
+        self.version = 0
+        # Берется после блокировок игроков, действует между воркерами
+        self.lock = player_locks.named_lock(P2P_LOCK)
         self.orders = self.load_orders()
+        # Число активных ордеров поддерживается при изменениях, а не проходом по стакану
+        self.active_count = self.count_active(self.orders)
+    
+    @staticmethod
+    def count_active(orders):
+        return sum(1 for order in orders if order["status"] == "active")
     
     def load_orders(self):
+        if self.store is not None:
+            orders, self.version = self.load_store_orders()
+            if self.version == 0 and os.path.exists(self.orders_file):
+                with open(self.orders_file, 'r', encoding='utf-8') as f:
+                    orders = json.load(f)
+                for order in orders:
+                    migrate_record_times(order)
+                self.version = self.store.save_orders(orders)
+                print(f"✅ Migrated {len(orders)} P2P orders to {self.store.path}")
+            return orders
         try:
             if os.path.exists(self.orders_file):
                 with open(self.orders_file, 'r', encoding='utf-8') as f:
                     orders = json.load(f)
+                    for order in orders:
+                        migrate_record_times(order)
                     print(f"✅ Loaded {len(orders)} P2P orders")
                     return orders
         except Exception as e:
             print(f"❌ Error loading P2P orders: {e}")
         return []
     
+    def load_store_orders(self):
+        orders, version = self.store.load_orders()
+        # Ордера, записанные до перехода на время в epoch
+        for order in orders:
+            migrate_record_times(order)
+        return orders, version
+    
+    def refresh(self):
+        """Перечитать ордера, если другой воркер изменил стакан"""
+        if self.store is None:
+            return
+        with self.lock:
+            if self.store.orders_version() != self.version:
+                self.orders, self.version = self.load_store_orders()
+                self.active_count = self.count_active(self.orders)
+    
+    def active_orders_count(self):
+        self.refresh()
+        return self.active_count
+    
+    def replace_orders(self, orders):
+        """Подменить весь стакан (восстановление из бэкапа, очистка)"""
+        with self.lock:
+            self.orders = orders
+            self.active_count = self.count_active(orders)
+            self.save_orders()
+    
+    def current_version(self):
+        self.refresh()
+        return self.version
+    
     def save_orders(self):
-        try:
-            with open(self.orders_file, 'w', encoding='utf-8') as f:
-                json.dump(self.orders, f, indent=2, ensure_ascii=False)
-            print(f"💾 P2P orders saved: {len(self.orders)} orders")
-        except Exception as e:
-            print(f"❌ Error saving P2P orders: {e}")
+        with self.lock:
+            started = time.perf_counter()
+            if self.store is not None:
+                self.version = self.store.save_orders(self.orders)
+                save_duration.observe(time.perf_counter() - started, "p2p_orders")
+                return
+            self.version += 1
+            try:
+                with open(self.orders_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.orders, f, indent=2, ensure_ascii=False)
+                    size = f.tell()
+                save_duration.observe(time.perf_counter() - started, "p2p_orders")
+                save_bytes.observe(size, "p2p_orders")
+                print(f"💾 P2P orders saved: {len(self.orders)} orders")
+            except Exception as e:
+                print(f"❌ Error saving P2P orders: {e}")
     
     def create_order(self, user_id, symbol, amount, price, order_type, username="Trader"):
+        with self.lock:
+            self.refresh()
+            return self._create_order(user_id, symbol, amount, price, order_type, username)
+    
+    def _create_order(self, user_id, symbol, amount, price, order_type, username):
         order_id = len(self.orders) + 1
         order = {
             "id": order_id,
@@ -310,40 +226,54 @@ class P2PManager:
             "total": amount * price,
             "type": order_type,
             "status": "active",
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+            "created_at": now_ts(),
+            "updated_at": now_ts()
         }
         
         self.orders.append(order)
+        self.active_count += 1
         self.save_orders()
         return order
     
     def get_active_orders(self, symbol=None):
+        self.refresh()
         active_orders = [order for order in self.orders if order["status"] == "active"]
         if symbol:
             active_orders = [order for order in active_orders if order["symbol"] == symbol]
         return active_orders
     
     def get_user_orders(self, user_id):
+        self.refresh()
         return [order for order in self.orders if order["user_id"] == user_id]
     
     def get_order_by_id(self, order_id):
+        self.refresh()
         for order in self.orders:
             if order["id"] == order_id:
                 return order
         return None
     
     def cancel_order(self, order_id, user_id):
-        order = self.get_order_by_id(order_id)
-        if order and order["user_id"] == user_id and order["status"] == "active":
-            order["status"] = "cancelled"
-            order["updated_at"] = datetime.now().isoformat()
-            self.save_orders()
-            return True
+        with self.lock:
+            order = self.get_order_by_id(order_id)
+            if order and order["user_id"] == user_id and order["status"] == "active":
+                order["status"] = "cancelled"
+                order["updated_at"] = now_ts()
+                self.active_count -= 1
+                self.save_orders()
+                return True
         return False
     
     def execute_trade(self, order_id, buyer_id):
         order = self.get_order_by_id(order_id)
+        if not order:
+            return False, "Order not found or not active"
+        
+        # Обе стороны сделки блокируются в фиксированном порядке, стакан - после них
+        with player_locks.hold(order["user_id"], buyer_id), self.lock:
+            return self._execute_trade(self.get_order_by_id(order_id), buyer_id)
+    
+    def _execute_trade(self, order, buyer_id):
         if not order or order["status"] != "active":
             return False, "Order not found or not active"
         
@@ -389,44 +319,192 @@ class P2PManager:
             seller_data["portfolio"][symbol] = seller_data["portfolio"].get(symbol, 0) + amount
             seller_data["balance"] -= total
         
-        db.save_player(order["user_id"], seller_data)
-        db.save_player(buyer_id, buyer_data)
+        db.save_player(order["user_id"], seller_data, ["balance", "portfolio"])
+        db.save_player(buyer_id, buyer_data, ["balance", "portfolio"])
+        metrics.incr("trades")
+        metrics.incr("trade_volume", total)
+        candles.add_volume(symbol, amount)
         
         order["status"] = "filled"
-        order["updated_at"] = datetime.now().isoformat()
+        order["updated_at"] = now_ts()
         order["filled_with"] = buyer_id
+        self.active_count -= 1
         self.save_orders()
         
         return True, "Trade executed successfully"
 
 p2p_manager = P2PManager()
 
+response_cache = ResponseCache()
+
+PAGE_TEMPLATES = {"index": "index.html", "admin": "admin.html", "p2p": "p2p.html", "mining": "mining.html"}
+static_pages = StaticPages()
+static_pages.build(app, PAGE_TEMPLATES)
+
+def replace_p2p_orders(orders):
+    p2p_manager.replace_orders(orders)
+
+# С общим хранилищем очередь майнинга обрабатывает один воркер
+mining_scheduler = MiningScheduler(db, owner=lambda: player_locks.claim(MINING_OWNER))
+
+activity_index = ActivityIndex()
+activity_index.attach(db)
+player_index = PlayerIndex()
+player_index.attach(db)
+
+# Полная история ордеров игроков; в записи игрока только последние ордера
+trade_history = TradeHistory(os.environ.get("TRADE_HISTORY_DB", "trade_history.db"))
+trade_history.migrate_all(db)
+
+# Манифест бэкапов общий для воркеров, периодические бэкапы делает один из них
+backup_manager = BackupManager(db, lambda: p2p_manager.orders, replace_p2p_orders,
+                               lock=player_locks.named_lock(BACKUP_LOCK),
+                               owner=lambda: player_locks.claim(BACKUP_OWNER))
+backup_manager.start_periodic(int(os.environ.get("BACKUP_INTERVAL", 0)))
+
+economy_totals = EconomyTotals()
+economy_totals.attach(db)
+metrics.add_gauge_source(economy_totals.gauges)
+metrics.add_gauge_source(lambda: {"p2p_active_orders": p2p_manager.active_orders_count()})
+candles = CandleAggregator()
+
+# С общим хранилищем историю метрик и свечей пишет и сохраняет один воркер,
+# остальные читают его файлы - поэтому сохраняем чаще, чтобы они не отставали
+history_persist_default = 60
+if db.store is not None:
+    history_persist_default = 5
+    history_owner = lambda: player_locks.claim(HISTORY_OWNER)
+    metrics.share(db.store, history_owner, refresh=db.sync)
+    candles.share(db.store, history_owner, refresh=db.sync)
+
+metrics.load()
+metrics.start(float(os.environ.get("METRICS_INTERVAL", 1)),
+              int(os.environ.get("METRICS_PERSIST_INTERVAL", history_persist_default)))
+
+candles.load()
+# Свечи строятся по одной опорной цене рынка, а не по блужданиям цен отдельных игроков
+candles.start(int(os.environ.get("CANDLES_PERSIST_INTERVAL", history_persist_default)),
+              price_source=economy_totals.reference_prices)
+
+# Метрики процесса для /metrics
+http_requests = telemetry.counter(
+    "crypto_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+http_latency = telemetry.histogram(
+    "crypto_http_request_duration_seconds", "HTTP request latency by route", ("route",)
+)
+save_player_calls = telemetry.histogram(
+    "crypto_save_player_calls_per_request", "db.save_player calls per request", ("route",), COUNT_BUCKETS
+)
+telemetry.gauge("crypto_players", "Players in memory", lambda: len(db.players))
+telemetry.gauge("crypto_p2p_orders", "P2P orders by status", lambda: p2p_order_counts(), ("status",))
+telemetry.gauge(
+    "crypto_p2p_book_orders", "Active P2P orders by symbol and side", lambda: p2p_book_sizes(), ("symbol", "side")
+)
+telemetry.gauge("crypto_snapshot_age_seconds", "Age of the last good players snapshot",
+                lambda: db.snapshot_stats().get("last_success_age_seconds"))
+telemetry.collected_counter("crypto_player_lock_wait_seconds_total", "Total time spent waiting for player locks",
+                            lambda: player_locks.get_stats()["wait_seconds"])
+telemetry.gauge("crypto_uptime_seconds", "Process uptime", lambda: time.time() - app_start_time)
+telemetry.gauge("process_resident_memory_bytes", "Resident memory size in bytes",
+                lambda: process_memory()["rss_bytes"])
+
+def p2p_order_counts():
+    counts = {}
+    for order in list(p2p_manager.orders):
+        counts[order["status"]] = counts.get(order["status"], 0) + 1
+    return counts
+
+def p2p_book_sizes():
+    sizes = {}
+    for order in list(p2p_manager.orders):
+        if order["status"] == "active":
+            key = (order["symbol"], order["type"])
+            sizes[key] = sizes.get(key, 0) + 1
+    return sizes
+
+# Профилирование по запросу админа: семплирование всех потоков и cProfile отдельных запросов
+profile_captures = ProfileCaptures(os.environ.get("PROFILE_DIR", "profiles"))
+sampling_profiler = SamplingProfiler(profile_captures)
+request_profiler = RequestProfiler(profile_captures)
+
+@app.before_request
+def before_request():
+    g.started_at = time.perf_counter()
+    telemetry.start_request()
+    if request_profiler.rules:
+        user_id = ((request.view_args or {}).get('user_id') or request.args.get('user_id')
+                   or (request.get_json(silent=True) or {}).get('user_id'))
+        rule = request_profiler.match(request.url_rule.rule if request.url_rule else None, request.path, user_id)
+        if rule is not None:
+            g.profile = (request_profiler.start(), rule, user_id)
+
+@app.teardown_request
+def teardown_request(exc):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        (profiler, started), rule, user_id = profile
+        try:
+            request_profiler.finish(profiler, started, rule, {
+                "method": request.method, "path": request.path, "user_id": user_id
+            })
+        except Exception as e:
+            print(f"❌ Error saving request profile: {e}")
+
 @app.after_request
 def after_request(response):
+    metrics.incr("requests")
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    response.headers.add('Access-Control-Expose-Headers', 'ETag')
+    response = response_cache.compress_response(response)
+    
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    http_requests.inc(route, request.method, response.status_code)
+    started = g.get("started_at")
+    if started is not None:
+        http_latency.observe(time.perf_counter() - started, route)
+    calls = telemetry.finish_request()
+    if calls is not None:
+        save_player_calls.observe(calls, route)
     return response
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(telemetry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return static_pages.page('index')
 
 @app.route('/admin')
 def admin():
-    return render_template('admin.html')
+    return static_pages.page('admin')
 
 @app.route('/p2p')
 def p2p_market():
-    return render_template('p2p.html')
+    return static_pages.page('p2p')
 
 @app.route('/mining')
 def mining():
-    return render_template('mining.html')
+    return static_pages.page('mining')
+
+@app.route('/assets/<filename>')
+def static_asset(filename):
+    response = static_pages.asset(filename)
+    if response is None:
+        return jsonify({"error": "Asset not found"}), 404
+    return response
+
+def health_etag():
+    db.sync()
+    return f"health-{db.change_seq}-{p2p_manager.current_version()}"
 
 @app.route('/health')
+@response_cache.conditional(health_etag)
 def health_check():
-    players_count = len(db.get_all_players())
+    players_count = len(db.players)
     return jsonify({
         "status": "healthy", 
         "service": "crypto-exchange",
@@ -446,25 +524,16 @@ def mining_status():
         if not player:
             return jsonify({"success": False, "error": "Player not found"})
         
-        last_mining_time = datetime.fromisoformat(player["mining"]["last_mining_time"].replace('Z', '+00:00'))
-        time_diff = (datetime.now() - last_mining_time).total_seconds()
-        energy_to_regenerate = min(
-            time_diff / 60 * MINING_CONFIG["energy_regeneration_rate"],
-            MINING_CONFIG["max_energy"] - player["mining"]["energy"]
-        )
-        
-        if energy_to_regenerate > 0:
-            player["mining"]["energy"] += energy_to_regenerate
-            player["mining"]["last_mining_time"] = datetime.now().isoformat()
-            db.save_player(user_id, player)
+        # Энергия вычисляется на лету - запрос статуса ничего не записывает
+        energy = get_current_energy(player["mining"])
         
         mining_data = {
-            "energy": player["mining"]["energy"],
+            "energy": energy,
             "max_energy": MINING_CONFIG["max_energy"],
             "equipment_level": player["mining"]["equipment_level"],
             "mining_power": player["mining"]["mining_power"],
             "total_mined": player["mining"]["total_mined"],
-            "can_mine": player["mining"]["energy"] >= MINING_CONFIG["base_energy_cost"],
+            "can_mine": energy >= MINING_CONFIG["base_energy_cost"],
             "equipment_name": MINING_CONFIG["equipment_levels"][player["mining"]["equipment_level"]]["name"],
             "next_upgrade_cost": MINING_CONFIG["equipment_levels"][player["mining"]["equipment_level"] + 1]["cost"] if player["mining"]["equipment_level"] < len(MINING_CONFIG["equipment_levels"]) else None
         }
@@ -478,6 +547,7 @@ def mining_status():
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/mining/mine', methods=['POST'])
+@player_locks.locked(request_user_id)
 def mine_crypto():
     try:
         user_id = request.json.get('user_id')
@@ -490,38 +560,23 @@ def mine_crypto():
         if not player:
             return jsonify({"success": False, "error": "Player not found"})
         
-        if player["mining"]["energy"] < MINING_CONFIG["base_energy_cost"]:
+        now = now_ts()
+        energy = get_current_energy(player["mining"], now)
+        if energy < MINING_CONFIG["base_energy_cost"]:
             return jsonify({"success": False, "error": "Not enough energy"})
         
-        last_mining_time = datetime.fromisoformat(player["mining"]["last_mining_time"].replace('Z', '+00:00'))
-        time_diff = (datetime.now() - last_mining_time).total_seconds()
+        time_diff = now - player["mining"]["last_mining_time"]
         if time_diff < MINING_CONFIG["mining_cooldown"]:
             return jsonify({"success": False, "error": f"Wait {int(MINING_CONFIG['mining_cooldown'] - time_diff)} seconds"})
         
-        base_reward = CRYPTOS[symbol]["mining_reward"]
-        difficulty = CRYPTOS[symbol]["mining_difficulty"]
-        equipment_multiplier = MINING_CONFIG["equipment_levels"][player["mining"]["equipment_level"]]["multiplier"]
-        player_multiplier = player["mining"]["mining_power"]
+        reward = apply_mining_attempt(player, symbol, energy, random.random(), random.uniform(0.7, 1.1), now)
+        db.save_player(user_id, player, ["portfolio", "mining", "stats"])
         
-        success_chance = min(0.8, (equipment_multiplier * player_multiplier) / difficulty)
-        
-        if random.random() > success_chance:
-            player["mining"]["energy"] -= MINING_CONFIG["base_energy_cost"] // 2
-            player["mining"]["last_mining_time"] = datetime.now().isoformat()
-            db.save_player(user_id, player)
+        if reward is None:
             return jsonify({"success": False, "error": "Mining failed. Try again!"})
         
-        reward = base_reward * equipment_multiplier * player_multiplier * random.uniform(0.7, 1.1)
-        reward = round(reward, 6)
-        
-        player["portfolio"][symbol] = player["portfolio"].get(symbol, 0) + reward
-        player["mining"]["energy"] -= MINING_CONFIG["base_energy_cost"]
-        player["mining"]["last_mining_time"] = datetime.now().isoformat()
-        player["mining"]["total_mined"][symbol] = player["mining"]["total_mined"].get(symbol, 0) + reward
-        player["stats"]["total_mining_rewards"] += reward * player["current_prices"][symbol]
-        
-        db.save_player(user_id, player)
-        
+        metrics.incr("mining_rewards")
+        metrics.incr("mining_emission_value", reward * player["current_prices"][symbol])
         return jsonify({
             "success": True,
             "reward": reward,
@@ -534,6 +589,7 @@ def mine_crypto():
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/mining/upgrade', methods=['POST'])
+@player_locks.locked(request_user_id)
 def upgrade_equipment():
     try:
         user_id = request.json.get('user_id')
@@ -556,7 +612,7 @@ def upgrade_equipment():
         player["mining"]["equipment_level"] = next_level
         player["mining"]["mining_power"] = MINING_CONFIG["equipment_levels"][next_level]["multiplier"]
         
-        db.save_player(user_id, player)
+        db.save_player(user_id, player, ["balance", "mining"])
         
         return jsonify({
             "success": True,
@@ -568,8 +624,57 @@ def upgrade_equipment():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/mining/jobs', methods=['POST'])
+def create_mining_job():
+    try:
+        user_id = request.json.get('user_id')
+        symbols = request.json.get('symbols') or [request.json.get('symbol')]
+        attempts = int(request.json.get('attempts', 1))
+        
+        if not db.get_player_data(user_id):
+            return jsonify({"success": False, "error": "Player not found"})
+        
+        job, error = mining_scheduler.submit(user_id, symbols, attempts)
+        if error:
+            return jsonify({"success": False, "error": error})
+        
+        return jsonify({
+            "success": True,
+            "message": f"Queued {attempts} mining attempts",
+            "job": record_to_api(job, MINING_JOB_TIME_FIELDS)
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/mining/jobs/status', methods=['POST'])
+def mining_jobs_status():
+    try:
+        user_id = request.json.get('user_id')
+        return jsonify({
+            "success": True,
+            "jobs": [record_to_api(job, MINING_JOB_TIME_FIELDS) for job in mining_scheduler.get_user_jobs(user_id)]
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/mining/jobs/cancel', methods=['POST'])
+def cancel_mining_job():
+    try:
+        user_id = request.json.get('user_id')
+        job_id = int(request.json.get('job_id', 0))
+        
+        if mining_scheduler.cancel(job_id, user_id):
+            return jsonify({"success": True, "message": "Mining job cancelled"})
+        return jsonify({"success": False, "error": "Failed to cancel mining job"})
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
 # ЕЖЕДНЕВНЫЙ БОНУС
 @app.route('/api/daily_bonus', methods=['POST'])
+@player_locks.locked(request_user_id)
 def claim_daily_bonus():
     try:
         user_id = request.json.get('user_id')
@@ -578,8 +683,7 @@ def claim_daily_bonus():
         if not player:
             return jsonify({"success": False, "error": "Player not found"})
         
-        today = datetime.now().date().isoformat()
-        last_login = datetime.fromisoformat(player["last_login"].replace('Z', '+00:00')).date()
+        last_login = datetime.fromtimestamp(player["last_login"]).date()
         current_date = datetime.now().date()
         
         if last_login < current_date:
@@ -594,9 +698,9 @@ def claim_daily_bonus():
         player["balance"] += bonus_amount
         player["stats"]["daily_bonus_claimed"] = True
         player["stats"]["login_streak"] = streak + 1 if last_login == current_date - timedelta(days=1) else 1
-        player["last_login"] = datetime.now().isoformat()
+        player["last_login"] = now_ts()
         
-        db.save_player(user_id, player)
+        db.save_player(user_id, player, ["balance", "stats", "last_login"])
         
         return jsonify({
             "success": True,
@@ -610,6 +714,7 @@ def claim_daily_bonus():
 
 # ОБНОВЛЕННЫЙ ТОРГОВЫЙ ЭНДПОИНТ
 @app.route('/api/place_order', methods=['POST'])
+@player_locks.locked(request_user_id)
 def place_order():
     try:
         user_id = request.json.get('user_id')
@@ -657,7 +762,7 @@ def place_order():
                 player["portfolio"][symbol] -= amount
             
             order = {
-                "id": len(player["orders"]) + 1,
+                "id": trade_history.next_order_id(player),
                 "symbol": symbol,
                 "type": order_type,
                 "amount": amount,
@@ -665,23 +770,26 @@ def place_order():
                 "total": total_cost,
                 "fee": fee,
                 "status": "filled",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_ts()
             }
-            player["orders"].append(order)
+            trade_history.record(user_id, player, order)
             player["stats"]["total_trades"] += 1
             
-            db.save_player(user_id, player)
+            db.save_player(user_id, player, ["balance", "portfolio", "orders", "stats"])
+            metrics.incr("trades")
+            metrics.incr("trade_volume", total_cost)
+            candles.add_volume(symbol, amount)
             
             return jsonify({
                 "success": True,
                 "message": f"{order_type.upper()} {amount} {symbol} @ ${execution_price:.2f} (комиссия: ${fee:.2f})",
-                "order": order,
-                "player": player
+                "order": record_to_api(order),
+                "player": player_view(user_id, player, *parse_view_params(request.json))
             })
         
         else:
             order = {
-                "id": len(player["orders"]) + 1,
+                "id": trade_history.next_order_id(player),
                 "symbol": symbol,
                 "type": order_type,
                 "amount": amount,
@@ -689,25 +797,67 @@ def place_order():
                 "total": amount * limit_price,
                 "fee": calculate_trading_fee(amount, limit_price, 'limit'),
                 "status": "pending",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_ts()
             }
-            player["orders"].append(order)
+            trade_history.record(user_id, player, order)
             
-            db.save_player(user_id, player)
+            db.save_player(user_id, player, ["orders", "stats"])
             
             return jsonify({
                 "success": True,
                 "message": f"Limit order placed: {order_type} {amount} {symbol} @ ${limit_price:.2f}",
-                "order": order,
-                "player": player
+                "order": record_to_api(order),
+                "player": player_view(user_id, player, *parse_view_params(request.json))
             })
         
     except Exception as e:
         print(f"Error in place_order: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/player/<user_id>/orders', methods=['GET'])
+@player_locks.locked(request_user_id)
+def get_player_orders(user_id):
+    """История ордеров игрока от новых к старым: ?limit=N&cursor=<next_cursor>&symbol=BTC"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+    
+    player = db.get_player_data(user_id)
+    if not player:
+        return jsonify({"error": "Player not found"}), 404
+    if trade_history.ensure_migrated(user_id, player):
+        db.save_player(user_id, player, ["orders", "stats"])
+    
+    symbol = request.args.get('symbol', '').upper() or None
+    orders, next_cursor = trade_history.page(user_id, limit, cursor, symbol)
+    return jsonify({
+        "success": True,
+        "orders": [record_to_api(order) for order in orders],
+        "next_cursor": next_cursor,
+        "total_count": player["stats"]["total_orders"]
+    })
+
+@app.route('/api/candles/<symbol>', methods=['GET'])
+def get_candles(symbol):
+    """OHLCV свечи: ?interval=1m|5m|1h|1d&since=<epoch>&limit=N&format=json|binary"""
+    try:
+        interval = request.args.get('interval', '1m')
+        since = float(request.args['since']) if request.args.get('since') else None
+        limit = max(1, min(int(request.args.get('limit', 500)), 5000))
+        result = candles.query(symbol.upper(), interval, since, limit)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    step = dict((name, step) for name, step, _ in CANDLE_INTERVALS)[interval]
+    if request.args.get('format') == 'binary':
+        return Response(encode_binary(result, step), mimetype="application/octet-stream")
+    return jsonify(encode_compact(symbol.upper(), interval, step, result))
+
 # P2P ЭНДПОИНТЫ
 @app.route('/api/p2p/create_order', methods=['POST'])
+@player_locks.locked(request_user_id)
 def create_p2p_order():
     try:
         data = request.json
@@ -747,7 +897,7 @@ def create_p2p_order():
         return jsonify({
             "success": True,
             "message": f"P2P {order_type} order created successfully",
-            "order": order
+            "order": record_to_api(order)
         })
         
     except Exception as e:
@@ -755,6 +905,7 @@ def create_p2p_order():
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/p2p/orders', methods=['GET'])
+@response_cache.conditional(lambda: f"p2p-{p2p_manager.current_version()}-{request.args.get('symbol') or 'all'}")
 def get_p2p_orders():
     try:
         symbol = request.args.get('symbol')
@@ -762,7 +913,7 @@ def get_p2p_orders():
         
         return jsonify({
             "success": True,
-            "orders": orders,
+            "orders": [record_to_api(order) for order in orders],
             "total": len(orders)
         })
         
@@ -771,6 +922,7 @@ def get_p2p_orders():
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/p2p/my_orders', methods=['GET'])
+@response_cache.conditional(lambda: f"p2p-{p2p_manager.current_version()}-user-{request.args.get('user_id')}")
 def get_my_p2p_orders():
     try:
         user_id = request.args.get('user_id')
@@ -781,7 +933,7 @@ def get_my_p2p_orders():
         
         return jsonify({
             "success": True,
-            "orders": orders,
+            "orders": [record_to_api(order) for order in orders],
             "total": len(orders)
         })
         
@@ -817,6 +969,7 @@ def execute_p2p_trade():
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/p2p/cancel_order', methods=['POST'])
+@player_locks.locked(request_user_id)
 def cancel_p2p_order():
     try:
         data = request.json
@@ -911,35 +1064,142 @@ def admin_stats_route():
         "stats": stats
     })
 
+def admin_player_summary(user_id, player):
+    """Строка игрока для списка в админке (без полного портфеля)"""
+    return {
+        "user_id": user_id,
+        "username": player.get('username', 'Unknown'),
+        "balance": player.get('balance', 0),
+        "portfolio_value": player.get('portfolio_value', 0),
+        "total_value": player.get('total_value', 0),
+        "created_at": to_iso(player.get('created_at', 'Unknown')),
+        "last_login": to_iso(player.get('last_login', 'Never')),
+        "orders_count": player.get('stats', {}).get('total_orders', len(player.get('orders', []))),
+        "holdings_count": len([a for a in player.get('portfolio', {}).values() if a > 0]),
+        "mining_level": player.get('mining', {}).get('equipment_level', 1),
+        "total_trades": player.get('stats', {}).get('total_trades', 0)
+    }
+
 @app.route('/api/admin/players', methods=['POST'])
 @require_admin_auth
 def admin_players_route():
-    players = db.get_all_players()
+    params = request.json or {}
+    sort = params.get('sort', 'total_value')
+    if sort not in SORT_KEYS:
+        return jsonify({"success": False, "error": f"Sort must be one of: {', '.join(SORT_KEYS)}"}), 400
+    try:
+        limit = max(1, min(int(params.get('limit', 50)), 200))
+        mining_level = int(params['mining_level']) if params.get('mining_level') not in (None, '') else None
+        min_holding = float(params.get('min_holding') or 0)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Invalid filter parameters"}), 400
+    holding = params.get('holding') or None
+    if holding is not None and holding not in CRYPTOS:
+        return jsonify({"success": False, "error": "Invalid cryptocurrency"}), 400
+
+    # Страница читает только своих игроков: без копии всей базы на каждый запрос
+    db.sync()
+    players = db.players
+
+    def matches(user_id):
+        player = players.get(user_id)
+        if player is None:
+            return False
+        if mining_level is not None and player.get('mining', {}).get('equipment_level', 1) != mining_level:
+            return False
+        if holding is not None and player.get('portfolio', {}).get(holding, 0) <= min_holding:
+            return False
+        return True
+
+    filtered = mining_level is not None or holding is not None
+    prefix = (params.get('search') or '').strip() or None
+    try:
+        user_ids, next_cursor = player_index.page(
+            sort=sort,
+            descending=params.get('order', 'desc') != 'asc',
+            limit=limit,
+            cursor=params.get('cursor'),
+            predicate=matches if filtered else None,
+            prefix=prefix
+        )
+    except (ValueError, TypeError):
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
     players_list = []
-    
-    for user_id, player in players.items():
-        players_list.append({
-            "user_id": user_id,
-            "username": player.get('username', 'Unknown'),
-            "balance": player.get('balance', 0),
-            "portfolio_value": player.get('portfolio_value', 0),
-            "total_value": player.get('total_value', 0),
-            "created_at": player.get('created_at', 'Unknown'),
-            "last_login": player.get('last_login', 'Never'),
-            "orders_count": len(player.get('orders', [])),
-            "portfolio": player.get('portfolio', {}),
-            "mining_level": player.get('mining', {}).get('equipment_level', 1),
-            "total_trades": player.get('stats', {}).get('total_trades', 0)
-        })
-    
-    return jsonify({
+    for user_id in user_ids:
+        player = players.get(user_id)
+        if player is not None:
+            players_list.append(admin_player_summary(user_id, player))
+
+    result = {
         "success": True,
         "players": players_list,
-        "total_count": len(players_list)
+        "next_cursor": next_cursor
+    }
+    # Число игроков под фильтрами считается только для первой страницы -
+    # следующие страницы его не меняют, а проход с фильтрами линейный
+    if not params.get('cursor'):
+        result["total_count"] = player_index.count(predicate=matches if filtered else None, prefix=prefix)
+    return jsonify(result)
+
+@app.route('/api/admin/metrics', methods=['POST'])
+@require_admin_auth
+def admin_metrics_route():
+    """Временные ряды метрик экономики для графиков"""
+    params = request.json or {}
+    try:
+        result = metrics.query(
+            names=params.get('metrics'),
+            resolution=params.get('resolution', '1m'),
+            since=float(params['since']) if params.get('since') is not None else None,
+            limit=int(params['limit']) if params.get('limit') else None
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, **result})
+
+@app.route('/api/admin/changes', methods=['POST'])
+@require_admin_auth
+def admin_changes_route():
+    """Лента изменений для инкрементального обновления админки"""
+    since = request.args.get('since', request.json.get('since'))
+    try:
+        since = int(since) if since is not None else None
+        limit = max(1, min(int(request.json.get('limit', 1000)), 5000))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Invalid since"}), 400
+
+    if since is None:
+        return jsonify({"success": True, "seq": db.change_seq, "truncated": True, "changes": []})
+
+    changes, truncated = db.changes_since(since, limit)
+    if truncated:
+        return jsonify({"success": True, "seq": db.change_seq, "truncated": True, "changes": []})
+
+    # Текущее состояние каждого затронутого игрока: строка списка или удален
+    players = {}
+    deleted = []
+    for user_id in dict.fromkeys(user_id for _, _, user_id, _ in changes):
+        player = db.get_player_data(user_id)
+        if player is not None:
+            players[user_id] = admin_player_summary(user_id, player)
+        else:
+            deleted.append(user_id)
+
+    return jsonify({
+        "success": True,
+        "seq": changes[-1][0] if len(changes) == limit else db.change_seq,
+        "truncated": False,
+        "has_more": len(changes) == limit,
+        "changes": [{"seq": seq, "op": op, "user_id": user_id, "fields": fields}
+                    for seq, op, user_id, fields in changes],
+        "players": players,
+        "deleted": deleted
     })
 
 @app.route('/api/admin/player/<user_id>', methods=['POST'])
 @require_admin_auth
+@player_locks.locked(request_user_id)
 def admin_player_manage_route(user_id):
     action = request.json.get('action')
     
@@ -969,7 +1229,7 @@ def admin_player_manage_route(user_id):
     elif action == "get_info":
         return jsonify({
             "success": True,
-            "player": player
+            "player": player_to_api(player)
         })
     
     else:
@@ -977,6 +1237,7 @@ def admin_player_manage_route(user_id):
 
 @app.route('/api/admin/player/<user_id>/portfolio', methods=['POST'])
 @require_admin_auth
+@player_locks.locked(request_user_id)
 def admin_player_portfolio_route(user_id):
     action = request.json.get('action')
     symbol = request.json.get('symbol')
@@ -1012,6 +1273,7 @@ def admin_player_portfolio_route(user_id):
 
 @app.route('/api/admin/player/<user_id>/balance', methods=['POST'])
 @require_admin_auth
+@player_locks.locked(request_user_id)
 def admin_player_balance_route(user_id):
     action = request.json.get('action')
     amount = float(request.json.get('amount', 0))
@@ -1043,6 +1305,7 @@ def admin_player_balance_route(user_id):
 
 @app.route('/api/admin/player/<user_id>/prices', methods=['POST'])
 @require_admin_auth
+@player_locks.locked(request_user_id)
 def admin_player_prices_route(user_id):
     action = request.json.get('action')
     symbol = request.json.get('symbol')
@@ -1095,22 +1358,25 @@ def admin_bulk_actions_route():
     
     if action == "add_balance_all":
         for user_id, player in players.items():
-            player["balance"] += amount
-            player["total_value"] = player["balance"] + player["portfolio_value"]
-            db.save_player(user_id, player)
+            with player_locks.hold(user_id):
+                player["balance"] += amount
+                player["total_value"] = player["balance"] + player["portfolio_value"]
+                db.save_player(user_id, player)
         return jsonify({"success": True, "message": f"Added ${amount} to all {len(players)} players"})
     
     elif action == "multiply_balance_all":
         for user_id, player in players.items():
-            player["balance"] *= multiplier
-            player["total_value"] = player["balance"] + player["portfolio_value"]
-            db.save_player(user_id, player)
+            with player_locks.hold(user_id):
+                player["balance"] *= multiplier
+                player["total_value"] = player["balance"] + player["portfolio_value"]
+                db.save_player(user_id, player)
         return jsonify({"success": True, "message": f"Multiplied balance by {multiplier}x for all {len(players)} players"})
     
     elif action == "reset_all_players":
         for user_id in players.keys():
-            new_data = create_new_player_data()
-            db.save_player(user_id, new_data)
+            with player_locks.hold(user_id):
+                new_data = create_new_player_data()
+                db.save_player(user_id, new_data)
         return jsonify({"success": True, "message": f"Reset all {len(players)} players"})
     
     else:
@@ -1122,60 +1388,277 @@ def admin_system_route():
     action = request.json.get('action')
     
     if action == "save":
-        db.save_data()
-        return jsonify({"success": True, "message": "Data saved successfully"})
+        if not db.save_data(wait=True):
+            return jsonify({"success": False, "error": "Failed to save data", "snapshots": db.snapshot_stats()})
+        return jsonify({"success": True, "message": "Data saved successfully", "snapshots": db.snapshot_stats()})
     
     elif action == "reload":
-        db.__init__()
-        return jsonify({"success": True, "message": "Data reloaded successfully"})
+        if not db.reload_async():
+            return jsonify({"success": False, "error": "Reload already in progress", "reload": db.reload_status})
+        return jsonify({"success": True, "message": "Reload started", "reload": db.reload_status})
+    
+    elif action == "reload_status":
+        return jsonify({"success": True, "reload": db.reload_status})
     
     elif action == "update_prices_all":
         players = db.get_all_players()
         for user_id, player in players.items():
-            for symbol, crypto in CRYPTOS.items():
-                current_price = player["current_prices"][symbol]
-                new_price = generate_realistic_price(current_price, crypto["volatility"] * 2, symbol)
-                
-                player["current_prices"][symbol] = new_price
-                player["price_history"][symbol].append(new_price)
-                if len(player["price_history"][symbol]) > 50:
-                    player["price_history"][symbol].pop(0)
-                
-                player["order_books"][symbol] = update_order_book(symbol, new_price)
-            
-            db.save_player(user_id, player)
+            with player_locks.hold(user_id):
+                apply_price_tick(player, volatility_scale=2)
+                save_price_tick(user_id, player, PRICE_FIELDS)
         
         return jsonify({"success": True, "message": "Prices updated for all players"})
     
     else:
         return jsonify({"success": False, "error": "Unknown action"})
 
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def iter_export_lines(after=None, user_ids=None, include_orders=True):
+    """Построчная (NDJSON) выгрузка игроков и их P2P ордеров, отсортированная по user_id"""
+    orders_by_user = {}
+    if include_orders:
+        for order in list(p2p_manager.orders):
+            orders_by_user.setdefault(str(order["user_id"]), []).append(order)
+
+    # Сортируем только ключи - сами записи игроков не копируются
+    keys = sorted(set(db.players.keys()) | set(orders_by_user.keys()))
+    start = bisect.bisect_right(keys, after) if after is not None else 0
+
+    yield json.dumps({
+        "type": "meta",
+        "exported_at": datetime.now().isoformat(),
+        "after": after,
+        "total_players": len(db.players),
+        "total_p2p_orders": len(p2p_manager.orders)
+    }, ensure_ascii=False) + "\n"
+
+    # Последний реально выгруженный user_id - продолжение выгрузки с него ничего не пропустит
+    last_user_id = after
+    for user_id in keys[start:]:
+        if user_ids and user_id not in user_ids:
+            continue
+
+        player = db.get_player_data(user_id)
+        if player is not None:
+            yield json.dumps({"type": "player", "user_id": user_id, "data": player_to_api(player)}, ensure_ascii=False) + "\n"
+            last_user_id = user_id
+
+        for order in orders_by_user.get(user_id, ()):
+            yield json.dumps({"type": "p2p_order", "user_id": user_id, "data": record_to_api(order)}, ensure_ascii=False) + "\n"
+            last_user_id = user_id
+
+    yield json.dumps({"type": "end", "last_user_id": last_user_id}) + "\n"
+
+def iter_chunks(lines, compress=False):
+    """Склеивание строк в блоки и, при необходимости, gzip-сжатие потока"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+
+    chunk = b"".join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+def export_response(options):
+    """Потоковый ответ с выгрузкой данных"""
+    after = options.get('after') or options.get('cursor')
+    user_ids = options.get('user_ids')
+    if isinstance(user_ids, str):
+        user_ids = [u for u in user_ids.split(',') if u]
+    include_orders = options.get('include_orders', True) not in (False, 'false', '0', 0)
+    compress = options.get('gzip') in (True, 'true', '1', 1)
+
+    lines = iter_export_lines(
+        after=str(after) if after is not None else None,
+        user_ids=set(map(str, user_ids)) if user_ids else None,
+        include_orders=include_orders
+    )
+
+    filename = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "X-Accel-Buffering": "no"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(
+        stream_with_context(iter_chunks(lines, compress)),
+        mimetype='application/x-ndjson',
+        headers=headers
+    )
+
+@app.route('/api/admin/export', methods=['POST'])
+@require_admin_auth
+def admin_export_route():
+    try:
+        return export_response(request.json)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/admin/profile', methods=['POST'])
+@require_admin_auth
+def admin_profile_route():
+    params = request.json
+    action = params.get('action')
+    
+    if action == "sample":
+        seconds = max(1.0, min(float(params.get('seconds', 10)), 120.0))
+        interval = max(0.001, float(params.get('interval_ms', 5)) / 1000)
+        capture_id = sampling_profiler.start(seconds, interval)
+        if capture_id is None:
+            return jsonify({"success": False, "error": "Sampling already in progress", "sampling": sampling_profiler.status})
+        return jsonify({"success": True, "capture_id": capture_id, "sampling": sampling_profiler.status})
+    
+    elif action == "arm":
+        if not params.get('route') and not params.get('user_id'):
+            return jsonify({"success": False, "error": "route or user_id required"}), 400
+        rule_id = request_profiler.arm(
+            params.get('route'), params.get('user_id'),
+            count=max(1, min(int(params.get('count', 1)), 100)),
+            ttl=max(1, min(int(params.get('ttl', 600)), 86400))
+        )
+        return jsonify({"success": True, "rule_id": rule_id, "rules": request_profiler.list_rules()})
+    
+    elif action == "disarm":
+        if not request_profiler.disarm(params.get('rule_id')):
+            return jsonify({"success": False, "error": "Rule not found"}), 404
+        return jsonify({"success": True, "rules": request_profiler.list_rules()})
+    
+    elif action == "list":
+        return jsonify({
+            "success": True,
+            "sampling": sampling_profiler.status,
+            "rules": request_profiler.list_rules(),
+            "captures": profile_captures.list()
+        })
+    
+    elif action == "download":
+        # folded - collapsed stacks семплирования, txt/prof - отчет и pstats данные cProfile
+        capture_id = str(params.get('capture_id', ''))
+        file_format = params.get('format', 'folded')
+        path = profile_captures.path(capture_id, file_format)
+        if path is None:
+            return jsonify({"success": False, "error": "Capture not found"}), 404
+        with open(path, 'rb') as f:
+            data = f.read()
+        mimetype = "application/octet-stream" if file_format == "prof" else "text/plain"
+        return Response(data, mimetype=mimetype, headers={
+            "Content-Disposition": f"attachment; filename={capture_id}.{file_format}"
+        })
+    
+    else:
+        return jsonify({"success": False, "error": "Unknown action"})
+
+def memory_subsystems():
+    """Оценка памяти структур процесса, кроме игроков (байты, число элементов, секунды)"""
+    subsystems = {
+        "p2p_orders": lambda: p2p_manager.orders,
+        "price_ticks": lambda: price_ticks,
+        "change_tracking": lambda: (db.change_log, db.player_seq, db.field_seq, db.deleted_seq),
+        "response_cache": lambda: response_cache.compressed,
+        "player_index": lambda: (player_index.usernames, player_index.username_by_user),
+        "activity_index": lambda: (activity_index.entries, activity_index.by_user),
+        "mining_jobs": lambda: mining_scheduler.jobs,
+        "candles": lambda: (candles.rings, candles.open_minute)
+    }
+    result = {}
+    for name, source in subsystems.items():
+        started = time.perf_counter()
+        try:
+            value = source()
+            result[name] = {
+                "bytes": deep_sizeof(value),
+                "items": len(value) if not isinstance(value, tuple) else len(value[0]),
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
+
+@app.route('/api/admin/memory', methods=['POST'])
+@require_admin_auth
+def admin_memory_route():
+    params = request.json
+    action = params.get('action', 'summary')
+    group_by = params.get('group_by', 'lineno')
+    if group_by not in ("lineno", "filename", "traceback"):
+        return jsonify({"success": False, "error": "group_by must be lineno, filename or traceback"}), 400
+    limit = max(1, min(int(params.get('limit', 20)), 500))
+    
+    if action == "summary":
+        # Размеры - оценки по sys.getsizeof: общие строки (user_id, символы) считаются в каждой структуре
+        sample = max(1, min(int(params.get('sample', 200)), 100000))
+        players = player_footprint(db.players, sample=sample, full=bool(params.get('full', False)))
+        return jsonify({
+            "success": True,
+            "process": process_memory(),
+            "players": players,
+            "price_histories_bytes": players["fields_bytes"].get("price_history", 0),
+            "order_books_bytes": players["fields_bytes"].get("order_books", 0),
+            "subsystems": memory_subsystems(),
+            "tracemalloc": memory_tracer.status()
+        })
+    
+    elif action == "tracemalloc_start":
+        frames = max(1, min(int(params.get('frames', 1)), 50))
+        started = memory_tracer.start(frames)
+        return jsonify({"success": True, "started": started, "tracemalloc": memory_tracer.status()})
+    
+    elif action == "tracemalloc_stop":
+        stopped = memory_tracer.stop()
+        return jsonify({"success": True, "stopped": stopped, "tracemalloc": memory_tracer.status()})
+    
+    elif action == "snapshot":
+        meta = memory_tracer.take()
+        if meta is None:
+            return jsonify({"success": False, "error": "tracemalloc is not running"}), 400
+        return jsonify({"success": True, "snapshot": meta, "top": memory_tracer.top(meta["id"], limit, group_by)})
+    
+    elif action == "top":
+        top = memory_tracer.top(str(params.get('snapshot_id', '')), limit, group_by)
+        if top is None:
+            return jsonify({"success": False, "error": "Snapshot not found"}), 404
+        return jsonify({"success": True, "top": top})
+    
+    elif action == "diff":
+        # Разница между двумя снимками: from - старый, to - новый (по умолчанию последний)
+        snapshots = memory_tracer.list()
+        new_id = params.get('to') or (snapshots[-1]["id"] if snapshots else None)
+        diff = memory_tracer.diff(str(params.get('from', '')), str(new_id), limit, group_by)
+        if diff is None:
+            return jsonify({"success": False, "error": "Snapshot not found"}), 404
+        return jsonify({"success": True, "from": params.get('from'), "to": new_id, "diff": diff})
+    
+    elif action == "list":
+        return jsonify({"success": True, "tracemalloc": memory_tracer.status()})
+    
+    else:
+        return jsonify({"success": False, "error": "Unknown action"})
+
 @app.route('/api/admin/system/advanced', methods=['POST'])
 @require_admin_auth
 def admin_system_advanced_route():
     action = request.json.get('action')
     
     if action == "clear_p2p_orders":
-        p2p_manager.orders = []
-        p2p_manager.save_orders()
+        p2p_manager.replace_orders([])
         return jsonify({"success": True, "message": "Cleared all P2P orders"})
     
     elif action == "export_data":
-        players = db.get_all_players()
-        
-        export_data = {
-            "players": players,
-            "p2p_orders": p2p_manager.orders,
-            "exported_at": datetime.now().isoformat(),
-            "total_players": len(players),
-            "total_p2p_orders": len(p2p_manager.orders),
-            "system_info": {
-                "cryptocurrencies": len(CRYPTOS),
-                "admin_user_id": ADMIN_USER_ID,
-                "server_time": datetime.now().isoformat()
-            }
-        }
-        return jsonify({"success": True, "data": export_data})
+        # Данные отдаются потоком NDJSON, без сборки всего набора в памяти
+        return export_response(request.json)
     
     elif action == "get_detailed_stats":
         players = db.get_all_players()
@@ -1275,49 +1758,51 @@ def admin_system_advanced_route():
         fixed_count = 0
         
         for user_id, player in players.items():
-            needs_fix = False
+            with player_locks.hold(user_id):
+                needs_fix = False
             
-            if "portfolio" not in player:
-                player["portfolio"] = {symbol: 0 for symbol in CRYPTOS}
-                needs_fix = True
+                if "portfolio" not in player:
+                    player["portfolio"] = {symbol: 0 for symbol in CRYPTOS}
+                    needs_fix = True
             
-            if "current_prices" not in player:
-                player["current_prices"] = {}
-                for symbol, crypto in CRYPTOS.items():
-                    player["current_prices"][symbol] = crypto["base_price"] * random.uniform(0.9, 1.1)
-                needs_fix = True
+                if "current_prices" not in player:
+                    player["current_prices"] = {}
+                    for symbol, crypto in CRYPTOS.items():
+                        player["current_prices"][symbol] = crypto["base_price"] * random.uniform(0.9, 1.1)
+                    needs_fix = True
             
-            if "portfolio_value" not in player:
-                player["portfolio_value"] = 0
-                needs_fix = True
+                if "portfolio_value" not in player:
+                    player["portfolio_value"] = 0
+                    needs_fix = True
             
-            if "total_value" not in player:
-                player["total_value"] = player.get("balance", 500) + player["portfolio_value"]
-                needs_fix = True
+                if "total_value" not in player:
+                    player["total_value"] = player.get("balance", 500) + player["portfolio_value"]
+                    needs_fix = True
             
-            if "mining" not in player:
-                player["mining"] = {
-                    "energy": MINING_CONFIG["max_energy"],
-                    "last_mining_time": datetime.now().isoformat(),
-                    "equipment_level": 1,
-                    "total_mined": {symbol: 0 for symbol in CRYPTOS},
-                    "mining_power": 1.0
-                }
-                needs_fix = True
+                if "mining" not in player:
+                    player["mining"] = {
+                        "energy": MINING_CONFIG["max_energy"],
+                        "energy_updated_at": now_ts(),
+                        "last_mining_time": now_ts(),
+                        "equipment_level": 1,
+                        "total_mined": {symbol: 0 for symbol in CRYPTOS},
+                        "mining_power": 1.0
+                    }
+                    needs_fix = True
             
-            if "stats" not in player:
-                player["stats"] = {
-                    "total_trades": 0,
-                    "total_profit": 0,
-                    "daily_bonus_claimed": False,
-                    "login_streak": 1,
-                    "total_mining_rewards": 0
-                }
-                needs_fix = True
+                if "stats" not in player:
+                    player["stats"] = {
+                        "total_trades": 0,
+                        "total_profit": 0,
+                        "daily_bonus_claimed": False,
+                        "login_streak": 1,
+                        "total_mining_rewards": 0
+                    }
+                    needs_fix = True
             
-            if needs_fix:
-                db.save_player(user_id, player)
-                fixed_count += 1
+                if needs_fix:
+                    db.save_player(user_id, player)
+                    fixed_count += 1
         
         return jsonify({"success": True, "message": f"Fixed data for {fixed_count} players"})
     
@@ -1335,67 +1820,76 @@ def admin_system_advanced_route():
             "corrupted_players": corrupted_players,
             "p2p_orders_total": len(p2p_manager.orders),
             "p2p_orders_active": len([o for o in p2p_manager.orders if o['status'] == 'active']),
-            "database_size": sum(len(str(player)) for player in players.values()),
+            # Оценка по выборке игроков вместо str() всей базы
+            "database_size": player_footprint(players, sample=100)["estimated_total_bytes"],
+            "memory": process_memory(),
             "system_uptime": int(time.time() - app_start_time),
-            "health_score": 100 - (corrupted_players / max(1, total_players)) * 100
+            "health_score": 100 - (corrupted_players / max(1, total_players)) * 100,
+            "response_cache": response_cache.stats,
+            "player_locks": player_locks.get_stats(),
+            "static_pages": static_pages.stats,
+            "snapshots": db.snapshot_stats()
         }
         
         return jsonify({"success": True, "health": health_status})
     
     elif action == "cleanup_old_data":
-        cutoff_date = datetime.now() - timedelta(days=30)
-        removed_count = 0
+        days = int(request.json.get('days', 30))
+        batch_size = int(request.json.get('batch_size', 500))
+        archive = request.json.get('archive', True) is not False
         
-        players = db.get_all_players()
-        for user_id, player in players.items():
-            last_login = player.get('last_login')
-            if last_login:
-                try:
-                    login_date = datetime.fromisoformat(last_login.replace('Z', '+00:00'))
-                    if login_date < cutoff_date:
-                        del db.players[user_id]
-                        removed_count += 1
-                except:
-                    pass
-        
-        if removed_count > 0:
-            db.save_data()
+        removed_count = archive_inactive_players(db, activity_index, days=days, batch_size=batch_size, archive=archive)
         
         return jsonify({"success": True, "message": f"Removed {removed_count} inactive players"})
     
+    elif action == "get_activity_stats":
+        return jsonify({"success": True, "activity": activity_index.get_stats()})
+    
     elif action == "backup_database":
-        backup_data = {
-            "players": db.get_all_players(),
-            "p2p_orders": p2p_manager.orders,
-            "backup_created": datetime.now().isoformat(),
-            "backup_version": "1.0"
-        }
+        full = bool(request.json.get('full', False))
+        job_id = backup_manager.submit(full=full)
+        return jsonify({"success": True, "message": f"Backup started: {job_id}", "job_id": job_id})
+    
+    elif action == "backup_status":
+        return jsonify({"success": True, "backup": backup_manager.get_status()})
+    
+    elif action == "list_backups":
+        return jsonify({"success": True, "backups": backup_manager.list_backups()})
+    
+    elif action == "restore_backup":
+        backup_id = request.json.get('backup_id')
+        until = request.json.get('until')
+        backup_file = request.json.get('file')
         
-        backup_filename = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        try:
-            with open(backup_filename, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=2, ensure_ascii=False)
-            return jsonify({"success": True, "message": f"Backup created: {backup_filename}", "filename": backup_filename})
-        except Exception as e:
-            return jsonify({"success": False, "error": f"Backup failed: {str(e)}"})
+        if backup_file and (os.path.isabs(backup_file) or '..' in backup_file):
+            return jsonify({"success": False, "error": "Invalid backup file"})
+        if until:
+            try:
+                until = to_epoch(until)
+            except (TypeError, ValueError, AttributeError):
+                return jsonify({"success": False, "error": "Invalid until: expected ISO time or epoch seconds"})
+        
+        job_id = backup_manager.submit_restore(backup_id=backup_id, until=until, file=backup_file)
+        return jsonify({"success": True, "message": f"Restore started: {job_id}", "job_id": job_id})
     
     elif action == "simulate_market_crash":
         players = db.get_all_players()
         affected_players = 0
         
         for user_id, player in players.items():
-            for symbol in CRYPTOS:
-                player["current_prices"][symbol] *= 0.5
+            with player_locks.hold(user_id):
+                for symbol in CRYPTOS:
+                    player["current_prices"][symbol] *= 0.5
             
-            portfolio_value = sum(
-                player["portfolio"][symbol] * player["current_prices"][symbol] 
-                for symbol in CRYPTOS
-            )
-            player["portfolio_value"] = round(portfolio_value, 2)
-            player["total_value"] = round(player["balance"] + portfolio_value, 2)
+                portfolio_value = sum(
+                    player["portfolio"][symbol] * player["current_prices"][symbol] 
+                    for symbol in CRYPTOS
+                )
+                player["portfolio_value"] = round(portfolio_value, 2)
+                player["total_value"] = round(player["balance"] + portfolio_value, 2)
             
-            db.save_player(user_id, player)
-            affected_players += 1
+                db.save_player(user_id, player)
+                affected_players += 1
         
         return jsonify({"success": True, "message": f"Simulated market crash for {affected_players} players"})
     
@@ -1404,18 +1898,19 @@ def admin_system_advanced_route():
         affected_players = 0
         
         for user_id, player in players.items():
-            for symbol in CRYPTOS:
-                player["current_prices"][symbol] *= 2.0
+            with player_locks.hold(user_id):
+                for symbol in CRYPTOS:
+                    player["current_prices"][symbol] *= 2.0
             
-            portfolio_value = sum(
-                player["portfolio"][symbol] * player["current_prices"][symbol] 
-                for symbol in CRYPTOS
-            )
-            player["portfolio_value"] = round(portfolio_value, 2)
-            player["total_value"] = round(player["balance"] + portfolio_value, 2)
+                portfolio_value = sum(
+                    player["portfolio"][symbol] * player["current_prices"][symbol] 
+                    for symbol in CRYPTOS
+                )
+                player["portfolio_value"] = round(portfolio_value, 2)
+                player["total_value"] = round(player["balance"] + portfolio_value, 2)
             
-            db.save_player(user_id, player)
-            affected_players += 1
+                db.save_player(user_id, player)
+                affected_players += 1
         
         return jsonify({"success": True, "message": f"Simulated market boom for {affected_players} players"})
     
@@ -1424,12 +1919,12 @@ def admin_system_advanced_route():
         reset_count = 0
         
         for user_id in players.keys():
-            new_data = create_new_player_data()
-            db.save_player(user_id, new_data)
-            reset_count += 1
+            with player_locks.hold(user_id):
+                new_data = create_new_player_data()
+                db.save_player(user_id, new_data)
+                reset_count += 1
         
-        p2p_manager.orders = []
-        p2p_manager.save_orders()
+        p2p_manager.replace_orders([])
         
         return jsonify({"success": True, "message": f"Complete economy reset for {reset_count} players"})
     
@@ -1471,7 +1966,76 @@ def admin_system_advanced_route():
         return jsonify({"success": False, "error": "Unknown action"})
 
 # ОСНОВНЫЕ ЭНДПОИНТЫ ИГРЫ
+PRICE_FIELDS = ["current_prices", "price_history", "order_books"]
+PRICE_HISTORY_LENGTH = 50
+
+# Версии, на которых в историю цен игрока добавлялись точки (для дельта-ответов)
+price_ticks = {}
+
+def apply_price_tick(player, volatility_scale=1):
+    """Новый тик цен: текущие цены, история и стаканы"""
+    for symbol, crypto in CRYPTOS.items():
+        current_price = player["current_prices"][symbol]
+        new_price = generate_realistic_price(current_price, crypto["volatility"] * volatility_scale, symbol)
+        
+        player["current_prices"][symbol] = new_price
+        player["price_history"][symbol].append(new_price)
+        if len(player["price_history"][symbol]) > PRICE_HISTORY_LENGTH:
+            player["price_history"][symbol].pop(0)
+        
+        player["order_books"][symbol] = update_order_book(symbol, new_price)
+
+def save_price_tick(user_id, player, fields):
+    """Сохранить игрока после тика цен и запомнить версию, на которой в историю добавилась точка"""
+    previous_seq = db.field_seq.get(user_id, {}).get("price_history")
+    db.save_player(user_id, player, fields)
+    
+    ticks = price_ticks.setdefault(user_id, deque(maxlen=PRICE_HISTORY_LENGTH))
+    # Между тиками история менялась иначе (сброс, восстановление) - старые тики недействительны
+    if ticks and ticks[-1] != previous_seq:
+        ticks.clear()
+    ticks.append(db.get_version(user_id))
+
+def price_history_since(user_id, player, since):
+    """Точки истории цен, добавленные после версии since, или None если это неизвестно"""
+    ticks = price_ticks.get(user_id)
+    history_seq = db.field_seq.get(user_id, {}).get("price_history")
+    # История менялась не через тик (сброс, восстановление) - нужна полная история
+    if not ticks or ticks[-1] != history_seq or ticks[0] > since:
+        return None
+    
+    count = sum(1 for seq in ticks if seq > since)
+    return {symbol: history[len(history) - count:] if count else [] for symbol, history in player["price_history"].items()}
+
+def parse_view_params(params):
+    """Параметры fields=a,b,c и since=<версия> из query string или JSON"""
+    params = params or {}
+    fields = params.get('fields')
+    if isinstance(fields, str):
+        fields = [f for f in fields.split(',') if f]
+    since = params.get('since')
+    return fields or None, int(since) if since not in (None, '') else None
+
+def player_view(user_id, player, fields=None, since=None):
+    """Ответ с выбранными полями игрока; при since - только поля, измененные после этой версии"""
+    keys = fields or list(player.keys())
+    changed = db.fields_changed_since(user_id, since) if since is not None else None
+    if changed is not None:
+        keys = [k for k in keys if k in changed]
+    
+    view = {k: player[k] for k in keys if k in player}
+    if changed is not None and "price_history" in view:
+        appended = price_history_since(user_id, player, since)
+        if appended is not None:
+            del view["price_history"]
+            view["price_history_append"] = appended
+    
+    view["_version"] = db.get_version(user_id)
+    view["_delta"] = changed is not None
+    return player_to_api(view)
+
 @app.route('/api/player/<user_id>', methods=['GET'])
+@player_locks.locked(request_user_id)
 def get_player_data(user_id):
     try:
         player_data = db.get_player_data(user_id)
@@ -1483,18 +2047,9 @@ def get_player_data(user_id):
         else:
             print(f"✅ Loaded player: {user_id}")
         
-        player_data["last_login"] = datetime.now().isoformat()
+        player_data["last_login"] = now_ts()
         
-        for symbol, crypto in CRYPTOS.items():
-            current_price = player_data["current_prices"][symbol]
-            new_price = generate_realistic_price(current_price, crypto["volatility"], symbol)
-            
-            player_data["current_prices"][symbol] = new_price
-            player_data["price_history"][symbol].append(new_price)
-            if len(player_data["price_history"][symbol]) > 50:
-                player_data["price_history"][symbol].pop(0)
-            
-            player_data["order_books"][symbol] = update_order_book(symbol, new_price)
+        apply_price_tick(player_data)
         
         portfolio_value = sum(
             player_data["portfolio"][symbol] * player_data["current_prices"][symbol] 
@@ -1503,15 +2058,16 @@ def get_player_data(user_id):
         player_data["portfolio_value"] = round(portfolio_value, 2)
         player_data["total_value"] = round(player_data["balance"] + portfolio_value, 2)
         
-        db.save_player(user_id, player_data)
+        save_price_tick(user_id, player_data, ["last_login", "portfolio_value", "total_value"] + PRICE_FIELDS)
         
-        return jsonify(player_data)
+        return jsonify(player_view(user_id, player_data, *parse_view_params(request.args)))
         
     except Exception as e:
         print(f"Error in get_player_data: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/update_prices', methods=['POST'])
+@player_locks.locked(request_user_id)
 def update_prices():
     try:
         user_id = request.json.get('user_id')
@@ -1520,23 +2076,14 @@ def update_prices():
         if not player:
             return jsonify({"error": "Player not found"}), 404
             
-        for symbol, crypto in CRYPTOS.items():
-            current_price = player["current_prices"][symbol]
-            new_price = generate_realistic_price(current_price, crypto["volatility"] * 2, symbol)
-            
-            player["current_prices"][symbol] = new_price
-            player["price_history"][symbol].append(new_price)
-            if len(player["price_history"][symbol]) > 50:
-                player["price_history"][symbol].pop(0)
-            
-            player["order_books"][symbol] = update_order_book(symbol, new_price)
+        apply_price_tick(player, volatility_scale=2)
         
-        db.save_player(user_id, player)
+        save_price_tick(user_id, player, PRICE_FIELDS)
         
         return jsonify({
             "success": True,
             "message": "Prices updated",
-            "player": player
+            "player": player_view(user_id, player, *parse_view_params(request.json))
         })
         
     except Exception as e:
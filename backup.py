@@ -0,0 +1,389 @@
+import copy
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from economy import persisted_player
+from locks import player_locks
+from timestamps import to_epoch
+
+
+class BackupManager:
+    """Фоновые инкрементальные бэкапы.
+
+    Каждый бэкап - это запись в manifest.json со списком сегментов. Сегмент -
+    сжатый gzip JSON с измененными (и удаленными) игроками, имя файла - sha256
+    его содержимого, поэтому одинаковые сегменты не дублируются. Полный бэкап
+    начинает новую цепочку, инкрементальные дописывают в нее по сегменту.
+
+    С несколькими воркерами манифест общий: lock действует между процессами,
+    и под ним манифест перечитывается перед каждым изменением. Периодические
+    бэкапы делает один процесс - тот, для которого owner() истинно.
+    """
+
+    def __init__(self, database, orders_provider, orders_setter=None, backup_dir="backups",
+                 full_every=10, keep_full=3, lock=None, owner=None):
+        self.db = database
+        self.orders_provider = orders_provider
+        self.orders_setter = orders_setter
+        self.backup_dir = backup_dir
+        self.segments_dir = os.path.join(backup_dir, "segments")
+        self.manifest_file = os.path.join(backup_dir, "manifest.json")
+        self.full_every = full_every
+        self.keep_full = keep_full
+
+        self.lock = threading.Lock()
+        # Блокировка манифеста и сегментов (между процессами, если передана общая)
+        self.manifest_lock = lock if lock is not None else threading.RLock()
+        self.owner = owner
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.job_counter = 0
+        self.worker = None
+        self.periodic = None
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            if os.path.exists(self.manifest_file):
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"❌ Error loading backup manifest: {e}")
+        return {"version": 2, "backups": []}
+
+    def save_manifest(self):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, self.manifest_file)
+
+    def segment_path(self, digest):
+        return os.path.join(self.segments_dir, f"{digest}.json.gz")
+
+    def write_segment(self, payload):
+        """Записать сегмент, адресуемый по содержимому. Возвращает (hash, размер)"""
+        raw = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self.segment_path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(self.segments_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(raw, compresslevel=6, mtime=0))
+            os.replace(tmp_path, path)
+
+        return digest, os.path.getsize(path)
+
+    def read_segment(self, digest):
+        with open(self.segment_path(digest), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()))
+
+    def submit(self, full=False):
+        """Поставить бэкап в очередь. Возвращает id задачи"""
+        return self.submit_job("backup", lambda: self.run_backup(full), full=full)
+
+    def submit_restore(self, backup_id=None, until=None, file=None):
+        """Поставить восстановление в очередь. Возвращает id задачи"""
+        return self.submit_job(
+            "restore", lambda: self.restore(backup_id, until, file),
+            backup_id=backup_id, until=until, file=file
+        )
+
+    def submit_job(self, kind, func, **params):
+        with self.lock:
+            self.job_counter += 1
+            job_id = f"{kind}-{int(time.time())}-{self.job_counter}"
+            self.jobs[job_id] = dict(
+                params,
+                job_id=job_id,
+                kind=kind,
+                status="queued",
+                queued_at=datetime.now().isoformat()
+            )
+            self.ensure_worker()
+
+        self.queue.put((job_id, func))
+        return job_id
+
+    def ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run_worker, name="backup-worker", daemon=True)
+            self.worker.start()
+
+    def run_worker(self):
+        while True:
+            job_id, func = self.queue.get()
+            job = self.jobs[job_id]
+            job["status"] = "running"
+            started = time.time()
+            try:
+                job["result"] = func()
+                job["status"] = "done"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                print(f"❌ Job {job_id} failed: {e}")
+            job["duration"] = round(time.time() - started, 3)
+            self.trim_jobs()
+
+    def trim_jobs(self, keep=50):
+        with self.lock:
+            finished = [k for k, v in self.jobs.items() if v["status"] in ("done", "failed")]
+            for job_id in finished[:-keep]:
+                del self.jobs[job_id]
+
+    def start_periodic(self, interval):
+        """Запускать инкрементальный бэкап каждые interval секунд"""
+        if interval <= 0 or self.periodic is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                if self.owner is None or self.owner():
+                    self.submit()
+
+        self.periodic = threading.Thread(target=loop, name="backup-scheduler", daemon=True)
+        self.periodic.start()
+
+    def run_backup(self, full=False):
+        """Выполнить бэкап (вызывается в фоновом потоке)"""
+        # Манифест и сегменты меняются только под общей блокировкой: иначе другой
+        # воркер перезапишет манифест или удалит по своему манифесту наши сегменты.
+        # Блокировки игроков берутся уже под ней - в обратном порядке ее никто не берет
+        with self.manifest_lock:
+            self.manifest = self.load_manifest()
+            return self._run_backup(full)
+
+    def _run_backup(self, full):
+        backups = self.manifest["backups"]
+        previous = backups[-1] if backups else None
+
+        chain_length = 0
+        if previous:
+            chain_length = len(previous["segments"])
+        # Инкремент возможен, только если этот процесс видел все изменения после
+        # предыдущего бэкапа (он мог быть сделан до запуска или другим воркером)
+        if (previous is None or chain_length >= self.full_every
+                or previous.get("seq", -1) < self.db.tracking_seq):
+            full = True
+
+        # Изменения других воркеров попадают в кэш только через sync
+        self.db.sync()
+        seq = self.db.change_seq
+        if full:
+            changed = list(self.db.players.keys())
+            deleted = []
+        else:
+            changed, deleted = self.db.changed_since(previous["seq"])
+
+        players = {}
+        for user_id in changed:
+            # Копия под блокировкой игрока: сделка, выполняемая в этот момент,
+            # попадет в сегмент целиком или не попадет вовсе
+            with player_locks.hold(user_id):
+                player = self.db.get_player_data(user_id)
+                if player is not None:
+                    players[user_id] = copy.deepcopy(persisted_player(player))
+
+        players_digest, players_size = self.write_segment({"players": players, "deleted": deleted})
+        orders_digest, orders_size = self.write_segment({"p2p_orders": list(self.orders_provider())})
+
+        segments = [players_digest] if full else previous["segments"] + [players_digest]
+        now = datetime.now()
+        backup = {
+            "id": now.strftime('%Y%m%d_%H%M%S_%f'),
+            "created_at": now.isoformat(),
+            "created_ts": now.timestamp(),
+            "full": full,
+            "seq": seq,
+            "segments": segments,
+            "orders_segment": orders_digest,
+            "players_changed": len(players),
+            "players_deleted": len(deleted),
+            "bytes_written": players_size + orders_size
+        }
+
+        backups.append(backup)
+        self.apply_retention()
+        self.save_manifest()
+
+        print(f"💾 Backup {backup['id']} ({'full' if full else 'incremental'}): {len(players)} players")
+        return backup
+
+    def apply_retention(self):
+        """Оставить keep_full последних полных цепочек и удалить ненужные сегменты"""
+        backups = self.manifest["backups"]
+        full_indexes = [i for i, b in enumerate(backups) if b["full"]]
+        if len(full_indexes) > self.keep_full:
+            cutoff = full_indexes[-self.keep_full]
+            self.manifest["backups"] = backups = backups[cutoff:]
+
+        referenced = set()
+        for backup in backups:
+            referenced.update(backup["segments"])
+            referenced.add(backup["orders_segment"])
+
+        if not os.path.isdir(self.segments_dir):
+            return
+        for filename in os.listdir(self.segments_dir):
+            digest = filename.split('.', 1)[0]
+            if filename.endswith(".json.gz") and digest not in referenced:
+                os.remove(os.path.join(self.segments_dir, filename))
+
+    def find_backup(self, backup_id=None, until=None):
+        """Найти бэкап по id или последний, созданный не позже until (timestamp)"""
+        backups = self.manifest["backups"]
+        if backup_id:
+            for backup in backups:
+                if backup["id"] == backup_id:
+                    return backup
+            raise ValueError(f"Backup {backup_id} not found")
+
+        candidates = [b for b in backups if until is None or b["created_ts"] <= until]
+        if not candidates:
+            raise ValueError("No backup available for the requested point in time")
+        return candidates[-1]
+
+    def load_backup(self, backup, workers=4):
+        """Собрать состояние из цепочки сегментов. Сегменты читаются параллельно"""
+        digests = backup["segments"] + [backup["orders_segment"]]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            payloads = list(executor.map(self.read_segment, digests))
+
+        players = {}
+        for payload in payloads[:-1]:
+            players.update(payload["players"])
+            for user_id in payload["deleted"]:
+                players.pop(user_id, None)
+
+        return players, payloads[-1]["p2p_orders"]
+
+    def restore(self, backup_id=None, until=None, file=None):
+        """Восстановить данные из бэкапа и атомарно подменить текущее состояние"""
+        started = time.time()
+        if file:
+            players, orders = load_backup_file(file)
+            source = file
+        else:
+            # Сегменты читаются под блокировкой манифеста - их не удалит чужая ротация
+            with self.manifest_lock:
+                self.manifest = self.load_manifest()
+                backup = self.find_backup(backup_id, until)
+                players, orders = self.load_backup(backup)
+            source = backup["id"]
+
+        # После подмены все игроки получают новый номер изменения, так что
+        # следующий инкремент сохранит их всех
+        self.db.swap_players(players)
+        if self.orders_setter:
+            self.orders_setter(orders)
+
+        print(f"♻️ Restored {len(players)} players and {len(orders)} P2P orders from {source}")
+        return {
+            "source": source,
+            "players": len(players),
+            "p2p_orders": len(orders),
+            "duration": round(time.time() - started, 3)
+        }
+
+    def list_backups(self):
+        self.manifest = self.load_manifest()
+        return [
+            {k: b[k] for k in ("id", "created_at", "full", "players_changed", "players_deleted", "bytes_written")}
+            for b in self.manifest["backups"]
+        ]
+
+    def get_status(self):
+        self.manifest = self.load_manifest()
+        backups = self.manifest["backups"]
+        return {
+            "jobs": list(self.jobs.values())[-10:],
+            "backups_count": len(backups),
+            "latest": backups[-1] if backups else None
+        }
+
+
+def load_backup_file(path):
+    """Прочитать бэкап старого формата (backup_*.json) или снимок players_data.json"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if "players" in data and isinstance(data["players"], dict):
+        return data["players"], data.get("p2p_orders", [])
+    return data, []
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def main():
+    """Офлайн-восстановление: python backup.py restore [--id ID | --until ISO | --file PATH]
+
+    Без PLAYER_STORE пишет players_data.json и p2p_orders.json, с ним - заменяет
+    игроков и ордера в общем хранилище (работающие воркеры перечитают его сами).
+    История ордеров (TRADE_HISTORY_DB) и история метрик не восстанавливаются:
+    в них останутся записи, сделанные после момента бэкапа.
+    """
+    import argparse
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--backup-dir", default="backups")
+
+    parser = argparse.ArgumentParser(description="Backup tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List backups from the manifest", parents=[common])
+    restore_parser = subparsers.add_parser(
+        "restore", help="Restore players and P2P orders (into PLAYER_STORE if it is set)", parents=[common]
+    )
+    restore_parser.add_argument("--id", dest="backup_id")
+    restore_parser.add_argument("--until", help="Point in time (ISO format)")
+    restore_parser.add_argument("--file", help="Legacy backup_*.json or snapshot file")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        manager = BackupManager(None, list, backup_dir=args.backup_dir)
+        for backup in manager.list_backups():
+            print(f"{backup['id']}  {'full' if backup['full'] else 'incr'}  {backup['created_at']}  players: {backup['players_changed']}")
+        return
+
+    if args.file:
+        players, orders = load_backup_file(args.file)
+    else:
+        manager = BackupManager(None, list, backup_dir=args.backup_dir)
+        until = to_epoch(args.until) if args.until else None
+        players, orders = manager.load_backup(manager.find_backup(args.backup_id, until))
+
+    store_path = os.environ.get("PLAYER_STORE")
+    if store_path:
+        # Источник данных - общее хранилище: JSON файлы в этом режиме никто не читает
+        from sqlite_store import SqliteStore
+        store = SqliteStore(store_path)
+        store.replace_all({user_id: persisted_player(player) for user_id, player in players.items()})
+        store.save_orders(orders)
+        target = store_path
+    else:
+        # Пишем во временные файлы и переименовываем, чтобы не оставить наполовину записанные данные
+        write_json_atomic("players_data.json", players)
+        write_json_atomic("p2p_orders.json", orders)
+        target = "players_data.json"
+    print(f"♻️ Restored {len(players)} players and {len(orders)} P2P orders into {target}")
+    print("⚠️  Trade history and metrics history are not restored and may include later records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,690 @@
+"""Нагрузочный бенчмарк на синтетической популяции игроков.
+
+Генерирует игроков с портфелями, P2P стаканом и историей сделок прямо в
+файлы данных (players_data.json или SQLite хранилище PLAYER_STORE и
+trade_history.db), затем гоняет смесь настоящих эндпоинтов из нескольких
+клиентов: через тестовый клиент Flask в этом процессе или по HTTP к
+локальному серверу. Считает пропускную способность и p50/p95/p99 задержки
+по эндпоинтам и пишет результат в JSON для сравнения между версиями.
+С тем же --seed популяция и последовательность запросов каждого клиента
+одинаковы. Примеры:
+
+    python bench_load.py --players 100000 --requests 20000 --clients 8 --out load.json
+    python bench_load.py --players 1000000 --store --generate-only --workdir /data/bench
+    python bench_load.py --players 1000000 --store --reuse --workdir /data/bench \\
+        --server gunicorn --duration 60 --clients 32 --compare load.json
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from economy import CRYPTOS, MINING_CONFIG, calculate_trading_fee, create_new_player_data, persisted_player
+from memory_stats import percentiles
+from simulator import DEFAULT_BEHAVIOUR
+
+SYMBOLS = list(CRYPTOS.keys())
+
+# Смесь запросов по умолчанию: имя операции=вес
+DEFAULT_MIX = ("player=35,place_order=25,mine=15,p2p_orders=8,p2p_my_orders=5,"
+               "p2p_create=5,p2p_trade=4,p2p_cancel=2,admin_stats=1")
+
+# Файл с описанием популяции: по нему --reuse узнает готовый каталог
+POPULATION_FILE = "bench_population.json"
+# Сколько разных историй цен у игроков (как у настоящих, но без генерации на каждого)
+PRICE_TEMPLATES = 32
+HISTORY_DAYS = 30
+BATCH_SIZE = 5000
+
+
+def user_id_for(index):
+    return f"bench_{index}"
+
+
+def make_templates(seed):
+    """Цены и история цен, общие для групп игроков"""
+    random.seed(seed)
+    templates = []
+    for _ in range(PRICE_TEMPLATES):
+        player = persisted_player(create_new_player_data())
+        templates.append({"current_prices": player["current_prices"], "price_history": player["price_history"]})
+    return templates
+
+
+def make_player(index, rng, templates, history, now):
+    """Игрок и все его ордера (от старых к новым)"""
+    template = templates[index % len(templates)]
+    prices = template["current_prices"]
+    levels = DEFAULT_BEHAVIOUR["equipment_distribution"]
+    level = rng.choices(list(levels), weights=list(levels.values()))[0]
+
+    portfolio = {symbol: 0 for symbol in CRYPTOS}
+    for symbol in SYMBOLS:
+        if rng.random() < 0.4:
+            # Стоимость позиции - логнормальная, медиана около $150
+            portfolio[symbol] = round(rng.lognormvariate(5, 1.5) / prices[symbol], 8)
+
+    count = int(rng.expovariate(1 / history)) if history > 0 else 0
+    created_at = now - rng.uniform(0, HISTORY_DAYS * 86400)
+    times = sorted(rng.uniform(created_at, now) for _ in range(count))
+    orders = []
+    for order_id, timestamp in enumerate(times, 1):
+        symbol = rng.choice(SYMBOLS)
+        price = prices[symbol] * rng.uniform(0.9, 1.1)
+        amount = round(rng.uniform(5, 500) / price, 8)
+        orders.append({
+            "id": order_id,
+            "symbol": symbol,
+            "type": rng.choice(("buy", "sell")),
+            "amount": amount,
+            "price": price,
+            "total": amount * price,
+            "fee": calculate_trading_fee(amount, price, 'market'),
+            "status": "filled",
+            "timestamp": round(timestamp, 3)
+        })
+
+    player = {
+        "balance": round(rng.lognormvariate(6, 1.2), 2),
+        "portfolio": portfolio,
+        "orders": orders,
+        "price_history": template["price_history"],
+        "current_prices": prices,
+        "created_at": round(created_at, 3),
+        "last_login": round(rng.uniform(created_at, now), 3),
+        "username": f"Bench{index}",
+        "mining": {
+            "energy": rng.randint(0, MINING_CONFIG["max_energy"]),
+            "energy_updated_at": round(now - rng.uniform(0, 3600), 3),
+            # Кулдаун уже прошел: майнинг в бенчмарке не упирается в него сразу
+            "last_mining_time": round(now - rng.uniform(MINING_CONFIG["mining_cooldown"], 7 * 86400), 3),
+            "equipment_level": level,
+            "total_mined": {symbol: 0 for symbol in CRYPTOS},
+            "mining_power": MINING_CONFIG["equipment_levels"][level]["multiplier"]
+        },
+        "stats": {
+            "total_trades": count,
+            "total_orders": count,
+            "total_profit": 0,
+            "daily_bonus_claimed": False,
+            "login_streak": rng.randint(1, 30),
+            "total_mining_rewards": 0
+        }
+    }
+    return player, orders
+
+
+def make_p2p_order(order_id, user_id, player, rng, now):
+    held = [symbol for symbol in SYMBOLS if player["portfolio"][symbol] > 0]
+    if held and rng.random() < 0.6:
+        order_type, symbol = "sell", rng.choice(held)
+        amount = round(player["portfolio"][symbol] * rng.uniform(0.1, 0.5), 8)
+    else:
+        order_type, symbol = "buy", rng.choice(SYMBOLS)
+        amount = round(rng.uniform(10, 200) / player["current_prices"][symbol], 8)
+    price = player["current_prices"][symbol] * rng.uniform(0.95, 1.05)
+    created_at = round(now - rng.uniform(0, 7 * 86400), 3)
+    return {
+        "id": order_id,
+        "user_id": user_id,
+        "username": player["username"],
+        "symbol": symbol,
+        "amount": amount,
+        "price": price,
+        "total": amount * price,
+        "type": order_type,
+        "status": rng.choices(("active", "completed", "cancelled"), weights=(80, 15, 5))[0],
+        "created_at": created_at,
+        "updated_at": created_at
+    }
+
+
+def prepare_workdir(workdir):
+    """Очистить каталог прошлой популяции (чужой непустой каталог не трогаем)"""
+    if os.path.isdir(workdir) and os.listdir(workdir):
+        if not os.path.exists(os.path.join(workdir, POPULATION_FILE)):
+            raise SystemExit(f"❌ {workdir} is not empty and has no {POPULATION_FILE}, refusing to clear it")
+        shutil.rmtree(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+
+def generate(args):
+    """Записать популяцию в текущий каталог. Возвращает ее описание"""
+    from sqlite_store import SqliteStore, Transaction, connect
+    from trade_history import RECENT_ORDERS, SCHEMA as HISTORY_SCHEMA
+
+    started = time.perf_counter()
+    now = time.time()
+    templates = make_templates(args.seed)
+    rng = random.Random(args.seed)
+    p2p_count = min(args.p2p_orders, args.players)
+    p2p_owners = set(rng.sample(range(args.players), p2p_count))
+    p2p_orders = []
+
+    history = connect("trade_history.db")
+    history.executescript(HISTORY_SCHEMA)
+    store = SqliteStore(os.environ["PLAYER_STORE"]) if args.store else None
+    players_file = None if store else open("players_data.json.tmp", 'w', encoding='utf-8')
+    if players_file:
+        players_file.write("{")
+
+    journal_rows = 0
+    player_rows = []
+    order_rows = []
+
+    def flush():
+        with Transaction(history) as conn:
+            conn.executemany("INSERT INTO orders (user_id, order_id, symbol, data) VALUES (?, ?, ?, ?)", order_rows)
+        if store is not None:
+            with store.transaction() as conn:
+                conn.executemany("INSERT INTO players (user_id, data, version) VALUES (?, ?, 1)", player_rows)
+        del order_rows[:]
+        del player_rows[:]
+
+    for index in range(args.players):
+        user_id = user_id_for(index)
+        player, orders = make_player(index, rng, templates, args.history, now)
+        for order in orders:
+            order_rows.append((user_id, order["id"], order["symbol"],
+                               json.dumps(order, ensure_ascii=False, sort_keys=True)))
+        journal_rows += len(orders)
+        player["orders"] = orders[-RECENT_ORDERS:]
+        if index in p2p_owners:
+            p2p_orders.append(make_p2p_order(len(p2p_orders) + 1, user_id, player, rng, now))
+
+        payload = json.dumps(player, ensure_ascii=False)
+        if players_file:
+            players_file.write(("," if index else "") + json.dumps(user_id) + ":" + payload)
+        else:
+            player_rows.append((user_id, payload))
+        if len(order_rows) >= BATCH_SIZE * 10 or len(player_rows) >= BATCH_SIZE:
+            flush()
+        if (index + 1) % 100000 == 0:
+            print(f"🧪 Generated {index + 1:,} players ({time.perf_counter() - started:.0f}s)")
+    flush()
+    history.close()
+
+    if players_file:
+        players_file.write("}")
+        players_file.close()
+        os.replace("players_data.json.tmp", "players_data.json")
+    if store is not None:
+        store.save_orders(p2p_orders)
+    else:
+        with open("p2p_orders.json", 'w', encoding='utf-8') as f:
+            json.dump(p2p_orders, f, ensure_ascii=False)
+
+    population = population_params(args)
+    population.update({
+        "journal_orders": journal_rows,
+        "active_p2p_orders": sum(1 for order in p2p_orders if order["status"] == "active"),
+        "generated_at": datetime.now().isoformat(),
+        "generate_seconds": round(time.perf_counter() - started, 2)
+    })
+    with open(POPULATION_FILE, 'w', encoding='utf-8') as f:
+        json.dump(population, f, indent=2)
+    print(f"✅ Generated {args.players:,} players, {journal_rows:,} journal orders, "
+          f"{len(p2p_orders):,} P2P orders in {population['generate_seconds']}s")
+    return population
+
+
+def population_params(args):
+    return {
+        "players": args.players,
+        "seed": args.seed,
+        "store": args.store,
+        "history": args.history,
+        "p2p_orders": args.p2p_orders
+    }
+
+
+def load_population(args, workdir):
+    """Описание готовой популяции, если она создана с теми же параметрами"""
+    try:
+        with open(os.path.join(workdir, POPULATION_FILE), 'r', encoding='utf-8') as f:
+            population = json.load(f)
+    except (OSError, ValueError):
+        return None
+    params = population_params(args)
+    return population if all(population.get(k) == v for k, v in params.items()) else None
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"❌ Unknown operation in --mix: {name} (known: {', '.join(OPERATIONS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class ClientContext:
+    """Состояние одного клиента: свой генератор и своя часть активных P2P ордеров"""
+
+    def __init__(self, seed, players, admin_password, orders):
+        self.rng = random.Random(seed)
+        self.players = players
+        self.admin_password = admin_password
+        self.orders = orders
+
+    def user(self):
+        return user_id_for(self.rng.randrange(self.players))
+
+    def symbol(self):
+        return self.rng.choice(SYMBOLS)
+
+    def take_order(self):
+        if not self.orders:
+            return None
+        return self.orders.pop(self.rng.randrange(len(self.orders)))
+
+
+def op_player(ctx):
+    return "GET", f"/api/player/{ctx.user()}", None
+
+
+def op_place_order(ctx):
+    symbol = ctx.symbol()
+    amount = round(ctx.rng.uniform(5, 50) / CRYPTOS[symbol]["base_price"], 8)
+    return "POST", "/api/place_order", {
+        "user_id": ctx.user(), "symbol": symbol, "type": ctx.rng.choice(("buy", "sell")),
+        "amount": amount, "price_type": "market"
+    }
+
+
+def op_mine(ctx):
+    return "POST", "/api/mining/mine", {"user_id": ctx.user(), "symbol": ctx.symbol()}
+
+
+def op_p2p_orders(ctx):
+    return "GET", f"/api/p2p/orders?symbol={ctx.symbol()}", None
+
+
+def op_p2p_my_orders(ctx):
+    return "GET", f"/api/p2p/my_orders?user_id={ctx.user()}", None
+
+
+def op_p2p_create(ctx):
+    symbol = ctx.symbol()
+    price = CRYPTOS[symbol]["base_price"] * ctx.rng.uniform(0.95, 1.05)
+    return "POST", "/api/p2p/create_order", {
+        "user_id": ctx.user(), "symbol": symbol, "type": ctx.rng.choice(("buy", "sell")),
+        "amount": round(ctx.rng.uniform(10, 100) / price, 8), "price": price
+    }
+
+
+def op_p2p_trade(ctx):
+    order = ctx.take_order()
+    return "POST", "/api/p2p/execute_trade", {
+        "order_id": order["id"] if order else 1, "buyer_id": ctx.user()
+    }
+
+
+def op_p2p_cancel(ctx):
+    order = ctx.take_order()
+    return "POST", "/api/p2p/cancel_order", {
+        "order_id": order["id"] if order else 1, "user_id": order["user_id"] if order else ctx.user()
+    }
+
+
+def op_admin_stats(ctx):
+    return "POST", "/api/admin/stats", {"password": ctx.admin_password}
+
+
+OPERATIONS = {
+    "player": op_player,
+    "place_order": op_place_order,
+    "mine": op_mine,
+    "p2p_orders": op_p2p_orders,
+    "p2p_my_orders": op_p2p_my_orders,
+    "p2p_create": op_p2p_create,
+    "p2p_trade": op_p2p_trade,
+    "p2p_cancel": op_p2p_cancel,
+    "admin_stats": op_admin_stats
+}
+
+
+class TestClientTarget:
+    """Запросы через тестовый клиент Flask в этом процессе"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self.app.test_client()
+
+    def request(self, session, method, path, body):
+        """(статус, тело ответа)"""
+        response = session.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+    def close(self, session):
+        pass
+
+
+class HttpTarget:
+    """Запросы по HTTP, у каждого клиента свое keep-alive соединение"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+
+    def session(self):
+        return {"conn": None}
+
+    def request(self, session, method, path, body):
+        if session["conn"] is None:
+            session["conn"] = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            session["conn"].request(method, path, body=json.dumps(body) if body is not None else None,
+                                    headers=headers)
+            response = session["conn"].getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            # Соединение закрыто сервером - в следующем запросе откроем новое
+            self.close(session)
+            raise
+
+    def close(self, session):
+        if session["conn"] is not None:
+            session["conn"].close()
+            session["conn"] = None
+
+
+def start_server(kind, port, workdir):
+    """Запустить сервер приложения на данных из workdir и дождаться /health"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    if kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(repo, "gunicorn.conf.py"), "app:app"]
+    else:
+        command = [sys.executable, os.path.join(repo, "app.py")]
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=os.pathsep.join(filter(None, [repo, os.environ.get("PYTHONPATH")])))
+    log = open(os.path.join(workdir, "server.log"), 'ab')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    started = time.perf_counter()
+    while process.poll() is None:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return process, time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"❌ Server exited with code {process.returncode}, see {workdir}/server.log")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def fetch_active_orders(target):
+    """Активные P2P ордера цели: их покупают и отменяют операции p2p_trade и p2p_cancel"""
+    session = target.session()
+    try:
+        status, data = target.request(session, "GET", "/api/p2p/orders", None)
+    finally:
+        target.close(session)
+    if status != 200:
+        return []
+    return [{"id": order["id"], "user_id": order["user_id"]} for order in json.loads(data).get("orders", [])]
+
+
+def run_load(target, args, mix, active_orders):
+    """Прогнать нагрузку: у каждого клиента свой поток, генератор и соединение"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    barrier = threading.Barrier(args.clients + 1)
+    results = [None] * args.clients
+    per_client = args.requests // args.clients if args.requests else None
+
+    def client(number):
+        ctx = ClientContext(args.seed * 1000 + number, args.players, args.admin_password,
+                            active_orders[number::args.clients])
+        latencies = {name: [] for name in names}
+        statuses = {name: {} for name in names}
+        session = target.session()
+        barrier.wait()
+        deadline = time.perf_counter() + args.duration if args.duration else None
+        done = 0
+        try:
+            while True:
+                if per_client is not None and done >= per_client + args.warmup:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                name = ctx.rng.choices(names, weights)[0]
+                method, path, body = OPERATIONS[name](ctx)
+                started = time.perf_counter()
+                try:
+                    status, _ = target.request(session, method, path, body)
+                except Exception:
+                    status = 0
+                elapsed = time.perf_counter() - started
+                done += 1
+                if done <= args.warmup:
+                    continue
+                latencies[name].append(int(elapsed * 1000000))
+                statuses[name][status] = statuses[name].get(status, 0) + 1
+        finally:
+            target.close(session)
+        results[number] = (latencies, statuses)
+
+    threads = [threading.Thread(target=client, args=(n,), name=f"bench-client-{n}") for n in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def latency_summary(values):
+    """Перцентили задержки в мс (значения - микросекунды)"""
+    return {key: round(value / 1000, 3) for key, value in percentiles(values, (50, 95, 99)).items()}
+
+
+def summarize(results, elapsed):
+    endpoints = {}
+    all_latencies = []
+    total_errors = 0
+    for name in sorted({name for latencies, _ in results for name in latencies}):
+        latencies = [value for client, _ in results for value in client.get(name, [])]
+        statuses = {}
+        for _, client in results:
+            for status, count in client.get(name, {}).items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+        if not latencies:
+            continue
+        # Ошибки - 5xx и запросы без ответа (status 0); 4xx - ответы приложения
+        errors = sum(count for status, count in statuses.items() if status == "0" or status.startswith("5"))
+        total_errors += errors
+        all_latencies.extend(latencies)
+        endpoints[name] = {
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "errors": errors,
+            "status": statuses,
+            "latency_ms": latency_summary(latencies)
+        }
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "requests": len(all_latencies),
+        "errors": total_errors,
+        "throughput_rps": round(len(all_latencies) / elapsed, 2) if elapsed else 0,
+        "latency_ms": latency_summary(all_latencies),
+        "endpoints": endpoints
+    }
+
+
+def change(old, new):
+    if not old:
+        return "n/a"
+    return f"{(new / old - 1) * 100:+.1f}%"
+
+
+def compare(baseline, report, threshold=None):
+    """Сравнить с прошлым результатом. Возвращает список регрессий p95 больше threshold процентов"""
+    regressions = []
+    rows = [("total", baseline, report)] + [
+        (name, baseline["endpoints"][name], report["endpoints"][name])
+        for name in report["endpoints"] if name in baseline.get("endpoints", {})
+    ]
+    for name, old, new in rows:
+        print(f"📈 {name}: {old['throughput_rps']} -> {new['throughput_rps']} req/s "
+              f"({change(old['throughput_rps'], new['throughput_rps'])}), "
+              f"p50 {change(old['latency_ms'].get('p50'), new['latency_ms'].get('p50'))}, "
+              f"p95 {change(old['latency_ms'].get('p95'), new['latency_ms'].get('p95'))}, "
+              f"p99 {change(old['latency_ms'].get('p99'), new['latency_ms'].get('p99'))}")
+        old_p95, new_p95 = old["latency_ms"].get("p95"), new["latency_ms"].get("p95")
+        if threshold is not None and old_p95 and new_p95 > old_p95 * (1 + threshold / 100):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test on a synthetic player population")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="bench_data", help="Directory for the generated data files")
+    parser.add_argument("--store", action="store_true", help="Use the SQLite player store (PLAYER_STORE)")
+    parser.add_argument("--history", type=float, default=20, help="Mean journal orders per player")
+    parser.add_argument("--p2p-orders", type=int, help="P2P orders in the book (default players / 50)")
+    parser.add_argument("--reuse", action="store_true",
+                        help="Keep an existing population with the same parameters instead of regenerating")
+    parser.add_argument("--generate-only", action="store_true")
+    parser.add_argument("--server", choices=("app", "gunicorn"),
+                        help="Start a local server on the data (default: Flask test client in this process)")
+    parser.add_argument("--url", help="Load an already running server instead (its own data is used)")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=10000, help="Total measured requests")
+    parser.add_argument("--duration", type=float, help="Run for N seconds instead of a fixed request count")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per client")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights, e.g. player=50,mine=50")
+    parser.add_argument("--admin-password", default=os.environ.get("ADMIN_PASSWORD", "bench"))
+    parser.add_argument("--out", help="Write results to a JSON file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare with")
+    parser.add_argument("--fail-threshold", type=float,
+                        help="Exit with code 1 if any p95 is this many percent worse than the baseline")
+    args = parser.parse_args()
+    if args.p2p_orders is None:
+        args.p2p_orders = args.players // 50
+    if args.duration:
+        args.requests = None
+    mix = parse_mix(args.mix)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    population = None
+    if not args.url:
+        # Приложение берет файлы данных из текущего каталога, а хранилище - из окружения,
+        # поэтому все настраивается до его импорта
+        workdir = os.path.abspath(args.workdir)
+        population = load_population(args, workdir) if args.reuse else None
+        if population is None:
+            prepare_workdir(workdir)
+        os.chdir(workdir)
+        if args.store:
+            os.environ["PLAYER_STORE"] = os.path.join(workdir, "players.db")
+        else:
+            os.environ.pop("PLAYER_STORE", None)
+        os.environ["ADMIN_PASSWORD"] = args.admin_password
+
+        if population is None:
+            population = generate(args)
+        else:
+            print(f"♻️ Reusing population in {workdir}")
+        if args.generate_only:
+            return
+
+    server = None
+    log = None
+    started = time.perf_counter()
+    if args.url:
+        target = HttpTarget(args.url)
+    elif args.server:
+        server, _ = start_server(args.server, args.port, os.getcwd())
+        target = HttpTarget(f"http://127.0.0.1:{args.port}")
+    else:
+        # Вывод приложения (по строке на запрос) - в server.log, а не в отчет
+        log = open("server.log", 'a', encoding='utf-8')
+        with contextlib.redirect_stdout(log):
+            import app as app_module
+        target = TestClientTarget(app_module.app)
+    startup_seconds = time.perf_counter() - started
+    print(f"🚀 Target ready in {startup_seconds:.1f}s")
+
+    try:
+        active_orders = fetch_active_orders(target)
+        print(f"🔥 Running {args.requests or f'{args.duration}s of'} requests from {args.clients} clients")
+        with contextlib.redirect_stdout(log) if log else contextlib.nullcontext():
+            results, elapsed = run_load(target, args, mix, active_orders)
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    report = summarize(results, elapsed)
+    report = {
+        "config": {
+            "target": "url" if args.url else args.server or "test_client",
+            "clients": args.clients,
+            "requests": args.requests,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": mix,
+            "seed": args.seed
+        },
+        "population": population,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "started_at": datetime.now().isoformat(),
+        "startup_seconds": round(startup_seconds, 3),
+        **report
+    }
+
+    latency = report["latency_ms"]
+    print(f"📊 total: {report['requests']:,} req, {report['throughput_rps']} req/s, {report['errors']} errors, "
+          f"p50 {latency.get('p50')}ms p95 {latency.get('p95')}ms p99 {latency.get('p99')}ms")
+    for name, endpoint in report["endpoints"].items():
+        latency = endpoint["latency_ms"]
+        print(f"📊 {name}: {endpoint['requests']:,} req, {endpoint['throughput_rps']} req/s, "
+              f"{endpoint['errors']} errors, p50 {latency['p50']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms")
+
+    if out:
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.fail_threshold)
+        if regressions:
+            print(f"❌ p95 regressions over {args.fail_threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
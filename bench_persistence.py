@@ -0,0 +1,81 @@
+"""Бенчмарк формата сохранения игроков.
+
+Сравнивает старый формат (все поля, включая стаканы и стоимость портфеля)
+с текущим (только исходные поля, вычисляемые восстанавливаются при
+загрузке): размер players_data.json, время записи снимка и время загрузки.
+Пример:
+
+    python bench_persistence.py --players 10000 --repeat 3
+"""
+import argparse
+import json
+import random
+import time
+
+from economy import CRYPTOS, create_new_player_data, hydrate_player, persisted_player
+
+
+def make_players(count, seed):
+    random.seed(seed)
+    players = {}
+    for i in range(count):
+        player = create_new_player_data()
+        player["username"] = f"bench_{i}"
+        player["balance"] = round(random.uniform(0, 5000), 2)
+        for symbol in CRYPTOS:
+            if random.random() < 0.5:
+                player["portfolio"][symbol] = round(random.uniform(0, 10), 6)
+        hydrate_player(player)
+        players[f"bench_{i}"] = player
+    return players
+
+
+def measure(players, repeat, hydrate):
+    dump_seconds = []
+    load_seconds = []
+    raw = ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        raw = json.dumps(players, indent=2, ensure_ascii=False)
+        dump_seconds.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        loaded = json.loads(raw)
+        if hydrate:
+            for player in loaded.values():
+                hydrate_player(player)
+        load_seconds.append(time.perf_counter() - started)
+    return {
+        "bytes": len(raw.encode('utf-8')),
+        "dump_seconds": round(min(dump_seconds), 4),
+        "load_seconds": round(min(load_seconds), 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Player persistence format benchmark")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write results to a JSON file")
+    args = parser.parse_args()
+
+    players = make_players(args.players, args.seed)
+    results = {
+        "players": args.players,
+        "legacy": measure(players, args.repeat, hydrate=False),
+        "current": measure({k: persisted_player(v) for k, v in players.items()}, args.repeat, hydrate=True)
+    }
+
+    legacy, current = results["legacy"], results["current"]
+    for name in ("bytes", "dump_seconds", "load_seconds"):
+        print(f"📦 {name}: {legacy[name]:,} -> {current[name]:,} "
+              f"({(current[name] / legacy[name] - 1) * 100:+.0f}%)")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+
+from economy import CRYPTOS
+from metrics import Ring
+
+# (имя, длительность свечи в секундах, число свечей в кольце)
+INTERVALS = [("1m", 60, 1440), ("5m", 300, 2016), ("1h", 3600, 720), ("1d", 86400, 730)]
+
+COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# Бинарный формат: заголовок (число свечей, длительность), затем записи time + OHLCV
+BINARY_HEADER = struct.Struct("<II")
+BINARY_RECORD = struct.Struct("<I5d")
+
+
+class CandleAggregator:
+    """OHLCV свечи по каждой монете на нескольких интервалах.
+
+    Цена свечей - одна опорная цена рынка на монету (sample раз в секунду),
+    а не цены отдельных игроков: у каждого игрока свое случайное блуждание,
+    и их смесь давала бы ложные тени. Сделки добавляют только объем.
+    Тики и объем пишутся только в минутную свечу. Когда минутная свеча
+    закрывается, она сливается в пятиминутную, закрытая пятиминутная - в
+    часовую и так далее. Незакрытые свечи младших интервалов при запросе
+    досливаются в последнюю свечу старшего, так что ответ всегда точный.
+
+    С несколькими воркерами (share) свечи строит и сохраняет один владелец,
+    остальные передают ему объем сделок через общее хранилище.
+    """
+
+    def __init__(self, history_file="candles_history.json.gz"):
+        self.history_file = history_file
+        self.lock = threading.Lock()
+        self.rings = {
+            symbol: {name: Ring(step, size, COLUMNS) for name, step, size in INTERVALS}
+            for symbol in CRYPTOS
+        }
+        # Начало текущей (незакрытой) минутной свечи по каждой монете
+        self.open_minute = {}
+        # Последняя опорная цена: по ней учитывается объем сделок между тиками
+        self.last_price = {}
+        self.worker = None
+        self.store = None
+        self.owner = None
+        self.refresh = None
+        self.owning = False
+        self.loaded_mtime = None
+        # Объем сделок, еще не переданный владельцу
+        self.pending_volume = {}
+
+    def share(self, store, owner, refresh=None):
+        """Режим нескольких воркеров: owner() истинно в процессе-владельце,
+        refresh() подтягивает изменения других воркеров перед тиком цен"""
+        self.store = store
+        self.owner = owner
+        self.refresh = refresh
+
+    def is_owner(self):
+        if self.store is None:
+            return True
+        owner = self.owner()
+        if owner and not self.owning:
+            # Процесс только что стал владельцем: продолжаем сохраненные свечи
+            self.load()
+        self.owning = owner
+        return owner
+
+    def record(self, symbol, price, volume=0.0, now=None):
+        """Учесть цену (тик или сделку) и объем"""
+        if symbol not in self.rings:
+            return
+        now = int(now or time.time())
+        minute = now - now % 60
+        rings = self.rings[symbol]
+
+        with self.lock:
+            previous = self.open_minute.get(symbol)
+            if previous is not None and previous != minute:
+                self.close_candles(rings, previous, now)
+            self.open_minute[symbol] = minute
+            self.last_price[symbol] = price
+            self.merge(rings["1m"], minute, price, price, price, price, volume)
+
+    def sample(self, prices, now=None):
+        """Тик опорных цен: {монета: цена}"""
+        for symbol, price in prices.items():
+            self.record(symbol, price, 0.0, now)
+
+    def add_volume(self, symbol, volume, now=None):
+        """Объем сделки по последней опорной цене"""
+        if symbol not in self.rings:
+            return
+        if self.store is not None and not self.owning:
+            with self.lock:
+                self.pending_volume[symbol] = self.pending_volume.get(symbol, 0.0) + volume
+            return
+        self.record(symbol, self.last_price.get(symbol, CRYPTOS[symbol]["base_price"]), volume, now)
+
+    def take_volume(self):
+        with self.lock:
+            pending, self.pending_volume = self.pending_volume, {}
+        return pending
+
+    def tick(self, price_source):
+        """Шаг фонового потока: владелец учитывает объем и опорные цены,
+        остальные передают ему накопленный объем"""
+        if not self.is_owner():
+            pending = self.take_volume()
+            if pending:
+                self.store.add_counters({f"candles.volume.{symbol}": volume for symbol, volume in pending.items()})
+            return
+        volumes = self.take_volume()
+        if self.store is not None:
+            for symbol, volume in self.store.take_counters("candles.volume.").items():
+                volumes[symbol] = volumes.get(symbol, 0.0) + volume
+        if self.refresh is not None:
+            self.refresh()
+        if price_source is not None:
+            self.sample(price_source())
+        for symbol, volume in volumes.items():
+            self.add_volume(symbol, volume)
+
+    def close_candles(self, rings, previous, now):
+        """Слить закрывшиеся свечи в следующий интервал по цепочке"""
+        for (lower, lower_step, _), (higher, step, _) in zip(INTERVALS, INTERVALS[1:]):
+            candle = self.read(rings[lower], previous - previous % lower_step)
+            if candle is None:
+                break
+            self.merge(rings[higher], previous - previous % step, *candle[1:])
+            if previous // step == now // step:
+                break
+
+    def merge(self, ring, bucket_ts, open_, high, low, close, volume):
+        slot = (bucket_ts // ring.step) % ring.size
+        values = ring.values
+        if ring.times[slot] != bucket_ts:
+            ring.times[slot] = bucket_ts
+            values["open"][slot] = open_
+            values["high"][slot] = high
+            values["low"][slot] = low
+            values["close"][slot] = close
+            values["volume"][slot] = volume
+        else:
+            values["high"][slot] = max(values["high"][slot], high)
+            values["low"][slot] = min(values["low"][slot], low)
+            values["close"][slot] = close
+            values["volume"][slot] += volume
+
+    def read(self, ring, bucket_ts):
+        slot = (bucket_ts // ring.step) % ring.size
+        if ring.times[slot] != bucket_ts:
+            return None
+        return (bucket_ts,) + tuple(ring.values[column][slot] for column in COLUMNS)
+
+    def reload_shared(self):
+        """Не владелец: перечитать свечи, если владелец сохранил новые"""
+        if self.store is None or self.owning:
+            return
+        try:
+            mtime = os.path.getmtime(self.history_file)
+        except OSError:
+            return
+        if mtime != self.loaded_mtime:
+            self.load(quiet=True)
+
+    def query(self, symbol, interval="1m", since=None, limit=500, now=None):
+        """Список свечей (time, open, high, low, close, volume) по возрастанию времени"""
+        self.reload_shared()
+        if symbol not in self.rings:
+            raise ValueError("Invalid symbol")
+        names = [name for name, _, _ in INTERVALS]
+        if interval not in names:
+            raise ValueError(f"Interval must be one of: {', '.join(names)}")
+        level = names.index(interval)
+        rings = self.rings[symbol]
+        ring = rings[interval]
+        now = int(now or time.time())
+        since = since if since is not None else now - ring.step * ring.size
+
+        with self.lock:
+            candles = [self.read(ring, bucket_ts) for bucket_ts, _ in ring.buckets(since, now + 1)]
+
+            # Досливаем незакрытые свечи младших интервалов в текущую свечу
+            minute = self.open_minute.get(symbol)
+            if minute is not None and level > 0:
+                current = minute - minute % ring.step
+                pending = None
+                for name, step, _ in INTERVALS[:level]:
+                    candle = self.read(rings[name], minute - minute % step)
+                    if candle is not None:
+                        pending = candle if pending is None else combine(candle, pending)
+                if pending is not None and current >= since:
+                    pending = (current,) + pending[1:]
+                    if candles and candles[-1][0] == current:
+                        candles[-1] = combine(candles[-1], pending)
+                    else:
+                        candles.append(pending)
+
+        if limit:
+            candles = candles[-limit:]
+        return candles
+
+    def save(self):
+        with self.lock:
+            data = {
+                "saved_at": time.time(),
+                "open_minute": self.open_minute,
+                "rings": {symbol: {name: ring.dump() for name, ring in rings.items()}
+                          for symbol, rings in self.rings.items()}
+            }
+        tmp_path = self.history_file + ".tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.history_file)
+
+    def load(self, quiet=False):
+        try:
+            if os.path.exists(self.history_file):
+                mtime = os.path.getmtime(self.history_file)
+                with gzip.open(self.history_file, 'rt', encoding='utf-8') as f:
+                    data = json.load(f)
+                with self.lock:
+                    for symbol, rings in data["rings"].items():
+                        for name, ring_data in rings.items():
+                            if symbol in self.rings and name in self.rings[symbol]:
+                                self.rings[symbol][name].restore(ring_data)
+                    self.open_minute = {k: v for k, v in data.get("open_minute", {}).items() if k in self.rings}
+                    self.loaded_mtime = mtime
+                if not quiet:
+                    print(f"✅ Loaded candles from {self.history_file}")
+        except Exception as e:
+            print(f"❌ Error loading candles: {e}")
+
+    def start(self, persist_every=60, price_source=None, interval=1.0):
+        """Фоновый поток: тик опорных цен из price_source() раз в interval секунд
+        и сохранение истории раз в persist_every секунд"""
+        if self.worker is not None or (price_source is None and self.store is None and persist_every <= 0):
+            return
+
+        def loop():
+            last_save = time.time()
+            while True:
+                time.sleep(interval if price_source is not None or self.store is not None else persist_every)
+                try:
+                    self.tick(price_source)
+                    # Файл свечей пишет только владелец
+                    if persist_every > 0 and self.is_owner() and time.time() - last_save >= persist_every:
+                        last_save = time.time()
+                        self.save()
+                except Exception as e:
+                    print(f"❌ Error in candles worker: {e}")
+
+        self.worker = threading.Thread(target=loop, name="candles-saver", daemon=True)
+        self.worker.start()
+
+
+def combine(first, second):
+    """Объединить две последовательные свечи (first раньше second)"""
+    return (first[0], first[1], max(first[2], second[2]), min(first[3], second[3]),
+            second[4], first[5] + second[5])
+
+
+def encode_binary(candles, step):
+    """Упаковать свечи: заголовок <II (число, длительность), записи <I5d (time, o, h, l, c, v)"""
+    buffer = bytearray(BINARY_HEADER.size + BINARY_RECORD.size * len(candles))
+    BINARY_HEADER.pack_into(buffer, 0, len(candles), step)
+    offset = BINARY_HEADER.size
+    for candle in candles:
+        BINARY_RECORD.pack_into(buffer, offset, int(candle[0]), *candle[1:])
+        offset += BINARY_RECORD.size
+    return bytes(buffer)
+
+
+def encode_compact(symbol, interval, step, candles):
+    """Колоночный JSON: одинаковые ключи не повторяются для каждой свечи"""
+    columns = list(zip(*candles)) if candles else [[] for _ in range(6)]
+    return {
+        "symbol": symbol,
+        "interval": interval,
+        "step": step,
+        "t": [int(t) for t in columns[0]],
+        "o": list(columns[1]),
+        "h": list(columns[2]),
+        "l": list(columns[3]),
+        "c": list(columns[4]),
+        "v": list(columns[5])
+    }
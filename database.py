@@ -1,84 +1,507 @@
 import json
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 
+from economy import (
+    DERIVED_FIELDS, VALUATION_FIELDS, VALUATION_INPUTS, hydrate_player, persisted_player, recompute_valuation
+)
+from locks import player_locks
+from snapshots import ForkSnapshotter, write_snapshot
+from sqlite_store import SqliteStore, StaleWriteError
+from telemetry import save_bytes, save_duration, telemetry
+from timestamps import migrate_player_times, now_ts
+
+# Сколько последних изменений хранить для ленты изменений админки
+CHANGE_LOG_SIZE = 10000
+
 class Database:
     def __init__(self):
         self.data_file = "players_data.json"
+        # Общее хранилище для нескольких воркеров (PLAYER_STORE=путь к SQLite файлу).
+        # Без него данные живут в памяти процесса и сбрасываются в JSON файл
+        store_path = os.environ.get("PLAYER_STORE")
+        self.store = SqliteStore(store_path) if store_path else None
+        self.row_versions = {}
+        self.store_seq = 0
+        # Загруженный файл в старом формате (вычисляемые поля, время ISO строками) - перезапишем его
+        self.legacy_format = False
         self.players = self.load_data()
+        # Счетчик изменений: номер последнего изменения для каждого игрока и каждого его поля.
+        # С общим хранилищем это номер строки журнала changes, одинаковый во всех воркерах.
+        # Без него - свой счетчик от времени запуска в мс, чтобы версии не повторялись после перезапуска
+        self.change_seq = self.store_seq if self.store is not None else int(time.time() * 1000)
+        self.player_seq = {}
+        self.field_seq = {}
+        self.deleted_seq = {}
+        # Ограниченный журнал изменений (seq, op, user_id, fields). Все изменения
+        # с номером больше change_log_floor гарантированно есть в журнале
+        self.change_log = deque(maxlen=CHANGE_LOG_SIZE)
+        self.change_log_floor = self.change_seq
+        # changed_since(seq) полон только для seq не меньше номера на момент запуска:
+        # более ранние изменения этот процесс не видел
+        self.tracking_seq = self.change_seq
+        self.reload_thread = None
+        self.reload_status = {"state": "idle"}
+        self.listeners = []
+        # lock защищает счетчики изменений и набор игроков, save_lock - запись файла.
+        # Данные отдельного игрока защищаются блокировками игроков (locks.player_locks)
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        # SNAPSHOT_MODE=fork (по умолчанию) пишет файл данных в дочернем процессе,
+        # sync - прямо в запросе, как раньше
+        self.snapshotter = None
+        if (self.store is None and hasattr(os, "fork")
+                and os.environ.get("SNAPSHOT_MODE", "fork") == "fork"):
+            self.snapshotter = ForkSnapshotter(
+                self.data_file, self.real_players, self.write_barrier,
+                min_interval=float(os.environ.get("SNAPSHOT_MIN_INTERVAL", 1)),
+                on_snapshot=self.observe_save
+            )
+        if self.legacy_format:
+            print(f"♻️ Rewriting {self.data_file} in the compact format")
+            self.save_data()
+    
+    @contextmanager
+    def write_barrier(self):
+        """Все блокировки игроков и lock базы. Обработчики меняют записи игроков
+        под блокировками игроков, поэтому одного self.lock для снимка мало"""
+        with player_locks.hold_all(), self.lock:
+            yield
+    
+    def add_listener(self, listener):
+        """Подписаться на изменения: listener(op, user_id, player, fields)"""
+        self.listeners.append(listener)
+    
+    def notify(self, op, user_id, player, fields=None):
+        for listener in self.listeners:
+            try:
+                listener(op, user_id, player, fields)
+            except Exception as e:
+                print(f"❌ Error in database listener: {e}")
+    
+    def next_seq(self, seq=None):
+        """Номер изменения: следующий по своему счетчику или seq из журнала хранилища"""
+        if seq is None:
+            seq = self.change_seq + 1
+        self.change_seq = max(self.change_seq, seq)
+        return seq
+    
+    def mark_changed(self, user_id, op="update", fields=None, seq=None):
+        """Отметить игрока как измененного. fields - измененные поля верхнего уровня (None - все)"""
+        with self.lock:
+            seq = self.next_seq(seq)
+            player = self.players.get(user_id)
+            self.player_seq[user_id] = seq
+            self.deleted_seq.pop(user_id, None)
+            
+            if fields is None or user_id not in self.field_seq:
+                self.field_seq[user_id] = {field: seq for field in (player or {})}
+            else:
+                versions = self.field_seq[user_id]
+                for field in fields:
+                    versions[field] = seq
+            
+            self.log_change(seq, op, user_id, fields)
+            self.notify(op, user_id, player, fields)
+        return seq
+    
+    def log_change(self, seq, op, user_id, fields=None):
+        if len(self.change_log) == self.change_log.maxlen:
+            self.change_log_floor = self.change_log[0][0]
+        self.change_log.append((seq, op, user_id, list(fields) if fields is not None else None))
+    
+    def changes_since(self, since, limit=None):
+        """Изменения после номера since из журнала.
+
+        Возвращает (изменения, truncated). truncated=True означает, что журнал
+        уже не содержит всех изменений после since и нужна полная перезагрузка.
+        """
+        self.sync()
+        with self.lock:
+            if since < self.change_log_floor or since > self.change_seq:
+                return [], True
+            changes = [entry for entry in self.change_log if entry[0] > since]
+        if limit is not None:
+            changes = changes[:limit]
+        return changes, False
+    
+    def get_version(self, user_id):
+        """Номер последнего изменения игрока"""
+        return self.player_seq.get(user_id, 0)
+    
+    def fields_changed_since(self, user_id, since):
+        """Поля игрока, измененные после версии since (None - неизвестно, нужен полный ответ)"""
+        if since > self.change_seq or user_id not in self.field_seq:
+            return None
+        return [field for field, seq in self.field_seq[user_id].items() if seq > since]
+    
+    def swap_players(self, players, save=True):
+        """Атомарно заменить набор игроков целиком (новое состояние собирается заранее).
+
+        Подмена идет под write_barrier: ни один обработчик не начнет изменение игрока
+        в старом наборе, чтобы закончить его уже после подмены. Вызывать без
+        удерживаемых блокировок игроков.
+        """
+        players = {k: hydrate_player(v) for k, v in players.items() if not k.startswith('trader_')}
+        with self.write_barrier():
+            if self.store is not None:
+                self.row_versions, self.store_seq = self.store.replace_all(
+                    {user_id: persisted_player(player) for user_id, player in players.items()}
+                )
+                self.swap_local(players, self.store_seq)
+            else:
+                self.swap_local(players)
+        if save:
+            self.save_data()
+    
+    def swap_local(self, players, seq=None):
+        with self.lock:
+            removed = set(self.players) - set(players)
+            # Одно присваивание ссылки: запросы видят либо старый, либо новый набор
+            self.players = players
+            seq = self.next_seq(seq)
+            self.player_seq = {user_id: seq for user_id in players}
+            self.field_seq = {}
+            self.deleted_seq = {user_id: seq for user_id in removed}
+            self.change_log.clear()
+            self.change_log_floor = seq
+            self.notify("reset", None, players)
+    
+    def reload_async(self):
+        """Перечитать данные в фоновом потоке и подменить набор игроков.
+
+        С общим хранилищем перечитывается оно: файл данных в этом режиме
+        устаревший, и его замена затерла бы изменения всех воркеров.
+
+        Возвращает False, если перезагрузка уже выполняется.
+        """
+        # Проверка и запуск под одной блокировкой - два запроса не запустят две перезагрузки
+        with self.lock:
+            if self.reload_thread is not None and self.reload_thread.is_alive():
+                return False
+            
+            self.reload_status = {
+                "state": "running",
+                "phase": "reading",
+                "started_at": datetime.now().isoformat()
+            }
+            self.reload_thread = threading.Thread(target=self.run_reload, name="db-reload", daemon=True)
+            self.reload_thread.start()
+            return True
+    
+    def run_reload(self):
+        status = self.reload_status
+        started = time.time()
+        try:
+            if self.store is not None:
+                status["phase"] = "reading_store"
+                # sync() перечитывает хранилище под блокировками вызывающего обработчика,
+                # а фоновая перезагрузка сама берет барьер
+                with self.write_barrier():
+                    status["players"] = self.reload_from_store()
+                status["state"] = "done"
+                return
+            with open(self.data_file, 'rb') as f:
+                raw = f.read()
+            status["bytes"] = len(raw)
+            
+            status["phase"] = "parsing"
+            data = json.loads(raw)
+            status["parse_seconds"] = round(time.time() - started, 3)
+            
+            status["phase"] = "validating"
+            players = validate_players(data)
+            
+            status["phase"] = "swapping"
+            self.swap_players(players, save=False)
+            
+            status["players"] = len(players)
+            status["state"] = "done"
+            print(f"✅ Reloaded {len(players)} real players from file")
+        except Exception as e:
+            status["state"] = "failed"
+            status["error"] = str(e)
+            print(f"❌ Error reloading data: {e}")
+        finally:
+            status.pop("phase", None)
+            status["duration"] = round(time.time() - started, 3)
+            status["finished_at"] = datetime.now().isoformat()
+    
+    def changed_since(self, seq):
+        """Игроки, измененные и удаленные после указанного номера изменения"""
+        changed = [k for k, v in list(self.player_seq.items()) if v > seq]
+        deleted = [k for k, v in list(self.deleted_seq.items()) if v > seq]
+        return changed, deleted
     
     def load_data(self):
         """Загрузка данных из файла"""
+        if self.store is not None:
+            return self.load_from_store()
         try:
             if os.path.exists(self.data_file):
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     # Фильтруем только реальных пользователей (не начинающихся с 'trader_')
                     real_players = {k: v for k, v in data.items() if not k.startswith('trader_')}
+                    self.legacy_format = is_legacy_format(real_players)
+                    for player in real_players.values():
+                        hydrate_player(player)
                     print(f"✅ Loaded {len(real_players)} real players from file")
                     return real_players
         except Exception as e:
             print(f"❌ Error loading data: {e}")
         return {}
     
-    def save_data(self):
-        """Сохранение данных в файл"""
+    def load_from_store(self):
+        if self.store.count() == 0 and os.path.exists(self.data_file):
+            # Первый запуск с общим хранилищем - переносим игроков из JSON файла
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                players = validate_players(json.load(f))
+            self.store.replace_all({user_id: persisted_player(player) for user_id, player in players.items()})
+            print(f"✅ Migrated {len(players)} players from {self.data_file} to {self.store.path}")
+        compacted = self.store.compact_players(compact_record, markers=LEGACY_MARKERS)
+        if compacted:
+            print(f"♻️ Converted {compacted} stored players to the compact format")
+        players, self.row_versions, self.store_seq = self.store.load_all()
+        for player in players.values():
+            hydrate_player(player)
+        print(f"✅ Loaded {len(players)} real players from {self.store.path}")
+        return players
+    
+    def sync(self):
+        """Подтянуть в кэш изменения из общего журнала, свои и других воркеров, по порядку"""
+        if self.store is None:
+            return
+        with self.lock:
+            floor, changes = self.store.changes_since(self.store_seq)
+            if not changes:
+                return
+            if floor > self.store_seq + 1 or any(user_id is None for _, user_id, _, _ in changes):
+                # Кто-то заменил всех игроков или журнал обрезан дальше нашего номера -
+                # пропущенные изменения не восстановить, перечитываем всех
+                self.reload_from_store()
+                return
+            # Последнее изменение каждого игрока и все его измененные поля (None - все)
+            latest = {}
+            for seq, user_id, op, fields in changes:
+                previous = latest.pop(user_id, None)
+                if previous is not None:
+                    fields = None if previous[2] is None or fields is None else previous[2] + fields
+                latest[user_id] = (seq, op, fields)
+            for user_id, (seq, op, fields) in latest.items():
+                self.apply_row(user_id, seq, op, fields)
+            self.store_seq = changes[-1][0]
+            self.change_seq = max(self.change_seq, self.store_seq)
+    
+    def reload_from_store(self):
+        """Перечитать всех игроков из общего хранилища. Возвращает их число"""
+        players, versions, last_seq = self.store.load_all()
+        for player in players.values():
+            hydrate_player(player)
+        with self.lock:
+            self.row_versions = versions
+            self.store_seq = last_seq
+            self.swap_local(players, last_seq)
+        print(f"♻️ Reloaded {len(players)} players from {self.store.path}")
+        return len(players)
+    
+    def apply_row(self, user_id, seq, op, fields):
+        """Применить изменение игрока с номером seq: перечитать строку, если ее версия в кэше устарела"""
+        data, version = self.store.get(user_id)
+        if data is None:
+            self.row_versions.pop(user_id, None)
+            self.delete_local(user_id, seq)
+            return
+        if version != self.row_versions.get(user_id):
+            # Запись изменил другой воркер; вычисляемые поля при загрузке строятся заново
+            op = "update" if user_id in self.players else "create"
+            self.players[user_id] = hydrate_player(data)
+            self.row_versions[user_id] = version
+            if fields is not None:
+                fields = list(fields) + [field for field in DERIVED_FIELDS if field not in fields]
+        self.mark_changed(user_id, op, fields, seq)
+    
+    def record_change(self, user_id, op="update", fields=None):
+        """Отметить свое изменение. С хранилищем номер берется из журнала changes вместе с чужими изменениями"""
+        if self.store is not None:
+            self.sync()
+        else:
+            self.mark_changed(user_id, op, fields)
+    
+    def write_row(self, user_id, player_data, fields=None):
+        """Записать игрока в хранилище до изменения кэша (вызывается под self.lock)"""
+        if self.store is None:
+            return
+        started = time.perf_counter()
+        try:
+            self.row_versions[user_id] = self.store.write_player(
+                user_id, persisted_player(player_data), self.row_versions.get(user_id), fields
+            )
+            save_duration.observe(time.perf_counter() - started, "player_row")
+        except StaleWriteError:
+            self.sync()
+            raise
+    
+    def save_data(self, wait=False):
+        """Сохранение данных в файл. wait=True - дождаться записи снимка"""
+        if self.store is not None:
+            return True  # Каждое изменение уже записано в хранилище построчно
+        if self.snapshotter is not None:
+            return self.snapshotter.request(wait=wait)
         try:
             # Сохраняем только реальных пользователей
-            real_players = {k: v for k, v in self.players.items() if not k.startswith('trader_')}
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(real_players, f, indent=2, ensure_ascii=False)
+            with self.lock:
+                real_players = self.real_players()
+            with self.save_lock:
+                started = time.perf_counter()
+                size = write_snapshot(self.data_file, real_players)
+                self.observe_save(time.perf_counter() - started, size)
             print(f"💾 Real players saved: {len(real_players)} players")
+            return True
         except Exception as e:
             print(f"❌ Error saving data: {e}")
+            return False
+    
+    def observe_save(self, seconds, size):
+        save_duration.observe(seconds, "players")
+        save_bytes.observe(size, "players")
+    
+    def real_players(self):
+        """Реальные игроки в формате сохранения (без вычисляемых полей)"""
+        return {k: persisted_player(v) for k, v in self.players.items() if not k.startswith('trader_')}
+    
+    def snapshot_stats(self):
+        if self.snapshotter is None:
+            return {"mode": "store" if self.store is not None else "sync"}
+        return dict(self.snapshotter.get_stats(), mode="fork")
     
     def get_player(self, user_id):
         """Получить игрока по ID"""
         # Для тестовых пользователей не сохраняем в базу
         if user_id.startswith('trader_'):
             return None
+        self.sync()
         return self.players.get(user_id)
     
     def create_player(self, user_id, player_data):
         """Создать нового игрока"""
         # Сохраняем только реальных пользователей
         if not user_id.startswith('trader_'):
-            self.players[user_id] = player_data
+            with self.lock:
+                self.write_row(user_id, player_data)
+                self.players[user_id] = player_data
+                self.record_change(user_id, "create")
             self.save_data()
         return player_data
     
-    def update_player(self, user_id, player_data):
+    def update_player(self, user_id, player_data, fields=None):
         """Обновить данные игрока"""
         # Обновляем только реальных пользователей
         if not user_id.startswith('trader_') and user_id in self.players:
             # Сохраняем некоторые старые данные если они нужны
             old_player = self.players[user_id]
-            player_data.setdefault('created_at', old_player.get('created_at', datetime.now().isoformat()))
+            player_data.setdefault('created_at', old_player.get('created_at', now_ts()))
             player_data.setdefault('username', old_player.get('username', 'Trader'))
             
-            self.players[user_id] = player_data
+            # Запись заменена другим объектом - считаем измененными все поля
+            if old_player is not player_data:
+                fields = None
+            
+            with self.lock:
+                self.write_row(user_id, player_data, fields)
+                self.players[user_id] = player_data
+                self.record_change(user_id, fields=fields)
             self.save_data()
         return player_data
     
-    def save_player(self, user_id, player_data):
-        """Сохранить или обновить игрока"""
+    def delete_player(self, user_id, save=True):
+        """Удалить игрока"""
+        with self.lock:
+            if self.store is not None:
+                if user_id not in self.players:
+                    return False
+                self.store.delete_player(user_id)
+                self.sync()
+            elif not self.delete_local(user_id):
+                return False
+        if save:
+            self.save_data()
+        return True
+    
+    def delete_local(self, user_id, seq=None):
+        with self.lock:
+            if self.players.pop(user_id, None) is None:
+                return False
+            seq = self.next_seq(seq)
+            self.player_seq.pop(user_id, None)
+            self.field_seq.pop(user_id, None)
+            self.deleted_seq[user_id] = seq
+            self.log_change(seq, "delete", user_id)
+            self.notify("delete", user_id, None)
+        return True
+    
+    def save_player(self, user_id, player_data, fields=None):
+        """Сохранить или обновить игрока. fields - какие поля изменились (None - все)"""
         if user_id.startswith('trader_'):
             return player_data  # Не сохраняем тестовых пользователей
+        telemetry.note_save_player()
+        
+        # Стоимость - производное поле, обработчики ее не пересчитывают: делаем это
+        # здесь при любом изменении баланса, портфеля или цен
+        if fields is None or any(field in VALUATION_INPUTS for field in fields):
+            recompute_valuation(player_data)
+            if fields is not None:
+                fields = list(fields) + [field for field in VALUATION_FIELDS if field not in fields]
             
         if user_id in self.players:
-            return self.update_player(user_id, player_data)
+            return self.update_player(user_id, player_data, fields)
         else:
             return self.create_player(user_id, player_data)
     
     def get_all_players(self):
         """Получить всех реальных игроков"""
-        return {k: v for k, v in self.players.items() if not k.startswith('trader_')}
+        self.sync()
+        with self.lock:
+            return {k: v for k, v in self.players.items() if not k.startswith('trader_')}
     
     def get_player_data(self, user_id):
         """Получить данные игрока в формате словаря"""
         if user_id.startswith('trader_'):
             return None  # Тестовые пользователи не хранятся в базе
+        self.sync()
         return self.players.get(user_id)
 
+# Признаки записи старого формата: сохраненные вычисляемые поля или время ISO строкой
+LEGACY_MARKERS = [f'"{field}"' for field in DERIVED_FIELDS] + ['"last_login": "']
+
+def is_legacy_format(players):
+    return any(
+        any(field in player for field in DERIVED_FIELDS) or isinstance(player.get('last_login'), str)
+        for player in players.values()
+    )
+
+def compact_record(player):
+    """Запись игрока старого формата в текущем формате хранения"""
+    migrate_player_times(player)
+    return persisted_player(player)
+
+def validate_players(data):
+    """Проверить загруженные данные и отфильтровать тестовых пользователей"""
+    if not isinstance(data, dict):
+        raise ValueError("Players data must be an object")
+    
+    players = {}
+    for user_id, player in data.items():
+        if user_id.startswith('trader_'):
+            continue
+        if not isinstance(player, dict) or 'balance' not in player or 'portfolio' not in player:
+            raise ValueError(f"Invalid player record: {user_id}")
+        players[user_id] = player
+    return players
+
 # Глобальный экземпляр базы данных
 db = Database()
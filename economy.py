@@ -0,0 +1,262 @@
+import random
+import time
+
+from timestamps import migrate_player_times, now_ts
+
+# Усложненная конфигурация криптовалют
+CRYPTOS = {
+    "BTC": {
+        "name": "Bitcoin", 
+        "color": "#f7931a",
+        "volatility": 0.015,
+        "base_price": 45000,
+        "emoji": "₿",
+        "mining_difficulty": 100,
+        "mining_reward": 0.0001
+    },
+    "ETH": {
+        "name": "Ethereum", 
+        "color": "#627eea",
+        "volatility": 0.018,
+        "base_price": 3000,
+        "emoji": "🔷",
+        "mining_difficulty": 80,
+        "mining_reward": 0.001
+    },
+    "BNB": {
+        "name": "Binance Coin", 
+        "color": "#f3ba2f",
+        "volatility": 0.022,
+        "base_price": 350,
+        "emoji": "💠",
+        "mining_difficulty": 60,
+        "mining_reward": 0.01
+    },
+    "XRP": {
+        "name": "Ripple", 
+        "color": "#23292f",
+        "volatility": 0.025,
+        "base_price": 0.6,
+        "emoji": "⚡",
+        "mining_difficulty": 40,
+        "mining_reward": 0.1
+    },
+    "ADA": {
+        "name": "Cardano", 
+        "color": "#0033ad",
+        "volatility": 0.020,
+        "base_price": 0.5,
+        "emoji": "🃏",
+        "mining_difficulty": 50,
+        "mining_reward": 0.05
+    },
+    "DOGE": {
+        "name": "Dogecoin", 
+        "color": "#c2a633",
+        "volatility": 0.028,
+        "base_price": 0.15,
+        "emoji": "🐕",
+        "mining_difficulty": 30,
+        "mining_reward": 1.0
+    },
+    "SOL": {
+        "name": "Solana", 
+        "color": "#00ffbd",
+        "volatility": 0.024,
+        "base_price": 100,
+        "emoji": "🔆",
+        "mining_difficulty": 45,
+        "mining_reward": 0.02
+    },
+    "DOT": {
+        "name": "Polkadot", 
+        "color": "#e6007a",
+        "volatility": 0.021,
+        "base_price": 7,
+        "emoji": "🔴",
+        "mining_difficulty": 55,
+        "mining_reward": 0.03
+    }
+}
+
+# Конфигурация майнинга
+MINING_CONFIG = {
+    "base_energy_cost": 10,
+    "energy_regeneration_rate": 0.5,
+    "max_energy": 100,
+    "mining_cooldown": 120,
+    "equipment_levels": {
+        1: {"name": "Basic GPU", "multiplier": 1.0, "cost": 1000},
+        2: {"name": "Advanced GPU", "multiplier": 1.3, "cost": 5000},
+        3: {"name": "ASIC Miner", "multiplier": 1.8, "cost": 20000},
+        4: {"name": "Mining Farm", "multiplier": 2.5, "cost": 100000},
+        5: {"name": "Industrial Farm", "multiplier": 4.0, "cost": 500000}
+    }
+}
+
+def generate_realistic_price(previous_price, volatility, symbol):
+    change = random.gauss(0, volatility)
+    mean_reversion = (CRYPTOS[symbol]["base_price"] - previous_price) * 0.0003
+    
+    change += mean_reversion
+    
+    new_price = previous_price * (1 + change)
+    new_price = max(new_price, previous_price * 0.7)
+    new_price = min(new_price, previous_price * 1.5)
+    
+    if new_price < 1:
+        return round(new_price, 4)
+    else:
+        return round(new_price, 2)
+
+def calculate_trading_fee(amount, price, order_type):
+    base_fee = 0.0025
+    if order_type == 'market':
+        base_fee += 0.0015
+    return amount * price * base_fee
+
+def initialize_order_book(symbol, base_price):
+    bids = []
+    asks = []
+    
+    spread = 0.015
+    
+    for i in range(5):
+        bid_price = base_price * (1 - spread * (i + 1))
+        ask_price = base_price * (1 + spread * (i + 1))
+        
+        bids.append({
+            "price": round(bid_price, 4 if base_price < 1 else 2),
+            "amount": round(random.uniform(0.05, 1.5), 4),
+            "total": round(bid_price * random.uniform(0.05, 1.5), 2)
+        })
+        
+        asks.append({
+            "price": round(ask_price, 4 if base_price < 1 else 2),
+            "amount": round(random.uniform(0.05, 1.5), 4),
+            "total": round(ask_price * random.uniform(0.05, 1.5), 2)
+        })
+    
+    return {"bids": bids, "asks": asks}
+
+def update_order_book(symbol, current_price):
+    return initialize_order_book(symbol, current_price)
+
+def get_current_energy(mining, now=None):
+    """Текущая энергия: сохраненное значение плюс восстановление с момента energy_updated_at.
+
+    now и время в записи - секунды epoch.
+    """
+    now = now or time.time()
+    elapsed = now - mining.get("energy_updated_at", mining["last_mining_time"])
+    regenerated = max(0, elapsed) / 60 * MINING_CONFIG["energy_regeneration_rate"]
+    return min(MINING_CONFIG["max_energy"], mining["energy"] + regenerated)
+
+def set_energy(mining, energy, now=None):
+    """Зафиксировать энергию на момент now"""
+    now = now or now_ts()
+    mining["energy"] = energy
+    mining["energy_updated_at"] = now
+
+def mining_success_chance(mining, symbol):
+    """Вероятность успешного майнинга для игрока"""
+    equipment_multiplier = MINING_CONFIG["equipment_levels"][mining["equipment_level"]]["multiplier"]
+    return min(0.8, (equipment_multiplier * mining["mining_power"]) / CRYPTOS[symbol]["mining_difficulty"])
+
+def apply_mining_attempt(player, symbol, energy, success_roll, reward_roll, now):
+    """Применить одну попытку майнинга к игроку.
+
+    success_roll - равномерное число [0, 1), reward_roll - множитель награды [0.7, 1.1],
+    now - секунды epoch.
+    Возвращает награду или None, если попытка неудачна.
+    """
+    mining = player["mining"]
+    
+    if success_roll > mining_success_chance(mining, symbol):
+        set_energy(mining, energy - MINING_CONFIG["base_energy_cost"] // 2, now)
+        mining["last_mining_time"] = now
+        return None
+    
+    equipment_multiplier = MINING_CONFIG["equipment_levels"][mining["equipment_level"]]["multiplier"]
+    reward = CRYPTOS[symbol]["mining_reward"] * equipment_multiplier * mining["mining_power"] * reward_roll
+    reward = round(reward, 6)
+    
+    player["portfolio"][symbol] = player["portfolio"].get(symbol, 0) + reward
+    set_energy(mining, energy - MINING_CONFIG["base_energy_cost"], now)
+    mining["last_mining_time"] = now
+    mining["total_mined"][symbol] = mining["total_mined"].get(symbol, 0) + reward
+    player["stats"]["total_mining_rewards"] += reward * player["current_prices"][symbol]
+    return reward
+
+# Поля, которые вычисляются из цен и портфеля: в памяти есть, на диск не пишутся
+DERIVED_FIELDS = ("order_books", "portfolio_value", "total_value")
+# Поля, от которых зависит стоимость (portfolio_value, total_value)
+VALUATION_INPUTS = ("balance", "portfolio", "current_prices")
+VALUATION_FIELDS = ("portfolio_value", "total_value")
+
+def recompute_valuation(player):
+    """Пересчитать стоимость портфеля и общую стоимость по текущим ценам"""
+    prices = player.get("current_prices", {})
+    portfolio_value = sum(amount * prices.get(symbol, 0) for symbol, amount in player.get("portfolio", {}).items())
+    player["portfolio_value"] = round(portfolio_value, 2)
+    player["total_value"] = round(player.get("balance", 0) + portfolio_value, 2)
+
+def hydrate_player(player):
+    """Восстановить вычисляемые поля после загрузки с диска и перевести время старого формата в epoch"""
+    migrate_player_times(player)
+    if not player.get("order_books"):
+        player["order_books"] = {
+            symbol: initialize_order_book(symbol, price)
+            for symbol, price in player.get("current_prices", {}).items()
+        }
+    recompute_valuation(player)
+    return player
+
+def persisted_player(player):
+    """Запись игрока для сохранения: только исходные поля, без вычисляемых"""
+    return {k: v for k, v in player.items() if k not in DERIVED_FIELDS}
+
+def create_new_player_data():
+    now = now_ts()
+    player_data = {
+        "balance": 500.00,
+        "portfolio": {symbol: 0 for symbol in CRYPTOS},
+        "portfolio_value": 0,
+        "total_value": 500.00,
+        "orders": [],
+        "price_history": {},
+        "current_prices": {},
+        "order_books": {},
+        "created_at": now,
+        "last_login": now,
+        "username": "Trader",
+        "mining": {
+            "energy": MINING_CONFIG["max_energy"],
+            "energy_updated_at": now,
+            "last_mining_time": now,
+            "equipment_level": 1,
+            "total_mined": {symbol: 0 for symbol in CRYPTOS},
+            "mining_power": 1.0
+        },
+        "stats": {
+            "total_trades": 0,
+            "total_orders": 0,
+            "total_profit": 0,
+            "daily_bonus_claimed": False,
+            "login_streak": 1,
+            "total_mining_rewards": 0
+        }
+    }
+    
+    for symbol, crypto in CRYPTOS.items():
+        price = crypto["base_price"] * random.uniform(0.95, 1.05)
+        player_data["current_prices"][symbol] = price
+        
+        history = [price]
+        for _ in range(49):
+            history.append(generate_realistic_price(history[-1], crypto["volatility"], symbol))
+        player_data["price_history"][symbol] = history
+        
+        player_data["order_books"][symbol] = initialize_order_book(symbol, price)
+    
+    return player_data
@@ -0,0 +1,18 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py app:app
+#
+# При нескольких воркерах все они работают с общим SQLite хранилищем
+# (PLAYER_STORE) и общими файловыми блокировками игроков, поэтому данные
+# согласованы между процессами. Приложение импортируется в каждом воркере
+# после fork, чтобы фоновые потоки запускались в воркерах, а не в мастере.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 60
+preload_app = False
+
+if workers > 1:
+    os.environ.setdefault("PLAYER_STORE", "players.db")
@@ -0,0 +1,112 @@
+import functools
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/css", "application/javascript", "text/javascript")
+
+
+class ResponseCache:
+    """Условные GET-запросы и сжатие ответов.
+
+    ETag вычисляется из счетчиков версий ресурса до вызова обработчика, поэтому
+    ответ 304 не требует сериализации данных. Сжатые байты ответов с ETag
+    кэшируются по (ETag, кодировка), так что общий ресурс (P2P стакан)
+    сериализуется и сжимается один раз на версию.
+    """
+
+    def __init__(self, min_size=1024, max_entries=256, gzip_level=6, brotli_quality=5):
+        self.min_size = min_size
+        self.max_entries = max_entries
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.lock = threading.Lock()
+        self.compressed = OrderedDict()
+        self.stats = {"not_modified": 0, "compressed": 0, "cache_hits": 0}
+
+    def conditional(self, etag_fn):
+        """Декоратор: etag_fn(**kwargs) возвращает ETag ресурса или None"""
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                etag = etag_fn(**kwargs)
+                if etag is None:
+                    return f(*args, **kwargs)
+
+                if request.if_none_match.contains_weak(etag):
+                    self.stats["not_modified"] += 1
+                    response = Response(status=304)
+                    response.set_etag(etag, weak=True)
+                    return response
+
+                # Сжатая версия этого ресурса уже есть - обработчик не вызываем вовсе
+                encoding = self.choose_encoding()
+                with self.lock:
+                    body = self.compressed.get((etag, encoding, request.path)) if encoding else None
+                if body is not None:
+                    self.stats["cache_hits"] += 1
+                    response = Response(body, mimetype="application/json")
+                    response.headers["Content-Encoding"] = encoding
+                    response.vary.add("Accept-Encoding")
+                    response.set_etag(etag, weak=True)
+                    return response
+
+                response = f(*args, **kwargs)
+                if isinstance(response, tuple):
+                    return response
+                if response.status_code == 200:
+                    response.set_etag(etag, weak=True)
+                return response
+            return decorated_function
+        return decorator
+
+    def choose_encoding(self):
+        accepted = request.headers.get("Accept-Encoding", "").lower()
+        tokens = {part.split(";")[0].strip() for part in accepted.split(",")}
+        if brotli is not None and "br" in tokens:
+            return "br"
+        if "gzip" in tokens:
+            return "gzip"
+        return None
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def compress_response(self, response):
+        """Сжать ответ, если клиент это поддерживает и ответ достаточно большой"""
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        body = self.compress(data, encoding)
+        self.stats["compressed"] += 1
+
+        etag, weak = response.get_etag()
+        if etag:
+            with self.lock:
+                self.compressed[(etag, encoding, request.path)] = body
+                while len(self.compressed) > self.max_entries:
+                    self.compressed.popitem(last=False)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,194 @@
+import errno
+import functools
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Номера именованных блокировок (named_lock, claim)
+P2P_LOCK = 0
+# Процесс, который обрабатывает очередь майнинга
+MINING_OWNER = 1
+# Процесс, который пишет и сохраняет историю метрик и свечей
+HISTORY_OWNER = 2
+# Запись manifest.json бэкапов и процесс, который делает периодические бэкапы
+BACKUP_LOCK = 3
+BACKUP_OWNER = 4
+
+
+class SharedLock:
+    """Реентерабельная блокировка, которая при наличии файла блокировок
+    действует и между процессами: поверх RLock берется fcntl-блокировка
+    одного байта файла по смещению offset."""
+
+    def __init__(self, fd=None, offset=0):
+        self.fd = fd
+        self.offset = offset
+        self.lock = threading.RLock()
+        # Глубина захвата владельцем: файловая блокировка берется только на первом уровне
+        self.depth = 0
+
+    def acquire(self):
+        """Захватить блокировку. Возвращает время ожидания (None - без ожидания)"""
+        waited = None
+        if not self.lock.acquire(blocking=False):
+            started = time.perf_counter()
+            self.lock.acquire()
+            waited = time.perf_counter() - started
+
+        if self.depth == 0 and self.fd is not None:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self.offset)
+            except OSError:
+                started = time.perf_counter()
+                self.wait_file_lock()
+                waited = (waited or 0) + time.perf_counter() - started
+        self.depth += 1
+        return waited
+
+    def wait_file_lock(self):
+        # Ядро ищет взаимоблокировки fcntl по процессам, а не по потокам, поэтому
+        # при нескольких потоках в воркерах возможен ложный EDEADLK. Полосы
+        # берутся по порядку, настоящей взаимоблокировки быть не может - повторяем
+        delay = 0.001
+        while True:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+                return
+            except OSError as e:
+                if e.errno != errno.EDEADLK:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.fd is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class StripedLocks:
+    """Блокировки игроков, разложенные по фиксированному числу полос.
+
+    user_id хэшируется в одну из stripes полос, поэтому запросы разных
+    игроков почти всегда идут параллельно, а память не растет с числом игроков.
+    Несколько игроков блокируются в порядке номеров полос - так две сделки
+    между одними и теми же игроками не могут заблокировать друг друга.
+    С lock_file полосы блокируются и между процессами (воркерами gunicorn).
+    """
+
+    def __init__(self, stripes=64, lock_file=None):
+        self.fd = None
+        if lock_file and fcntl is not None:
+            self.fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        self.stripes = [SharedLock(self.fd, index) for index in range(stripes)]
+        self.stats_lock = threading.Lock()
+        self.stats = {"acquired": 0, "contended": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+        # Именованные блокировки, захваченные этим процессом навсегда (claim)
+        self.claimed = set()
+
+    def stripe_for(self, user_id):
+        return zlib.crc32(str(user_id).encode()) % len(self.stripes)
+
+    def named_lock(self, index):
+        """Отдельная блокировка вне полос игроков (например, для P2P стакана).
+
+        Ее нужно брать последней, уже удерживая нужные блокировки игроков.
+        """
+        return SharedLock(self.fd, len(self.stripes) + index)
+
+    def claim(self, index):
+        """Выбор одного процесса-владельца среди воркеров.
+
+        Неблокирующий захват именованной блокировки, который не отпускается до
+        завершения процесса: после смерти владельца блокировку захватит следующий
+        вызвавший. Без файла блокировок процесс один и всегда владелец.
+        """
+        if self.fd is None:
+            return True
+        with self.stats_lock:
+            if index in self.claimed:
+                return True
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, len(self.stripes) + index)
+            except OSError:
+                return False
+            self.claimed.add(index)
+            return True
+
+    @contextmanager
+    def hold(self, *user_ids):
+        """Удерживать блокировки всех указанных игроков"""
+        indexes = sorted({self.stripe_for(user_id) for user_id in user_ids if user_id is not None})
+        acquired = []
+        try:
+            for index in indexes:
+                lock = self.stripes[index]
+                self.record_wait(lock.acquire())
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    @contextmanager
+    def hold_all(self):
+        """Удерживать все полосы: пока они взяты, ни один обработчик не меняет игроков"""
+        acquired = []
+        try:
+            for lock in self.stripes:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def record_wait(self, seconds):
+        with self.stats_lock:
+            self.stats["acquired"] += 1
+            if seconds is not None:
+                self.stats["contended"] += 1
+                self.stats["wait_seconds"] += seconds
+                self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], seconds)
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["stripes"] = len(self.stripes)
+        stats["shared_between_processes"] = self.fd is not None
+        stats["avg_wait_ms"] = round(stats["wait_seconds"] / stats["contended"] * 1000, 3) if stats["contended"] else 0
+        stats["wait_seconds"] = round(stats["wait_seconds"], 4)
+        return stats
+
+    def locked(self, user_id_fn):
+        """Декоратор обработчика: user_id_fn(**kwargs) возвращает игрока, которого нужно заблокировать"""
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                with self.hold(user_id_fn(**kwargs)):
+                    return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+
+
+# Глобальный экземпляр блокировок игроков. В режиме общего хранилища
+# (PLAYER_STORE) блокировки действуют между всеми воркерами
+player_locks = StripedLocks(
+    lock_file=os.environ["PLAYER_STORE"] + ".lock" if os.environ.get("PLAYER_STORE") else None
+)
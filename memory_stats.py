@@ -0,0 +1,228 @@
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from datetime import datetime
+
+# Сколько снимков tracemalloc держать в памяти
+TRACEMALLOC_SNAPSHOTS = 10
+
+# Файлы самого tracemalloc и механизма импорта в отчетах не нужны
+TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def dict_items(value):
+    """Копия элементов словаря, который может меняться в другом потоке"""
+    for _ in range(3):
+        try:
+            return list(value.items())
+        except RuntimeError:
+            continue
+    return []
+
+
+def deep_sizeof(obj, seen=None):
+    """Оценка памяти объекта вместе со всем, на что он ссылается (dict, list, tuple, set, deque).
+
+    Объект, на который ссылаются несколько раз, считается один раз в пределах seen.
+    Контейнеры копируются перед обходом, поэтому параллельные изменения не мешают.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            for key, value in dict_items(item):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(item))
+    return total
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {f"p{point}": values[min(len(values) - 1, int(len(values) * point / 100))] for point in points}
+    result["max"] = values[-1]
+    result["mean"] = round(sum(values) / len(values))
+    return result
+
+
+def process_memory():
+    """RSS процесса из /proc (Linux) или пиковое значение из getrusage"""
+    result = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM", "VmSize"):
+                    result[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    if "VmRSS" not in result:
+        try:
+            import resource
+            # ru_maxrss - в килобайтах на Linux и в байтах на macOS
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["VmHWM"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+        except ImportError:
+            pass
+    return {
+        "rss_bytes": result.get("VmRSS"),
+        "peak_rss_bytes": result.get("VmHWM"),
+        "virtual_bytes": result.get("VmSize")
+    }
+
+
+def player_footprint(players, sample=200, full=False):
+    """Размер записей игроков: перцентили на выборке и оценка по полям для всех игроков.
+
+    full=True обходит всех игроков (точнее, но на больших базах долго).
+    """
+    started = time.perf_counter()
+    user_ids = list(players)
+    if not full and len(user_ids) > sample:
+        user_ids = random.sample(user_ids, sample)
+
+    sizes = []
+    fields = {}
+    for user_id in user_ids:
+        player = players.get(user_id)
+        if player is None:
+            continue
+        # Один seen на игрока: общие объекты внутри записи считаются один раз
+        seen = set()
+        size = sys.getsizeof(player)
+        seen.add(id(player))
+        for field, value in dict_items(player):
+            field_size = deep_sizeof(field, seen) + deep_sizeof(value, seen)
+            fields[field] = fields.get(field, 0) + field_size
+            size += field_size
+        sizes.append(size)
+
+    scale = len(players) / len(sizes) if sizes else 0
+    return {
+        "players": len(players),
+        "sampled": len(sizes),
+        "estimated_total_bytes": round(sum(sizes) * scale),
+        "per_player_bytes": percentiles(sizes),
+        # Оценка по полям для всех игроков
+        "fields_bytes": {field: round(total * scale) for field, total in fields.items()},
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+
+def format_stat(stat):
+    frame = stat.traceback[0]
+    return {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback] if len(stat.traceback) > 1 else None,
+        "size_bytes": stat.size,
+        "count": stat.count
+    }
+
+
+def format_diff(stat):
+    result = format_stat(stat)
+    result["size_diff_bytes"] = stat.size_diff
+    result["count_diff"] = stat.count_diff
+    return result
+
+
+class MemoryTracer:
+    """Снимки tracemalloc: самые крупные места выделения памяти и разница между снимками.
+
+    Трассировка включается админом (или PYTHONTRACEMALLOC при запуске) и
+    замедляет выделение памяти, поэтому по умолчанию выключена. Снимки
+    хранятся в памяти процесса, последние TRACEMALLOC_SNAPSHOTS штук.
+    """
+
+    def __init__(self, keep=TRACEMALLOC_SNAPSHOTS):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.snapshots = {}
+
+    def start(self, frames=1):
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(frames)
+        return True
+
+    def stop(self):
+        """Выключить трассировку. Снятые снимки остаются"""
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        return True
+
+    def status(self):
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": self.list()
+        }
+
+    def take(self):
+        """Снять снимок. Возвращает описание или None, если трассировка выключена"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+        snapshot_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        meta = {
+            "id": snapshot_id,
+            "created_at": datetime.now().isoformat(),
+            "traced_bytes": sum(stat.size for stat in snapshot.statistics("filename")),
+            "frames": snapshot.traceback_limit
+        }
+        with self.lock:
+            self.snapshots[snapshot_id] = (meta, snapshot)
+            for old_id in list(self.snapshots)[:-self.keep]:
+                del self.snapshots[old_id]
+        return meta
+
+    def list(self):
+        with self.lock:
+            return [meta for meta, _ in self.snapshots.values()]
+
+    def get(self, snapshot_id):
+        with self.lock:
+            entry = self.snapshots.get(snapshot_id)
+        return entry[1] if entry else None
+
+    def top(self, snapshot_id, limit=20, group_by="lineno"):
+        """Самые крупные места выделения в снимке: group_by - lineno, filename или traceback"""
+        snapshot = self.get(snapshot_id)
+        if snapshot is None:
+            return None
+        return [format_stat(stat) for stat in snapshot.statistics(group_by)[:limit]]
+
+    def diff(self, old_id, new_id, limit=20, group_by="lineno"):
+        """Места, где память выросла (или уменьшилась) сильнее всего между двумя снимками"""
+        old, new = self.get(old_id), self.get(new_id)
+        if old is None or new is None:
+            return None
+        return [format_diff(stat) for stat in new.compare_to(old, group_by)[:limit]]
+
+
+# Глобальный экземпляр трассировки памяти
+memory_tracer = MemoryTracer()
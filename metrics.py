@@ -0,0 +1,324 @@
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+from array import array
+
+from economy import CRYPTOS
+
+# (имя, шаг в секундах, число слотов): 10 минут посекундно, сутки поминутно,
+# месяц по часам и два года по дням
+RESOLUTIONS = [("1s", 1, 600), ("1m", 60, 1440), ("1h", 3600, 720), ("1d", 86400, 730)]
+
+GAUGES = ["players", "total_wealth", "total_balance", "p2p_active_orders"] + [f"holdings.{symbol}" for symbol in CRYPTOS]
+COUNTERS = ["trades", "trade_volume", "mining_rewards", "mining_emission_value", "requests"]
+
+
+class Ring:
+    """Кольцевой буфер фиксированного размера: слот = (время // шаг) % размер"""
+
+    def __init__(self, step, size, names):
+        self.step = step
+        self.size = size
+        self.times = array('d', [0.0]) * size
+        self.values = {name: array('d', [0.0]) * size for name in names}
+
+    def write(self, bucket_ts, values):
+        slot = (bucket_ts // self.step) % self.size
+        self.times[slot] = bucket_ts
+        for name, column in self.values.items():
+            column[slot] = values.get(name, 0.0)
+
+    def buckets(self, start_ts, end_ts):
+        """Номера слотов с данными для бакетов в [start_ts, end_ts), по порядку времени"""
+        start_ts = int(max(start_ts, end_ts - self.step * self.size))
+        start_ts -= start_ts % self.step
+        result = []
+        for bucket_ts in range(start_ts, int(end_ts), self.step):
+            slot = (bucket_ts // self.step) % self.size
+            if self.times[slot] == bucket_ts:
+                result.append((bucket_ts, slot))
+        return result
+
+    def dump(self):
+        return {
+            "times": base64.b64encode(self.times.tobytes()).decode(),
+            "values": {name: base64.b64encode(column.tobytes()).decode() for name, column in self.values.items()}
+        }
+
+    def restore(self, data):
+        times = array('d')
+        times.frombytes(base64.b64decode(data["times"]))
+        if len(times) != self.size:
+            return
+        self.times = times
+        for name, encoded in data["values"].items():
+            if name in self.values:
+                column = array('d')
+                column.frombytes(base64.b64decode(encoded))
+                self.values[name] = column
+
+
+class MetricsStore:
+    """Временные ряды метрик экономики.
+
+    Фоновый поток раз в секунду пишет значения в посекундное кольцо, а при
+    переходе через границу минуты, часа и дня сворачивает завершившийся
+    интервал в следующее разрешение: счетчики суммируются, показатели
+    усредняются. Запросы читают только кольца и не трогают данные игроков.
+
+    С несколькими воркерами (share) ряды пишет и сохраняет один процесс-владелец.
+    Остальные передают ему свои счетчики через общее хранилище и читают
+    историю из файла, который он сохранил.
+    """
+
+    def __init__(self, history_file="metrics_history.json.gz"):
+        self.history_file = history_file
+        self.lock = threading.Lock()
+        self.names = GAUGES + COUNTERS
+        self.rings = {name: Ring(step, size, self.names) for name, step, size in RESOLUTIONS}
+        self.pending = {name: 0.0 for name in COUNTERS}
+        self.gauge_sources = []
+        self.last_sample = None
+        self.worker = None
+        self.store = None
+        self.owner = None
+        self.refresh = None
+        self.owning = False
+        self.loaded_mtime = None
+
+    def share(self, store, owner, refresh=None):
+        """Режим нескольких воркеров: owner() истинно в процессе-владельце,
+        refresh() подтягивает изменения других воркеров перед выборкой"""
+        self.store = store
+        self.owner = owner
+        self.refresh = refresh
+
+    def is_owner(self):
+        if self.store is None:
+            return True
+        owner = self.owner()
+        if owner and not self.owning:
+            # Процесс только что стал владельцем: продолжаем сохраненную историю
+            self.load()
+            self.last_sample = None
+        self.owning = owner
+        return owner
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.pending[name] += amount
+
+    def add_gauge_source(self, source):
+        """source() возвращает словарь {метрика: значение}"""
+        self.gauge_sources.append(source)
+
+    def flush_counters(self):
+        """Не владелец: передать накопленные счетчики владельцу через хранилище"""
+        with self.lock:
+            pending = {f"metrics.{name}": value for name, value in self.pending.items() if value}
+            self.pending = {name: 0.0 for name in COUNTERS}
+        if pending:
+            self.store.add_counters(pending)
+
+    def sample(self, now=None):
+        if not self.is_owner():
+            self.flush_counters()
+            return
+        second = int(now or time.time())
+        shared = self.store.take_counters("metrics.") if self.store is not None else {}
+        if self.refresh is not None:
+            self.refresh()
+        values = {}
+        for source in self.gauge_sources:
+            try:
+                values.update(source())
+            except Exception as e:
+                print(f"❌ Error in metrics source: {e}")
+
+        with self.lock:
+            values.update(self.pending)
+            for name, value in shared.items():
+                if name in values:
+                    values[name] += value
+            self.pending = {name: 0.0 for name in COUNTERS}
+            self.rings["1s"].write(second, values)
+
+            previous = self.last_sample
+            self.last_sample = second
+            if previous is None:
+                return
+            # Свернуть завершившиеся интервалы в следующее разрешение
+            for (lower, _, _), (higher, step, _) in zip(RESOLUTIONS, RESOLUTIONS[1:]):
+                if previous // step == second // step:
+                    break
+                bucket_ts = previous - previous % step
+                self.rollup(self.rings[lower], self.rings[higher], bucket_ts, step)
+
+    def rollup(self, source, target, bucket_ts, step):
+        buckets = source.buckets(bucket_ts, bucket_ts + step)
+        if not buckets:
+            return
+        values = {}
+        for name in GAUGES:
+            column = source.values[name]
+            values[name] = sum(column[slot] for _, slot in buckets) / len(buckets)
+        for name in COUNTERS:
+            column = source.values[name]
+            values[name] = sum(column[slot] for _, slot in buckets)
+        target.write(bucket_ts, values)
+
+    def reload_shared(self):
+        """Не владелец: перечитать историю, если владелец сохранил новую"""
+        if self.store is None or self.owning:
+            return
+        try:
+            mtime = os.path.getmtime(self.history_file)
+        except OSError:
+            return
+        if mtime != self.loaded_mtime:
+            self.load(quiet=True)
+
+    def query(self, names=None, resolution="1m", since=None, until=None, limit=None):
+        self.reload_shared()
+        ring = self.rings.get(resolution)
+        if ring is None:
+            raise ValueError(f"Resolution must be one of: {', '.join(self.rings)}")
+        names = [name for name in (names or self.names) if name in ring.values]
+        until = until or time.time() + 1
+        since = since if since is not None else until - ring.step * ring.size
+
+        with self.lock:
+            buckets = ring.buckets(since, until)
+            if limit:
+                buckets = buckets[-limit:]
+            return {
+                "resolution": resolution,
+                "step": ring.step,
+                "timestamps": [int(bucket_ts) for bucket_ts, _ in buckets],
+                "series": {name: [ring.values[name][slot] for _, slot in buckets] for name in names},
+                "counters": [name for name in names if name in COUNTERS]
+            }
+
+    def save(self):
+        with self.lock:
+            data = {"saved_at": time.time(), "rings": {name: ring.dump() for name, ring in self.rings.items()}}
+        tmp_path = self.history_file + ".tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.history_file)
+
+    def load(self, quiet=False):
+        try:
+            if os.path.exists(self.history_file):
+                mtime = os.path.getmtime(self.history_file)
+                with gzip.open(self.history_file, 'rt', encoding='utf-8') as f:
+                    data = json.load(f)
+                with self.lock:
+                    for name, ring_data in data["rings"].items():
+                        if name in self.rings:
+                            self.rings[name].restore(ring_data)
+                    self.loaded_mtime = mtime
+                if not quiet:
+                    print(f"✅ Loaded metrics history from {self.history_file}")
+        except Exception as e:
+            print(f"❌ Error loading metrics history: {e}")
+
+    def start(self, interval=1.0, persist_every=60):
+        if interval <= 0 or self.worker is not None:
+            return
+
+        def loop():
+            last_saved = time.time()
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sample()
+                    # Файл истории пишет только владелец
+                    if self.is_owner() and time.time() - last_saved >= persist_every:
+                        self.save()
+                        last_saved = time.time()
+                except Exception as e:
+                    print(f"❌ Error in metrics sampler: {e}")
+
+        self.worker = threading.Thread(target=loop, name="metrics-sampler", daemon=True)
+        self.worker.start()
+
+
+class EconomyTotals:
+    """Суммарное богатство, запасы монет и средние цены, которые поддерживаются по изменениям.
+
+    Для каждого игрока хранится его вклад, при сохранении пересчитывается
+    только он, поэтому выборка метрик не проходит по всем игрокам.
+    Вклад - (богатство, баланс, запасы по монетам, цены по монетам).
+    """
+
+    FIELDS = ("balance", "portfolio", "current_prices")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contributions = {}
+        self.totals = [0.0] * (2 + 2 * len(CRYPTOS))
+
+    def attach(self, database):
+        self.rebuild(database.players)
+        database.add_listener(self.on_change)
+
+    def contribution(self, player):
+        # Богатство считается здесь, а не берется из total_value: производное
+        # поле пересчитывается не при каждом сохранении и может быть устаревшим
+        portfolio = player.get('portfolio', {})
+        prices = player.get('current_prices', {})
+        balance = float(player.get('balance', 0) or 0)
+        holdings = tuple(float(portfolio.get(symbol, 0) or 0) for symbol in CRYPTOS)
+        player_prices = tuple(float(prices.get(symbol, crypto["base_price"]) or 0) for symbol, crypto in CRYPTOS.items())
+        wealth = balance + sum(amount * price for amount, price in zip(holdings, player_prices))
+        return (wealth, balance) + holdings + player_prices
+
+    def on_change(self, op, user_id, player, fields):
+        if op == "reset":
+            self.rebuild(player)
+        elif op == "delete":
+            self.set(user_id, None)
+        elif player is not None and (fields is None or any(field in fields for field in self.FIELDS)):
+            self.set(user_id, self.contribution(player))
+
+    def rebuild(self, players):
+        contributions = {user_id: self.contribution(player) for user_id, player in list(players.items())}
+        totals = [sum(column) for column in zip(*contributions.values())] or [0.0] * (2 + 2 * len(CRYPTOS))
+        with self.lock:
+            self.contributions = contributions
+            self.totals = totals
+
+    def set(self, user_id, contribution):
+        with self.lock:
+            previous = self.contributions.pop(user_id, None)
+            if previous is not None:
+                self.totals = [total - value for total, value in zip(self.totals, previous)]
+            if contribution is not None:
+                self.contributions[user_id] = contribution
+                self.totals = [total + value for total, value in zip(self.totals, contribution)]
+
+    def gauges(self):
+        with self.lock:
+            totals = list(self.totals)
+            players = len(self.contributions)
+        values = {"players": players, "total_wealth": totals[0], "total_balance": totals[1]}
+        for symbol, amount in zip(CRYPTOS, totals[2:]):
+            values[f"holdings.{symbol}"] = amount
+        return values
+
+    def reference_prices(self):
+        """Опорная цена рынка: средняя текущая цена монеты по всем игрокам"""
+        with self.lock:
+            price_sums = self.totals[2 + len(CRYPTOS):]
+            players = len(self.contributions)
+        if not players:
+            return {}
+        return {symbol: total / players for symbol, total in zip(CRYPTOS, price_sums)}
+
+
+# Глобальный экземпляр хранилища метрик
+metrics = MetricsStore()
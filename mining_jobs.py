@@ -0,0 +1,220 @@
+import threading
+import time
+
+import numpy as np
+
+from economy import CRYPTOS, MINING_CONFIG, get_current_energy, apply_mining_attempt
+from metrics import metrics
+from locks import player_locks
+from timestamps import now_ts
+
+
+class MiningScheduler:
+    """Очередь пакетного майнинга.
+
+    Игрок ставит задачу на N попыток по одной или нескольким монетам, фоновый
+    поток раз в interval секунд обрабатывает все задачи, у которых подошло
+    время. Случайные числа для всей пачки генерируются одним проходом, а
+    каждый затронутый игрок сохраняется один раз за пачку.
+
+    В режиме общего хранилища задачи лежат в нем, и их видят все воркеры,
+    а обрабатывает очередь один процесс - тот, для которого owner() истинно.
+    """
+
+    def __init__(self, database, interval=1.0, max_attempts=100, max_jobs_per_user=3, owner=None):
+        self.db = database
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.max_jobs_per_user = max_jobs_per_user
+        # Задачи в общем хранилище (если оно есть), иначе в памяти процесса
+        self.store = database.store
+        self.owner = owner
+
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.job_counter = 0
+        self.rng = np.random.default_rng()
+        self.worker = None
+        self.stats = {"batches": 0, "attempts": 0, "last_batch_size": 0, "last_batch_seconds": 0}
+        if self.store is not None:
+            # Задачи могут поставить через любой воркер, поток нужен владельцу сразу
+            self.ensure_worker()
+
+    def submit(self, user_id, symbols, attempts):
+        """Создать задачу майнинга. Возвращает (job, ошибка)"""
+        symbols = [s for s in symbols if s in CRYPTOS]
+        if not symbols:
+            return None, "Invalid cryptocurrency"
+        if attempts < 1 or attempts > self.max_attempts:
+            return None, f"Attempts must be between 1 and {self.max_attempts}"
+
+        job = {
+            "user_id": user_id,
+            "symbols": symbols,
+            "attempts_total": attempts,
+            "attempts_done": 0,
+            "successes": 0,
+            "failures": 0,
+            "rewards": {symbol: 0 for symbol in symbols},
+            "value": 0,
+            "status": "active",
+            "next_due": time.time(),
+            "created_at": now_ts(),
+            "updated_at": now_ts()
+        }
+
+        if self.store is not None:
+            job_id = self.store.add_mining_job(job, self.max_jobs_per_user)
+            if job_id is None:
+                return None, "Too many active mining jobs"
+            return dict(job, job_id=job_id), None
+
+        with self.lock:
+            active = [j for j in self.jobs.values() if j["user_id"] == user_id and j["status"] == "active"]
+            if len(active) >= self.max_jobs_per_user:
+                return None, "Too many active mining jobs"
+
+            self.job_counter += 1
+            job = dict(job, job_id=self.job_counter)
+            self.jobs[job["job_id"]] = job
+            self.ensure_worker()
+
+        return job, None
+
+    def cancel(self, job_id, user_id):
+        if self.store is not None:
+            # Владелец обрабатывает задачи игрока под его блокировкой - отмена ждет пачку
+            with player_locks.hold(user_id):
+                return self.store.cancel_mining_job(job_id, user_id, now_ts())
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job["user_id"] == user_id and job["status"] == "active":
+                job["status"] = "cancelled"
+                job["updated_at"] = now_ts()
+                return True
+        return False
+
+    def get_user_jobs(self, user_id):
+        if self.store is not None:
+            return self.store.user_mining_jobs(user_id)
+        with self.lock:
+            return [dict(job, rewards=dict(job["rewards"])) for job in self.jobs.values() if job["user_id"] == user_id]
+
+    def ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run, name="mining-scheduler", daemon=True)
+            self.worker.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.process_due()
+            except Exception as e:
+                print(f"❌ Error in mining scheduler: {e}")
+
+    def process_due(self, now=None):
+        """Обработать все задачи, у которых подошло время. Возвращает число попыток"""
+        if self.owner is not None and not self.owner():
+            return 0
+        started = time.time()
+        now = now or started
+
+        if self.store is not None:
+            due = self.store.due_mining_jobs(now)
+        else:
+            with self.lock:
+                due = [j for j in self.jobs.values() if j["status"] == "active" and j["next_due"] <= now]
+        if not due:
+            return 0
+
+        # Одна выборка случайных чисел на всю пачку: шанс успеха и множитель награды
+        success_rolls = self.rng.random(len(due)).tolist()
+        reward_rolls = self.rng.uniform(0.7, 1.1, len(due)).tolist()
+
+        # Задачи одного игрока обрабатываются под его блокировкой, сохранение - одно на игрока
+        by_user = {}
+        for job, success_roll, reward_roll in zip(due, success_rolls, reward_rolls):
+            by_user.setdefault(job["user_id"], []).append((job, success_roll, reward_roll))
+
+        attempts = 0
+        for user_id, user_jobs in by_user.items():
+            with player_locks.hold(user_id):
+                attempts += self.process_user_jobs(user_id, user_jobs, now)
+
+        self.stats["batches"] += 1
+        self.stats["attempts"] += attempts
+        self.stats["last_batch_size"] = len(due)
+        self.stats["last_batch_seconds"] = round(time.time() - started, 4)
+        self.trim_jobs()
+        return attempts
+
+    def process_user_jobs(self, user_id, user_jobs, now):
+        player = self.db.get_player_data(user_id)
+        attempts = 0
+        processed = []
+        for job, success_roll, reward_roll in user_jobs:
+            # Проверка статуса и обновление задачи - под self.lock, иначе отмена,
+            # пришедшая во время обработки, будет перезаписана
+            with self.lock:
+                if self.store is not None:
+                    # Отмена из другого воркера: статус перечитывается под блокировкой игрока
+                    job = self.store.get_mining_job(job["job_id"])
+                if job is None or job["status"] != "active":
+                    continue
+                attempts += self.process_job(job, player, success_roll, reward_roll, now)
+                processed.append(job)
+
+        if attempts:
+            self.db.save_player(user_id, player, ["portfolio", "mining", "stats"])
+        if self.store is not None and processed:
+            self.store.save_mining_jobs(processed)
+        return attempts
+
+    def process_job(self, job, player, success_roll, reward_roll, now):
+        """Одна попытка по задаче. Вызывается под self.lock и блокировкой игрока"""
+        if not player:
+            job["status"] = "failed"
+            job["error"] = "Player not found"
+            return 0
+
+        mining = player["mining"]
+        energy = get_current_energy(mining, now)
+        cooldown_left = MINING_CONFIG["mining_cooldown"] - (now - mining["last_mining_time"])
+
+        if cooldown_left > 0:
+            job["next_due"] = now + cooldown_left
+            return 0
+        if energy < MINING_CONFIG["base_energy_cost"]:
+            # Ждем, пока энергия восстановится до стоимости одной попытки
+            missing = MINING_CONFIG["base_energy_cost"] - energy
+            job["next_due"] = now + missing / MINING_CONFIG["energy_regeneration_rate"] * 60
+            return 0
+
+        symbol = job["symbols"][job["attempts_done"] % len(job["symbols"])]
+        reward = apply_mining_attempt(player, symbol, energy, success_roll, reward_roll, now)
+
+        job["attempts_done"] += 1
+        if reward is None:
+            job["failures"] += 1
+        else:
+            job["successes"] += 1
+            job["rewards"][symbol] += reward
+            job["value"] += reward * player["current_prices"][symbol]
+            metrics.incr("mining_rewards")
+            metrics.incr("mining_emission_value", reward * player["current_prices"][symbol])
+        job["next_due"] = now + MINING_CONFIG["mining_cooldown"]
+        job["updated_at"] = now
+        if job["attempts_done"] >= job["attempts_total"]:
+            job["status"] = "completed"
+        return 1
+
+    def trim_jobs(self, keep_seconds=3600):
+        """Удалить давно завершенные задачи"""
+        cutoff = time.time() - keep_seconds
+        if self.store is not None:
+            self.store.trim_mining_jobs(cutoff)
+            return
+        with self.lock:
+            for job_id in [k for k, j in self.jobs.items() if j["status"] != "active" and j["next_due"] < cutoff]:
+                del self.jobs[job_id]
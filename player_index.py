@@ -0,0 +1,186 @@
+import base64
+import bisect
+import json
+import threading
+
+from timestamps import to_epoch
+
+
+def login_key(player):
+    try:
+        return float(to_epoch(player.get('last_login')) or 0.0)
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+
+
+# Поле сортировки -> (поле игрока, от которого оно зависит, функция значения)
+SORT_KEYS = {
+    "total_value": ("total_value", lambda p: float(p.get('total_value', 0) or 0)),
+    "balance": ("balance", lambda p: float(p.get('balance', 0) or 0)),
+    "last_login": ("last_login", login_key),
+    "total_trades": ("stats", lambda p: int(p.get('stats', {}).get('total_trades', 0) or 0)),
+}
+
+
+def encode_cursor(value, user_id):
+    return base64.urlsafe_b64encode(json.dumps([value, user_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    value, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return value, user_id
+
+
+class PlayerIndex:
+    """Отсортированные индексы для списка игроков в админке.
+
+    Для каждого поля сортировки хранится отсортированный список
+    (значение, user_id), для поиска по имени - список (username.lower(), user_id).
+    Страница берется бинарным поиском от курсора, фильтры применяются при
+    проходе по индексу, так что страница не требует сортировки всех игроков.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {key: [] for key in SORT_KEYS}
+        self.values = {key: {} for key in SORT_KEYS}
+        self.usernames = []
+        self.username_by_user = {}
+
+    def attach(self, database):
+        self.rebuild(database.players)
+        database.add_listener(self.on_change)
+
+    def on_change(self, op, user_id, player, fields):
+        if op == "reset":
+            self.rebuild(player)
+        elif op == "delete":
+            self.remove(user_id)
+        elif player is not None:
+            self.update(user_id, player, fields)
+
+    def rebuild(self, players):
+        entries = {key: [] for key in SORT_KEYS}
+        values = {key: {} for key in SORT_KEYS}
+        usernames = []
+        username_by_user = {}
+        for user_id, player in list(players.items()):
+            for key, (_, value_fn) in SORT_KEYS.items():
+                value = value_fn(player)
+                entries[key].append((value, user_id))
+                values[key][user_id] = value
+            username = str(player.get('username', '')).lower()
+            usernames.append((username, user_id))
+            username_by_user[user_id] = username
+
+        for key_entries in entries.values():
+            key_entries.sort()
+        usernames.sort()
+
+        with self.lock:
+            self.entries = entries
+            self.values = values
+            self.usernames = usernames
+            self.username_by_user = username_by_user
+
+    def update(self, user_id, player, fields=None):
+        with self.lock:
+            for key, (source, value_fn) in SORT_KEYS.items():
+                if fields is not None and source not in fields and user_id in self.values[key]:
+                    continue
+                value = value_fn(player)
+                current = self.values[key].get(user_id)
+                if current == value and user_id in self.values[key]:
+                    continue
+                if user_id in self.values[key]:
+                    self._remove_entry(self.entries[key], (current, user_id))
+                bisect.insort(self.entries[key], (value, user_id))
+                self.values[key][user_id] = value
+
+            if fields is None or 'username' in fields or user_id not in self.username_by_user:
+                username = str(player.get('username', '')).lower()
+                current = self.username_by_user.get(user_id)
+                if current != username:
+                    if current is not None:
+                        self._remove_entry(self.usernames, (current, user_id))
+                    bisect.insort(self.usernames, (username, user_id))
+                    self.username_by_user[user_id] = username
+
+    def remove(self, user_id):
+        with self.lock:
+            for key in SORT_KEYS:
+                if user_id in self.values[key]:
+                    self._remove_entry(self.entries[key], (self.values[key].pop(user_id), user_id))
+            username = self.username_by_user.pop(user_id, None)
+            if username is not None:
+                self._remove_entry(self.usernames, (username, user_id))
+
+    def _remove_entry(self, entries, item):
+        index = bisect.bisect_left(entries, item)
+        if index < len(entries) and entries[index] == item:
+            del entries[index]
+
+    def count(self, predicate=None, prefix=None):
+        """Число игроков с учетом поиска по имени и фильтров.
+
+        Без фильтров - O(1), с поиском - только совпавшие по префиксу,
+        с predicate - проход по кандидатам без копирования записей.
+        """
+        with self.lock:
+            if prefix:
+                prefix = prefix.lower()
+                start = bisect.bisect_left(self.usernames, (prefix, ""))
+                end = bisect.bisect_left(self.usernames, (prefix + "\U0010ffff", ""))
+                user_ids = (user_id for _, user_id in self.usernames[start:end])
+            elif predicate is not None:
+                user_ids = list(self.username_by_user)
+            else:
+                return len(self.username_by_user)
+            if predicate is None:
+                return sum(1 for _ in user_ids)
+            return sum(1 for user_id in user_ids if predicate(user_id))
+
+    def page(self, sort="total_value", descending=True, limit=50, cursor=None,
+             predicate=None, prefix=None):
+        """Страница user_id в порядке сортировки.
+
+        cursor - значение next_cursor предыдущей страницы, predicate(user_id)
+        отсекает игроков по фильтрам. Возвращает (user_ids, next_cursor).
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unsupported sort field: {sort}")
+        after = decode_cursor(cursor) if cursor else None
+
+        with self.lock:
+            if prefix:
+                prefix = prefix.lower()
+                values = self.values[sort]
+                candidates = []
+                for i in range(bisect.bisect_left(self.usernames, (prefix, "")), len(self.usernames)):
+                    username, user_id = self.usernames[i]
+                    if not username.startswith(prefix):
+                        break
+                    candidates.append((values[user_id], user_id))
+                candidates.sort()
+                entries = candidates
+            else:
+                entries = self.entries[sort]
+
+            if descending:
+                end = bisect.bisect_left(entries, tuple(after)) if after else len(entries)
+                ordered = (entries[i] for i in range(end - 1, -1, -1))
+            else:
+                start = bisect.bisect_right(entries, tuple(after)) if after else 0
+                ordered = (entries[i] for i in range(start, len(entries)))
+
+            page = []
+            last = None
+            for value, user_id in ordered:
+                if predicate is not None and not predicate(user_id):
+                    continue
+                if len(page) == limit:
+                    return page, encode_cursor(*last)
+                page.append(user_id)
+                last = (value, user_id)
+
+        return page, None
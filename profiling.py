@@ -0,0 +1,211 @@
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+class ProfileCaptures:
+    """Снимки профилировщика на диске: <id>.json с описанием и файл с данными"""
+
+    def __init__(self, directory="profiles", keep=50):
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()
+
+    def new_id(self, kind):
+        return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{kind}_{uuid.uuid4().hex[:6]}"
+
+    def save(self, capture_id, meta, files):
+        """files - {расширение: bytes}"""
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for ext, data in files.items():
+                with open(os.path.join(self.directory, f"{capture_id}.{ext}"), 'wb') as f:
+                    f.write(data)
+            meta = dict(meta, id=capture_id, files=sorted(files))
+            with open(os.path.join(self.directory, f"{capture_id}.json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            self.trim()
+        return meta
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        captures = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                        captures.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return captures
+
+    def path(self, capture_id, ext):
+        """Путь к файлу снимка или None (capture_id проверяется по списку)"""
+        for meta in self.list():
+            if meta["id"] == capture_id and ext in meta["files"]:
+                return os.path.join(self.directory, f"{capture_id}.{ext}")
+        return None
+
+    def trim(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".json"))
+        for name in names[:-self.keep] if len(names) > self.keep else []:
+            capture_id = name[:-len(".json")]
+            for file_name in os.listdir(self.directory):
+                if file_name.startswith(capture_id + "."):
+                    os.remove(os.path.join(self.directory, file_name))
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик всех потоков процесса.
+
+    Фоновый поток каждые interval секунд снимает стеки через
+    sys._current_frames() и считает одинаковые стеки. Результат - collapsed
+    stacks ("поток;кадр;кадр число"), их понимают flamegraph.pl и speedscope.
+    Потоки запросов при этом не останавливаются и не трассируются.
+    """
+
+    def __init__(self, captures):
+        self.captures = captures
+        self.thread = None
+        self.status = {"state": "idle"}
+
+    def start(self, seconds=10, interval=0.005):
+        """Запустить профилирование в фоне. Возвращает id снимка или None, если уже идет"""
+        if self.thread is not None and self.thread.is_alive():
+            return None
+        capture_id = self.captures.new_id("sample")
+        self.status = {"state": "running", "capture_id": capture_id, "seconds": seconds,
+                       "started_at": datetime.now().isoformat()}
+        self.thread = threading.Thread(target=self.run, args=(capture_id, seconds, interval),
+                                       name="sampling-profiler", daemon=True)
+        self.thread.start()
+        return capture_id
+
+    def run(self, capture_id, seconds, interval):
+        own_id = threading.get_ident()
+        names = {}
+        stacks = {}
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        try:
+            while time.perf_counter() < deadline:
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                    key = ";".join(reversed(stack))
+                    stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+
+            folded = "\n".join(f"{stack} {count}" for stack, count in sorted(stacks.items())) + "\n"
+            meta = self.captures.save(capture_id, {
+                "kind": "sample",
+                "created_at": datetime.now().isoformat(),
+                "seconds": round(time.perf_counter() - started, 3),
+                "interval": interval,
+                "samples": samples,
+                "stacks": len(stacks)
+            }, {"folded": folded.encode('utf-8')})
+            self.status = {"state": "done", "capture": meta}
+        except Exception as e:
+            self.status = {"state": "failed", "capture_id": capture_id, "error": str(e)}
+            print(f"❌ Error in sampling profiler: {e}")
+
+
+class RequestProfiler:
+    """cProfile для отдельных запросов.
+
+    Правило задает маршрут (шаблон Flask, например /api/player/<user_id>, или
+    префикс пути) и/или user_id, сколько запросов снять и до какого времени.
+    Пока правил нет, проверка в начале запроса - одно сравнение.
+    """
+
+    def __init__(self, captures):
+        self.captures = captures
+        self.lock = threading.Lock()
+        self.rules = {}
+
+    def arm(self, route=None, user_id=None, count=1, ttl=600):
+        rule_id = uuid.uuid4().hex[:8]
+        with self.lock:
+            self.rules[rule_id] = {
+                "id": rule_id,
+                "route": route,
+                "user_id": user_id,
+                "remaining": count,
+                "expires_at": time.time() + ttl
+            }
+        return rule_id
+
+    def disarm(self, rule_id=None):
+        with self.lock:
+            if rule_id is None:
+                self.rules.clear()
+                return True
+            return self.rules.pop(rule_id, None) is not None
+
+    def list_rules(self):
+        with self.lock:
+            return [dict(rule) for rule in self.rules.values()]
+
+    def match(self, rule_path, path, user_id):
+        """Правило для запроса (и одна снятая попытка) или None"""
+        if not self.rules:
+            return None
+        now = time.time()
+        with self.lock:
+            for rule_id, rule in list(self.rules.items()):
+                if rule["expires_at"] < now:
+                    del self.rules[rule_id]
+                    continue
+                if rule["route"] and rule["route"] != rule_path and not path.startswith(rule["route"]):
+                    continue
+                if rule["user_id"] and rule["user_id"] != user_id:
+                    continue
+                rule["remaining"] -= 1
+                if rule["remaining"] <= 0:
+                    del self.rules[rule_id]
+                return dict(rule)
+        return None
+
+    def start(self):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler, time.perf_counter()
+
+    def finish(self, profiler, started, rule, request_info):
+        profiler.disable()
+        duration = time.perf_counter() - started
+
+        text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=text)
+        stats.sort_stats("cumulative").print_stats(40)
+        capture_id = self.captures.new_id("request")
+        return self.captures.save(capture_id, dict(request_info, **{
+            "kind": "request",
+            "rule_id": rule["id"],
+            "created_at": datetime.now().isoformat(),
+            "seconds": round(duration, 6)
+        }), {
+            "txt": text.getvalue().encode('utf-8'),
+            # Тот же формат, что пишет pstats.dump_stats: открывается pstats.Stats и snakeviz
+            "prof": marshal.dumps(stats.stats)
+        })
@@ -0,0 +1,252 @@
+"""Офлайн Монте-Карло симулятор экономики.
+
+Прогоняет популяцию игроков по дням с теми же формулами, что и сервер
+(шанс и награда майнинга, generate_realistic_price, calculate_trading_fee,
+ежедневный бонус со стриком), и считает эмиссию монет и распределение
+богатства для набора параметров. Пример:
+
+    python simulator.py --players 100000 --days 30 \\
+        --sweep difficulty_scale=0.5,1,2 --out simulation.json
+"""
+import argparse
+import copy
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from economy import CRYPTOS, MINING_CONFIG, calculate_trading_fee
+
+SYMBOLS = list(CRYPTOS.keys())
+
+DEFAULT_BEHAVIOUR = {
+    "mining_attempts_per_day": 12,
+    "trades_per_day": 3,
+    "trade_fraction": 0.1,
+    "market_order_share": 0.7,
+    "bonus_claim_probability": 0.6,
+    "price_ticks_per_day": 24,
+    "starting_balance": 500.0,
+    "equipment_distribution": {1: 0.7, 2: 0.18, 3: 0.08, 4: 0.03, 5: 0.01}
+}
+
+
+def make_params(difficulty_scale=1.0, reward_scale=1.0, equipment_multipliers=None,
+                cryptos=None, mining_config=None, **behaviour):
+    """Собрать набор параметров на основе текущих CRYPTOS и MINING_CONFIG"""
+    params = {
+        "cryptos": copy.deepcopy(cryptos or CRYPTOS),
+        "mining_config": copy.deepcopy(mining_config or MINING_CONFIG),
+        "behaviour": dict(DEFAULT_BEHAVIOUR, **behaviour),
+        "label": {
+            "difficulty_scale": difficulty_scale,
+            "reward_scale": reward_scale,
+            **behaviour
+        }
+    }
+    for crypto in params["cryptos"].values():
+        crypto["mining_difficulty"] *= difficulty_scale
+        crypto["mining_reward"] *= reward_scale
+    for level, multiplier in (equipment_multipliers or {}).items():
+        params["mining_config"]["equipment_levels"][int(level)]["multiplier"] = multiplier
+    return params
+
+
+def success_chance_table(params):
+    """Шанс успеха [уровень, монета]: min(0.8, multiplier * mining_power / difficulty).
+
+    После апгрейда mining_power равен множителю уровня, на первом уровне - 1.0.
+    """
+    levels = params["mining_config"]["equipment_levels"]
+    table = np.zeros((len(levels) + 1, len(SYMBOLS)))
+    for level, config in levels.items():
+        power = config["multiplier"] if level > 1 else 1.0
+        for j, symbol in enumerate(SYMBOLS):
+            difficulty = params["cryptos"][symbol]["mining_difficulty"]
+            table[level, j] = min(0.8, (config["multiplier"] * power) / difficulty)
+    return table
+
+
+def reward_table(params):
+    """Базовая награда за успешную попытку [уровень, монета] без случайного множителя"""
+    levels = params["mining_config"]["equipment_levels"]
+    table = np.zeros((len(levels) + 1, len(SYMBOLS)))
+    for level, config in levels.items():
+        power = config["multiplier"] if level > 1 else 1.0
+        for j, symbol in enumerate(SYMBOLS):
+            table[level, j] = params["cryptos"][symbol]["mining_reward"] * config["multiplier"] * power
+    return table
+
+
+def price_step(prices, rng, volatility, base_prices, ticks=1):
+    """Векторная версия generate_realistic_price для массива цен [игрок, монета].
+
+    ticks шагов схлопываются в один: волатильность растет как sqrt(ticks),
+    возврат к базовой цене - линейно. Ограничения 0.7x/1.5x за шаг при
+    реальных волатильностях не срабатывают, поэтому точность не теряется.
+    """
+    change = rng.normal(0.0, 1.0, size=prices.shape) * (volatility * np.sqrt(ticks))
+    change += (base_prices - prices) * 0.0003 * ticks
+    new_prices = prices * (1 + change)
+    return np.clip(new_prices, prices * 0.7, prices * 1.5)
+
+
+def gini(values):
+    values = np.sort(np.maximum(values, 0))
+    n = len(values)
+    if n == 0 or values.sum() == 0:
+        return 0.0
+    index = np.arange(1, n + 1)
+    return float((2 * np.sum(index * values) / (n * values.sum())) - (n + 1) / n)
+
+
+def simulate(params, players=10000, days=30, seed=0):
+    """Прогнать players игроков на days дней. Возвращает словарь с метриками"""
+    started = time.time()
+    rng = np.random.default_rng(seed)
+    behaviour = params["behaviour"]
+    n_symbols = len(SYMBOLS)
+
+    volatility = np.array([params["cryptos"][s]["volatility"] for s in SYMBOLS])
+    base_prices = np.array([params["cryptos"][s]["base_price"] for s in SYMBOLS])
+    mining_config = params["mining_config"]
+
+    # Ограничения майнинга: энергия восстанавливается energy_regeneration_rate в минуту, плюс кулдаун
+    energy_per_day = mining_config["energy_regeneration_rate"] * 1440
+    max_attempts = int(min(energy_per_day / mining_config["base_energy_cost"],
+                           86400 / mining_config["mining_cooldown"]))
+
+    distribution = behaviour["equipment_distribution"]
+    levels = rng.choice(
+        np.array(list(distribution.keys()), dtype=int),
+        size=players,
+        p=np.array(list(distribution.values())) / sum(distribution.values())
+    )
+    chance = success_chance_table(params)[levels]
+    base_reward = reward_table(params)[levels]
+
+    balance = np.full(players, behaviour["starting_balance"])
+    holdings = np.zeros((players, n_symbols))
+    prices = base_prices * rng.uniform(0.95, 1.05, size=(players, n_symbols))
+    streak = np.ones(players, dtype=int)
+    claimed_yesterday = np.zeros(players, dtype=bool)
+
+    emission = np.zeros(n_symbols)
+    emission_value = 0.0
+    bonus_total = 0.0
+    fees_total = 0.0
+    daily_emission_value = []
+
+    for _ in range(days):
+        prices = price_step(prices, rng, volatility, base_prices, behaviour["price_ticks_per_day"])
+
+        # Майнинг: попытки равномерно делятся между монетами. Успехи по монете -
+        # прореженное биномиальное распределение Binomial(attempts, chance / n_symbols)
+        attempts = np.minimum(rng.poisson(behaviour["mining_attempts_per_day"], size=players), max_attempts)
+        successes = rng.binomial(attempts[:, None], chance / n_symbols)
+        # Сумма k множителей U(0.7, 1.1) - нормальное приближение
+        multiplier_sum = successes * 0.9 + rng.standard_normal(successes.shape) * np.sqrt(successes * 0.4 ** 2 / 12)
+        mined = base_reward * np.maximum(multiplier_sum, 0)
+        holdings += mined
+        emission += mined.sum(axis=0)
+        day_value = float((mined * prices).sum())
+        emission_value += day_value
+        daily_emission_value.append(day_value)
+
+        # Ежедневный бонус: min(50, 5 * streak), стрик растет при входе подряд
+        claims = rng.random(players) < behaviour["bonus_claim_probability"]
+        bonus = np.where(claims, np.minimum(50, 5 * streak), 0)
+        balance += bonus
+        bonus_total += float(bonus.sum())
+        streak = np.where(claims, np.where(claimed_yesterday, streak + 1, 1), streak)
+        claimed_yesterday = claims
+
+        # Торговля: комиссия по calculate_trading_fee выводит деньги из экономики
+        trades = rng.poisson(behaviour["trades_per_day"], size=players)
+        notional = trades * balance * behaviour["trade_fraction"]
+        market_share = behaviour["market_order_share"]
+        fees = (calculate_trading_fee(notional * market_share, 1.0, 'market') +
+                calculate_trading_fee(notional * (1 - market_share), 1.0, 'limit'))
+        fees = np.minimum(fees, balance)
+        balance -= fees
+        fees_total += float(fees.sum())
+
+    wealth = balance + (holdings * prices).sum(axis=1)
+    percentiles = np.percentile(wealth, [10, 50, 90, 99])
+
+    return {
+        "params": params["label"],
+        "players": players,
+        "days": days,
+        "player_days": players * days,
+        "emission": {symbol: float(emission[j]) for j, symbol in enumerate(SYMBOLS)},
+        "emission_per_player_day": {symbol: float(emission[j] / (players * days)) for j, symbol in enumerate(SYMBOLS)},
+        "emission_value": emission_value,
+        "daily_emission_value": daily_emission_value,
+        "bonus_total": bonus_total,
+        "fees_total": fees_total,
+        "net_inflation": emission_value + bonus_total - fees_total,
+        "wealth": {
+            "mean": float(wealth.mean()),
+            "p10": float(percentiles[0]),
+            "median": float(percentiles[1]),
+            "p90": float(percentiles[2]),
+            "p99": float(percentiles[3]),
+            "gini": gini(wealth)
+        },
+        "seconds": round(time.time() - started, 3)
+    }
+
+
+def run_one(args):
+    params, players, days, seed = args
+    return simulate(params, players, days, seed)
+
+
+def sweep(param_sets, players=10000, days=30, seed=0, workers=None):
+    """Прогнать несколько наборов параметров параллельно в пуле процессов"""
+    jobs = [(params, players, days, seed + i) for i, params in enumerate(param_sets)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_one, jobs))
+
+
+def parse_sweep(values):
+    """--sweep difficulty_scale=0.5,1,2 --sweep reward_scale=1,2 -> список наборов параметров"""
+    grid = [{}]
+    for item in values or []:
+        name, options = item.split("=", 1)
+        grid = [dict(point, **{name: float(option)}) for point in grid for option in options.split(",")]
+    return [make_params(**point) for point in grid]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo economy simulator")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sweep", action="append", help="name=v1,v2,... (difficulty_scale, reward_scale, ...)")
+    parser.add_argument("--out", help="Write results to a JSON file")
+    args = parser.parse_args()
+
+    param_sets = parse_sweep(args.sweep)
+    started = time.time()
+    if len(param_sets) == 1:
+        results = [simulate(param_sets[0], args.players, args.days, args.seed)]
+    else:
+        results = sweep(param_sets, args.players, args.days, args.seed, args.workers)
+
+    for result in results:
+        print(f"📈 {result['params']}: emission ${result['emission_value']:,.0f}, "
+              f"net inflation ${result['net_inflation']:,.0f}, median wealth ${result['wealth']['median']:,.2f}, "
+              f"gini {result['wealth']['gini']:.3f} ({result['seconds']}s)")
+    print(f"⏱️ {len(results)} runs, {sum(r['player_days'] for r in results):,} player-days in {time.time() - started:.1f}s")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+
+def write_snapshot(path, data):
+    """Записать JSON атомарно: временный файл, fsync, rename, fsync каталога.
+
+    Возвращает размер файла в байтах.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return size
+
+
+class ForkSnapshotter:
+    """Снимки данных в дочернем процессе.
+
+    save_data только отмечает, что данные изменились. Фоновый поток делает
+    fork, и дочерний процесс сериализует свою copy-on-write копию памяти,
+    не занимая GIL родителя. Родитель продолжает обслуживать запросы, а поток
+    ждет завершения потомка и записывает результат. Изменения, пришедшие во
+    время снимка, попадут в следующий.
+    """
+
+    def __init__(self, path, source, barrier, min_interval=1.0, on_snapshot=None):
+        self.path = path
+        # source() возвращает данные для записи, вызывается в потомке
+        self.source = source
+        # barrier() - контекст, под которым делается fork: пока он удерживается,
+        # никто не меняет игроков, и снимок видит целостный набор данных
+        self.barrier = barrier
+        self.min_interval = min_interval
+        # on_snapshot(секунды, байты) вызывается после каждого успешного снимка
+        self.on_snapshot = on_snapshot
+        self.pending = threading.Event()
+        self.state = threading.Condition()
+        self.worker = None
+        self.running = False
+        self.started_at = 0.0
+        self.generation = 0
+        self.stats = {
+            "snapshots": 0,
+            "failures": 0,
+            "last_duration_seconds": None,
+            "last_bytes": None,
+            "last_success_at": os.path.getmtime(path) if os.path.exists(path) else None,
+            "last_error": None
+        }
+
+    def request(self, wait=False, timeout=60):
+        """Запросить снимок. wait=True - дождаться снимка, начатого после запроса"""
+        self.start()
+        with self.state:
+            target = self.generation + (2 if self.running else 1)
+        self.pending.set()
+        if not wait:
+            return True
+        with self.state:
+            return self.state.wait_for(lambda: self.generation >= target, timeout)
+
+    def start(self):
+        if self.worker is not None:
+            return
+        with self.state:
+            if self.worker is not None:
+                return
+            self.worker = threading.Thread(target=self.loop, name="db-snapshot", daemon=True)
+            self.worker.start()
+            atexit.register(self.flush)
+
+    def loop(self):
+        while True:
+            self.pending.wait()
+            delay = self.started_at + self.min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.pending.clear()
+            with self.state:
+                self.running = True
+            try:
+                self.snapshot()
+            except Exception as e:
+                self.record_failure(str(e))
+            finally:
+                with self.state:
+                    self.running = False
+                    self.generation += 1
+                    self.state.notify_all()
+
+    def snapshot(self):
+        read_fd, write_fd = os.pipe()
+        # Иначе буферы вывода родителя продублируются в потомке
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.started_at = time.time()
+        with self.barrier():
+            pid = os.fork()
+        if pid == 0:
+            self.run_child(read_fd, write_fd)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as pipe:
+            report = pipe.read()
+        _, status = os.waitpid(pid, 0)
+        duration = time.time() - self.started_at
+
+        if os.waitstatus_to_exitcode(status) != 0 or not report:
+            self.record_failure(report.decode(errors='replace') or f"snapshot process exited with {status}")
+            return
+        with self.state:
+            self.stats["snapshots"] += 1
+            self.stats["last_duration_seconds"] = round(duration, 3)
+            self.stats["last_bytes"] = int(report)
+            self.stats["last_success_at"] = self.started_at
+            self.stats["last_error"] = None
+        if self.on_snapshot is not None:
+            self.on_snapshot(duration, int(report))
+
+    def run_child(self, read_fd, write_fd):
+        # Только в потомке: никаких блокировок и вывода, выход через os._exit
+        code = 1
+        try:
+            os.close(read_fd)
+            size = write_snapshot(self.path, self.source())
+            os.write(write_fd, str(size).encode())
+            code = 0
+        except BaseException as e:
+            try:
+                os.write(write_fd, f"error: {e}".encode())
+            except OSError:
+                pass
+        finally:
+            os._exit(code)
+
+    def record_failure(self, error):
+        with self.state:
+            self.stats["failures"] += 1
+            self.stats["last_error"] = error
+        print(f"❌ Error saving snapshot: {error}")
+
+    def flush(self):
+        """Дождаться текущего снимка и, если остались изменения, записать их прямо в процессе"""
+        with self.state:
+            self.state.wait_for(lambda: not self.running, 60)
+        if self.pending.is_set():
+            self.pending.clear()
+            with self.barrier():
+                data = self.source()
+            write_snapshot(self.path, data)
+
+    def get_stats(self):
+        with self.state:
+            stats = dict(self.stats)
+            stats["in_progress"] = self.running
+        stats["pending"] = self.pending.is_set()
+        last_success = stats["last_success_at"]
+        stats["last_success_age_seconds"] = round(time.time() - last_success, 1) if last_success else None
+        return stats
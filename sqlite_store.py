@@ -0,0 +1,309 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+def connect(path):
+    """Соединение в режиме WAL без неявных транзакций (они открываются через Transaction)"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class StaleWriteError(Exception):
+    """Запись игрока изменилась в другом процессе после того, как мы ее прочитали"""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    op TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    fields TEXT
+);
+CREATE TABLE IF NOT EXISTS p2p_orders (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mining_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    next_due REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mining_jobs_user ON mining_jobs (user_id);
+CREATE INDEX IF NOT EXISTS mining_jobs_due ON mining_jobs (status, next_due);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+class SqliteStore:
+    """Общее хранилище для нескольких процессов (воркеров gunicorn).
+
+    Каждый игрок - строка с номером версии, запись проходит только если версия
+    не изменилась с момента чтения. Каждая запись добавляет строку в таблицу
+    changes, по которой воркеры подтягивают чужие изменения в свой кэш. Номер
+    строки changes.seq общий для всех воркеров и служит версией изменений.
+    P2P ордера хранятся целиком с общим счетчиком версии в meta. Здесь же
+    общая очередь задач майнинга и счетчики, которые воркеры передают
+    процессу-владельцу истории метрик.
+    """
+
+    def __init__(self, path, keep_changes=100000):
+        self.path = path
+        self.keep_changes = keep_changes
+        self.local = threading.local()
+        self.writes = 0
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            # Хранилище, созданное до появления списка измененных полей
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(changes)")]
+            if "fields" not in columns:
+                conn.execute("ALTER TABLE changes ADD COLUMN fields TEXT")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def transaction(self):
+        return Transaction(self.connection())
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM players").fetchone()[0]
+
+    def last_seq(self):
+        return self.connection().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def load_all(self):
+        """Все игроки: ({user_id: данные}, {user_id: версия}, номер последнего изменения)"""
+        with self.transaction() as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            rows = conn.execute("SELECT user_id, data, version FROM players").fetchall()
+        players = {user_id: json.loads(data) for user_id, data, _ in rows}
+        versions = {user_id: version for user_id, _, version in rows}
+        return players, versions, seq
+
+    def get(self, user_id):
+        row = self.connection().execute(
+            "SELECT data, version FROM players WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def changes_since(self, seq):
+        """Изменения после seq: (наименьший номер в журнале, [(seq, user_id, op, fields)]).
+
+        fields - список измененных полей или None (все поля). Если наименьший
+        номер больше seq + 1, часть изменений уже обрезана.
+        """
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT seq, user_id, op, fields FROM changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        if not rows:
+            return seq, []
+        # Нижняя граница читается после строк: обрезка между запросами будет замечена
+        floor = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        return floor, [(row_seq, user_id, op, json.loads(fields) if fields is not None else None)
+                       for row_seq, user_id, op, fields in rows]
+
+    def write_player(self, user_id, data, expected_version, fields=None):
+        """Записать игрока, если его версия все еще expected_version (None - новый игрок).
+
+        fields - измененные поля (None - все), попадают в журнал changes.
+        Возвращает новую версию, при конфликте - StaleWriteError.
+        """
+        payload = json.dumps(data, ensure_ascii=False)
+        with self.transaction() as conn:
+            if expected_version is None:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO players (user_id, data, version) VALUES (?, ?, 1)",
+                    (user_id, payload)
+                )
+                version = 1
+            else:
+                cursor = conn.execute(
+                    "UPDATE players SET data = ?, version = version + 1 WHERE user_id = ? AND version = ?",
+                    (payload, user_id, expected_version)
+                )
+                version = expected_version + 1
+            if cursor.rowcount == 0:
+                raise StaleWriteError(f"Player {user_id} was modified by another worker")
+            conn.execute("INSERT INTO changes (user_id, op, created_at, fields) VALUES (?, ?, ?, ?)",
+                         (user_id, "create" if expected_version is None else "update", time.time(),
+                          json.dumps(list(fields)) if fields is not None else None))
+        self.after_write()
+        return version
+
+    def delete_player(self, user_id):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM players WHERE user_id = ?", (user_id,))
+            conn.execute("INSERT INTO changes (user_id, op, created_at) VALUES (?, 'delete', ?)",
+                         (user_id, time.time()))
+        self.after_write()
+
+    def replace_all(self, players):
+        """Заменить всех игроков одной транзакцией. Возвращает ({user_id: версия}, номер изменения)"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM players")
+            conn.executemany(
+                "INSERT INTO players (user_id, data, version) VALUES (?, ?, 1)",
+                [(user_id, json.dumps(data, ensure_ascii=False)) for user_id, data in players.items()]
+            )
+            seq = conn.execute("INSERT INTO changes (user_id, op, created_at) VALUES (NULL, 'reset', ?)",
+                               (time.time(),)).lastrowid
+        return {user_id: 1 for user_id in players}, seq
+
+    def compact_players(self, transform, markers=()):
+        """Переписать данные игроков через transform(data) без смены версий.
+
+        Для миграций формата, не меняющих смысл записи. markers - подстроки, без
+        которых строку можно не разбирать. Возвращает число измененных строк.
+        """
+        changed = 0
+        with self.transaction() as conn:
+            for user_id, data in conn.execute("SELECT user_id, data FROM players").fetchall():
+                if markers and not any(marker in data for marker in markers):
+                    continue
+                payload = json.dumps(transform(json.loads(data)), ensure_ascii=False)
+                if payload != data:
+                    conn.execute("UPDATE players SET data = ? WHERE user_id = ?", (payload, user_id))
+                    changed += 1
+        return changed
+
+    def after_write(self):
+        # Время от времени обрезаем журнал изменений
+        self.writes += 1
+        if self.writes % 1000 == 0:
+            self.connection().execute(
+                "DELETE FROM changes WHERE seq < (SELECT MAX(seq) FROM changes) - ?", (self.keep_changes,)
+            )
+
+    def load_orders(self):
+        with self.transaction() as conn:
+            version = self.get_meta(conn, "p2p_version")
+            rows = conn.execute("SELECT data FROM p2p_orders ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows], version
+
+    def orders_version(self):
+        return self.get_meta(self.connection(), "p2p_version")
+
+    def save_orders(self, orders):
+        """Записать все ордера и увеличить общую версию стакана"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM p2p_orders")
+            conn.executemany("INSERT INTO p2p_orders (id, data) VALUES (?, ?)",
+                             [(order["id"], json.dumps(order, ensure_ascii=False)) for order in orders])
+            conn.execute("INSERT INTO meta (key, value) VALUES ('p2p_version', 1) "
+                         "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+            return self.get_meta(conn, "p2p_version")
+
+    def get_meta(self, conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def add_mining_job(self, job, max_active):
+        """Добавить задачу, если у игрока меньше max_active активных. Возвращает job_id или None"""
+        with self.transaction() as conn:
+            active = conn.execute("SELECT COUNT(*) FROM mining_jobs WHERE user_id = ? AND status = 'active'",
+                                  (job["user_id"],)).fetchone()[0]
+            if active >= max_active:
+                return None
+            return conn.execute(
+                "INSERT INTO mining_jobs (user_id, status, next_due, data) VALUES (?, ?, ?, ?)",
+                (job["user_id"], job["status"], job["next_due"], json.dumps(job, ensure_ascii=False))
+            ).lastrowid
+
+    def save_mining_jobs(self, jobs):
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE mining_jobs SET status = ?, next_due = ?, data = ? WHERE job_id = ?",
+                [(job["status"], job["next_due"], json.dumps(job, ensure_ascii=False), job["job_id"]) for job in jobs]
+            )
+
+    def get_mining_job(self, job_id):
+        row = self.connection().execute("SELECT job_id, data FROM mining_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self.mining_job(*row) if row else None
+
+    def user_mining_jobs(self, user_id):
+        rows = self.connection().execute(
+            "SELECT job_id, data FROM mining_jobs WHERE user_id = ? ORDER BY job_id", (user_id,)
+        ).fetchall()
+        return [self.mining_job(*row) for row in rows]
+
+    def due_mining_jobs(self, now):
+        rows = self.connection().execute(
+            "SELECT job_id, data FROM mining_jobs WHERE status = 'active' AND next_due <= ? ORDER BY job_id", (now,)
+        ).fetchall()
+        return [self.mining_job(*row) for row in rows]
+
+    def mining_job(self, job_id, data):
+        job = json.loads(data)
+        job["job_id"] = job_id
+        return job
+
+    def cancel_mining_job(self, job_id, user_id, now):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT job_id, data FROM mining_jobs WHERE job_id = ? AND user_id = ? AND status = 'active'",
+                               (job_id, user_id)).fetchone()
+            if row is None:
+                return False
+            job = self.mining_job(*row)
+            job["status"] = "cancelled"
+            job["updated_at"] = now
+            conn.execute("UPDATE mining_jobs SET status = ?, data = ? WHERE job_id = ?",
+                         (job["status"], json.dumps(job, ensure_ascii=False), job_id))
+            return True
+
+    def trim_mining_jobs(self, cutoff):
+        """Удалить завершенные задачи, последняя попытка по которым была раньше cutoff"""
+        self.connection().execute("DELETE FROM mining_jobs WHERE status != 'active' AND next_due < ?", (cutoff,))
+
+    def add_counters(self, values):
+        """Прибавить значения к общим счетчикам {имя: значение}"""
+        with self.transaction() as conn:
+            conn.executemany("INSERT INTO counters (name, value) VALUES (?, ?) "
+                             "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                             list(values.items()))
+
+    def take_counters(self, prefix):
+        """Забрать и обнулить общие счетчики с именами, начинающимися с prefix"""
+        with self.transaction() as conn:
+            rows = conn.execute("SELECT name, value FROM counters WHERE substr(name, 1, ?) = ?",
+                                (len(prefix), prefix)).fetchall()
+            conn.execute("DELETE FROM counters WHERE substr(name, 1, ?) = ?", (len(prefix), prefix))
+        return {name[len(prefix):]: value for name, value in rows}
+
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT / ROLLBACK"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import re
+import time
+
+from flask import Response, render_template, request
+
+from http_cache import brotli
+
+INLINE_STYLE = re.compile(r"<style>(.*?)</style>", re.S)
+INLINE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PAGE_CACHE_CONTROL = "no-cache"
+
+
+class StaticPages:
+    """Страницы, собранные один раз при старте.
+
+    Шаблоны не принимают переменных, поэтому каждый рендерится один раз.
+    Встроенные <style> и <script> выносятся в файлы /assets/ с хэшем
+    содержимого в имени и отдаются с immutable кэшированием. Для страниц и
+    ассетов заранее считаются gzip и brotli варианты, так что запрос страницы
+    не тратит CPU ни на шаблон, ни на сжатие.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.assets = {}
+        self.stats = {"built_at": None, "build_seconds": 0, "pages": 0, "assets": 0,
+                      "bytes": 0, "gzip_bytes": 0, "br_bytes": 0}
+
+    def build(self, app, templates):
+        """templates: {имя страницы: файл шаблона}"""
+        started = time.time()
+        pages = {}
+        assets = {}
+
+        with app.test_request_context():
+            for name, template in templates.items():
+                html = render_template(template)
+                html = INLINE_STYLE.sub(
+                    lambda m: self.extract(assets, name, "css", m.group(1),
+                                           '<link rel="stylesheet" href="/assets/{}">'),
+                    html
+                )
+                html = INLINE_SCRIPT.sub(
+                    lambda m: self.extract(assets, name, "js", m.group(1),
+                                           '<script src="/assets/{}"></script>'),
+                    html
+                )
+                pages[name] = self.make_variants(html.encode("utf-8"), "text/html")
+
+        self.pages = pages
+        self.assets = assets
+
+        variants = list(pages.values()) + list(assets.values())
+        self.stats = {
+            "built_at": time.time(),
+            "build_seconds": round(time.time() - started, 3),
+            "pages": len(pages),
+            "assets": len(assets),
+            "bytes": sum(len(v["identity"]) for v in variants),
+            "gzip_bytes": sum(len(v["gzip"]) for v in variants),
+            "br_bytes": sum(len(v.get("br", b"")) for v in variants)
+        }
+        print(f"📦 Built {len(pages)} pages and {len(assets)} assets in {self.stats['build_seconds']}s")
+
+    def extract(self, assets, page, ext, content, tag):
+        data = content.strip().encode("utf-8") + b"\n"
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        filename = f"{page}.{digest}.{ext}"
+        mimetype = "text/css" if ext == "css" else "application/javascript"
+        assets[filename] = self.make_variants(data, mimetype)
+        return tag.format(filename)
+
+    def make_variants(self, data, mimetype):
+        variants = {
+            "mimetype": mimetype,
+            "etag": hashlib.sha256(data).hexdigest()[:16],
+            "identity": data,
+            "gzip": gzip.compress(data, compresslevel=9, mtime=0)
+        }
+        if brotli is not None:
+            variants["br"] = brotli.compress(data, quality=11)
+        return variants
+
+    def choose_encoding(self, variants):
+        accepted = request.headers.get("Accept-Encoding", "").lower()
+        tokens = {part.split(";")[0].strip() for part in accepted.split(",")}
+        if "br" in tokens and "br" in variants:
+            return "br"
+        if "gzip" in tokens:
+            return "gzip"
+        return "identity"
+
+    def respond(self, variants, cache_control):
+        if request.if_none_match.contains(variants["etag"]):
+            response = Response(status=304)
+        else:
+            encoding = self.choose_encoding(variants)
+            response = Response(variants[encoding], mimetype=variants["mimetype"])
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(variants["etag"])
+        response.headers["Cache-Control"] = cache_control
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def page(self, name):
+        return self.respond(self.pages[name], PAGE_CACHE_CONTROL)
+
+    def asset(self, filename):
+        variants = self.assets.get(filename)
+        if variants is None:
+            return None
+        return self.respond(variants, ASSET_CACHE_CONTROL)
@@ -0,0 +1,185 @@
+import bisect
+import os
+import threading
+
+# Границы бакетов по умолчанию (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600, 1073741824)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 1000)
+
+
+def format_labels(names, values, const=()):
+    """{name="value",...}: сначала постоянные метки процесса const - пары (имя, значение)"""
+    if not names and not const:
+        return ""
+    pairs = []
+    for name, value in tuple(const) + tuple(zip(names, values)):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self, const=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, label_values, const)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами: на наблюдение - bisect и два сложения"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label_values -> [счетчики по бакетам (+Inf последним), сумма]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, const=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.series.items())
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = format_labels(names, label_values + (format_value(bound),), const)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values, const)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Показатель, значения которого собираются при выдаче: collect() -> {label_values: значение}"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self, const=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            if value is None:
+                continue
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            lines.append(f"{self.name}{format_labels(self.labels, label_values, const)} {format_value(value)}")
+        return lines
+
+
+class CollectedCounter(Gauge):
+    """Счетчик, который ведется в другом месте (например, в статистике блокировок)
+    и читается при выдаче: collect() должен только расти"""
+
+    metric_type = "counter"
+
+
+class Telemetry:
+    """Операционные метрики процесса в текстовом формате Prometheus.
+
+    Без внешних зависимостей: счетчики и гистограммы копятся в памяти
+    воркера, показатели вычисляются в момент запроса /metrics. Каждая строка
+    помечена меткой worker (pid): за балансировщиком запросы /metrics попадают
+    в разные воркеры, и без нее их значения сливались бы в один ряд.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.local = threading.local()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, collect, labels=()):
+        return self.register(Gauge(name, help_text, collect, labels))
+
+    def collected_counter(self, name, help_text, collect, labels=()):
+        return self.register(CollectedCounter(name, help_text, collect, labels))
+
+    def start_request(self):
+        """Начать подсчет событий текущего запроса (в потоке запроса)"""
+        self.local.save_player_calls = 0
+
+    def note_save_player(self):
+        if getattr(self.local, "save_player_calls", None) is not None:
+            self.local.save_player_calls += 1
+
+    def finish_request(self):
+        """Число вызовов save_player за запрос (None - вне запроса)"""
+        calls = getattr(self.local, "save_player_calls", None)
+        self.local.save_player_calls = None
+        return calls
+
+    def render(self):
+        lines = []
+        # pid берется при выдаче: с preload_app приложение импортируется до fork воркеров
+        const = (("worker", os.getpid()),)
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render(const))
+            except Exception as e:
+                lines.append(f"# error collecting {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный экземпляр метрик процесса
+telemetry = Telemetry()
+
+# Метрики слоя хранения объявлены здесь, чтобы их могли писать database и app
+save_duration = telemetry.histogram(
+    "crypto_save_duration_seconds", "Duration of persisting players and P2P orders", ("kind",)
+)
+save_bytes = telemetry.histogram(
+    "crypto_save_bytes", "Bytes written when persisting players and P2P orders", ("kind",), BYTES_BUCKETS
+)
@@ -0,0 +1,78 @@
+import json
+import os
+
+
+def make_database(tmp_path, monkeypatch):
+    """Database с общим хранилищем во временном каталоге"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PLAYER_STORE", str(tmp_path / "players.db"))
+    from database import Database
+    return Database()
+
+
+def test_reload_in_store_mode_keeps_store_changes(tmp_path, monkeypatch):
+    db = make_database(tmp_path, monkeypatch)
+    db.save_player("alice", {"balance": 100.0, "portfolio": {}})
+    # Устаревший файл данных: в режиме хранилища его перечитывать нельзя
+    with open(os.path.join(tmp_path, db.data_file), "w", encoding="utf-8") as f:
+        json.dump({"alice": {"balance": 100.0, "portfolio": {}}}, f)
+
+    # Изменение через хранилище, как его сделал бы другой воркер
+    data, version = db.store.get("alice")
+    data["balance"] = 250.0
+    db.store.write_player("alice", data, version, ["balance"])
+
+    assert db.reload_async()
+    db.reload_thread.join(10)
+
+    assert db.reload_status["state"] == "done"
+    assert db.get_player_data("alice")["balance"] == 250.0
+    assert db.store.get("alice")[0]["balance"] == 250.0
+
+
+def test_save_player_recomputes_total_value(tmp_path, monkeypatch):
+    db = make_database(tmp_path, monkeypatch)
+    db.save_player("alice", {"balance": 100.0, "portfolio": {}, "current_prices": {"BTC": 50.0}})
+    player = db.get_player_data("alice")
+    player["portfolio"]["BTC"] = 2.0
+    player["balance"] = 0.0
+    db.save_player("alice", player, ["balance", "portfolio"])
+
+    assert db.get_player_data("alice")["total_value"] == 100.0
+    assert db.get_player_data("alice")["portfolio_value"] == 100.0
+
+
+def test_archive_skips_player_who_logged_in_again(tmp_path, monkeypatch):
+    from activity_index import ActivityIndex, archive_inactive_players
+    db = make_database(tmp_path, monkeypatch)
+    db.save_player("alice", {"balance": 1.0, "portfolio": {}, "last_login": "2020-01-01T00:00:00"})
+    db.save_player("bob", {"balance": 1.0, "portfolio": {}, "last_login": "2020-01-01T00:00:00"})
+    index = ActivityIndex()
+    index.attach(db)
+    # Вход после выборки из индекса: индекс еще считает alice неактивной
+    db.players["alice"]["last_login"] = "2100-01-01T00:00:00"
+
+    removed = archive_inactive_players(db, index, archive_dir=str(tmp_path / "archive"))
+
+    assert removed == 1
+    assert db.get_player_data("alice") is not None
+    assert db.get_player_data("bob") is None
+
+
+def test_swap_players_waits_for_in_flight_handler(tmp_path, monkeypatch):
+    import threading
+    from locks import player_locks
+    db = make_database(tmp_path, monkeypatch)
+    db.save_player("alice", {"balance": 1.0, "portfolio": {}})
+
+    swap = threading.Thread(target=db.swap_players, args=({"bob": {"balance": 2.0, "portfolio": {}}}, False))
+    # Обработчик держит блокировку alice: подмена не может пройти посреди изменения
+    with player_locks.hold("alice"):
+        swap.start()
+        swap.join(0.2)
+        assert swap.is_alive()
+        assert db.get_player_data("alice") is not None
+    swap.join(10)
+
+    assert db.get_player_data("alice") is None
+    assert db.get_player_data("bob")["balance"] == 2.0
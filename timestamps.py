@@ -0,0 +1,70 @@
+import time
+from datetime import datetime
+
+# Поля времени в записях игроков и ордеров. Внутри хранятся секунды epoch,
+# ISO строки - только в ответах API
+RECORD_TIME_FIELDS = ("created_at", "updated_at", "last_login", "timestamp")
+MINING_TIME_FIELDS = ("energy_updated_at", "last_mining_time")
+# Задачи пакетного майнинга: еще и время следующей попытки
+MINING_JOB_TIME_FIELDS = RECORD_TIME_FIELDS + ("next_due",)
+
+
+def now_ts():
+    """Текущее время в секундах epoch (с точностью до миллисекунд)"""
+    return round(time.time(), 3)
+
+
+def to_epoch(value):
+    """Секунды epoch из числа или ISO строки старого формата"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def to_iso(value):
+    """ISO строка для ответа API (не время - возвращается как есть)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value).isoformat()
+    return value
+
+
+def record_to_api(record, fields=RECORD_TIME_FIELDS):
+    """Копия записи (ордер, задание майнинга) с временем в ISO формате"""
+    result = dict(record)
+    for field in fields:
+        if field in result:
+            result[field] = to_iso(result[field])
+    return result
+
+
+def player_to_api(player):
+    """Копия игрока (или выбранных полей) с временем в ISO формате"""
+    result = record_to_api(player)
+    if isinstance(result.get("mining"), dict):
+        result["mining"] = record_to_api(result["mining"], MINING_TIME_FIELDS)
+    if isinstance(result.get("orders"), list):
+        result["orders"] = [record_to_api(order) for order in result["orders"]]
+    return result
+
+
+def migrate_record_times(record, fields=RECORD_TIME_FIELDS):
+    """Перевести ISO строки записи в секунды epoch. Возвращает True, если что-то изменилось"""
+    changed = False
+    for field in fields:
+        value = record.get(field)
+        if isinstance(value, str):
+            try:
+                record[field] = round(to_epoch(value), 3)
+            except ValueError:
+                continue
+            changed = True
+    return changed
+
+
+def migrate_player_times(player):
+    changed = migrate_record_times(player)
+    if isinstance(player.get("mining"), dict):
+        changed = migrate_record_times(player["mining"], MINING_TIME_FIELDS) or changed
+    for order in player.get("orders", []):
+        changed = migrate_record_times(order) or changed
+    return changed
@@ -0,0 +1,129 @@
+import json
+import threading
+
+from locks import player_locks
+from sqlite_store import Transaction, connect
+from timestamps import migrate_record_times
+
+# Сколько последних ордеров остается в записи игрока, остальные - только в журнале
+RECENT_ORDERS = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    order_id INTEGER,
+    symbol TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_by_user ON orders (user_id, seq);
+"""
+
+
+class TradeHistory:
+    """Журнал ордеров игроков, только дописывается.
+
+    Полная история хранится в SQLite (общий файл для всех воркеров), в
+    записи игрока остаются только RECENT_ORDERS последних ордеров, поэтому
+    размер записи и стоимость save_player не растут с числом сделок.
+    Страницы читаются от новых к старым, курсор - seq последней строки.
+    """
+
+    def __init__(self, path="trade_history.db"):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def append(self, user_id, order):
+        self.connection().execute(
+            "INSERT INTO orders (user_id, order_id, symbol, data) VALUES (?, ?, ?, ?)",
+            (user_id, order.get("id"), order.get("symbol"), json.dumps(order, ensure_ascii=False, sort_keys=True))
+        )
+
+    def next_order_id(self, player):
+        stats = player["stats"]
+        return stats.get("total_orders", len(player.get("orders", []))) + 1
+
+    def record(self, user_id, player, order):
+        """Записать ордер в журнал и оставить в записи игрока только последние ордера.
+
+        Вызывается под блокировкой игрока, поля orders и stats нужно сохранить.
+        """
+        self.ensure_migrated(user_id, player)
+        self.append(user_id, order)
+        recent = player.setdefault("orders", [])
+        recent.append(order)
+        del recent[:-RECENT_ORDERS]
+        player["stats"]["total_orders"] += 1
+
+    def ensure_migrated(self, user_id, player):
+        """Перенести в журнал ордера игрока старого формата (без stats.total_orders).
+
+        Уже записанные ордера (например, после восстановления из старого бэкапа)
+        не дублируются. Возвращает True, если запись игрока изменилась.
+        """
+        stats = player.setdefault("stats", {})
+        if "total_orders" in stats:
+            return False
+        orders = player.get("orders", [])
+        with Transaction(self.connection()) as conn:
+            for order in orders:
+                if not self.is_logged(conn, user_id, order):
+                    conn.execute(
+                        "INSERT INTO orders (user_id, order_id, symbol, data) VALUES (?, ?, ?, ?)",
+                        (user_id, order.get("id"), order.get("symbol"),
+                         json.dumps(order, ensure_ascii=False, sort_keys=True))
+                    )
+        stats["total_orders"] = len(orders)
+        player["orders"] = orders[-RECENT_ORDERS:]
+        return True
+
+    def is_logged(self, conn, user_id, order):
+        # Время в журнале может быть записано еще ISO строкой - сравниваем в epoch
+        rows = conn.execute(
+            "SELECT data FROM orders WHERE user_id = ? AND order_id IS ?", (user_id, order.get("id"))
+        ).fetchall()
+        for (data,) in rows:
+            logged = json.loads(data)
+            migrate_record_times(logged)
+            if logged == order:
+                return True
+        return False
+
+    def migrate_all(self, database):
+        """Перенести историю всех игроков старого формата (при запуске)"""
+        migrated = 0
+        for user_id in list(database.players):
+            with player_locks.hold(user_id):
+                player = database.get_player_data(user_id)
+                if player is not None and self.ensure_migrated(user_id, player):
+                    database.save_player(user_id, player, ["orders", "stats"])
+                    migrated += 1
+        if migrated:
+            print(f"♻️ Moved order history of {migrated} players to {self.path}")
+        return migrated
+
+    def page(self, user_id, limit=50, cursor=None, symbol=None):
+        """Ордера игрока от новых к старым: (ордера, next_cursor)"""
+        query = "SELECT seq, data FROM orders WHERE user_id = ?"
+        params = [user_id]
+        if cursor is not None:
+            query += " AND seq < ?"
+            params.append(int(cursor))
+        if symbol:
+            query += " AND symbol = ?"
+            params.append(symbol)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.connection().execute(query, params).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(data) for _, data in rows[:limit]], next_cursor
+